@@ -0,0 +1,121 @@
+"""Compare the OpenID extension handling of a login and a callback before
+and after prebuilding extension requests and decoding responses once.
+
+``login`` adds the AX and SReg requests of the generic OpenID provider to a
+new OpenID 2 message, building them per login (``before``) or reusing the
+:class:`velruse.providers.oid_extensions.PrebuiltExtension` objects of a
+consumer (``after``).
+
+``callback`` reads the profile attributes the way ``extract_openid_data``
+does, with a ``getSingle`` lookup and SReg fallback per attribute
+(``before``) or through the single-pass
+:class:`velruse.providers.openid.AttribAccess` (``after``).
+
+Usage::
+
+    python benchmarks/openid_extensions.py [iterations]
+
+"""
+import sys
+import time
+
+from openid.extensions import ax
+from openid.extensions import sreg
+from openid.message import Message
+from openid.message import OPENID2_NS
+
+from velruse.providers.openid import AttribAccess
+from velruse.providers.openid import OpenIDConsumer
+from velruse.providers.openid import attributes
+from velruse.providers.openid import trans_dict
+
+
+KEYS = ['email', 'nickname', 'name_prefix', 'first_name', 'middle_name',
+        'last_name', 'name_suffix', 'full_name', 'web', 'gender',
+        'birthday', 'thumbnail', 'email']
+
+
+class DummyAuthRequest(object):
+
+    def __init__(self):
+        self.message = Message(OPENID2_NS)
+
+    def addExtension(self, extension_request):
+        extension_request.toMessage(self.message)
+
+
+def login_before():
+    authrequest = DummyAuthRequest()
+    ax_request = ax.FetchRequest()
+    for attrib in attributes.values():
+        ax_request.add(ax.AttrInfo(attrib))
+    authrequest.addExtension(ax_request)
+    sreg_request = sreg.SRegRequest(
+        optional=['nickname', 'email', 'fullname', 'dob', 'gender',
+                  'postcode', 'country', 'language', 'timezone'],
+    )
+    authrequest.addExtension(sreg_request)
+
+
+def make_login_after():
+    consumer = OpenIDConsumer('openid')
+
+    def login_after():
+        consumer._add_extensions(DummyAuthRequest())
+    return login_after
+
+
+def responses():
+    ax_resp = ax.FetchResponse()
+    ax_resp.addValue(attributes['email'], 'jane@example.com')
+    ax_resp.addValue(attributes['first_name'], 'Jane')
+    ax_resp.addValue(attributes['last_name'], 'Doe')
+    ax_resp.addValue(attributes['gender'], 'F')
+    sreg_resp = sreg.SRegResponse({'nickname': 'jane', 'dob': '1980-01-02',
+                                   'fullname': 'Jane Doe'})
+    return sreg_resp, ax_resp
+
+
+def callback_before(sreg_resp, ax_resp):
+    for key in KEYS:
+        v = ax_resp.getSingle(attributes[key])
+        if v:
+            continue
+        key = trans_dict.get(key, key)
+        if key in sreg.data_fields:
+            sreg_resp.get(key)
+
+
+def callback_after(sreg_resp, ax_resp):
+    attribs = AttribAccess(sreg_resp, ax_resp)
+    for key in KEYS:
+        attribs.get(key)
+
+
+def measure(func, args, iterations):
+    func(*args)
+    start = time.time()
+    for i in range(iterations):
+        func(*args)
+    return (time.time() - start) / iterations
+
+
+def report(name, old, new):
+    print '%s before: %.1fus' % (name, old * 1e6)
+    print '%s after:  %.1fus' % (name, new * 1e6)
+    print '%s speedup: %.2fx' % (name, old / new)
+
+
+def main(argv=sys.argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 10000
+    report('login',
+           measure(login_before, (), iterations),
+           measure(make_login_after(), (), iterations))
+    args = responses()
+    report('callback',
+           measure(callback_before, args, iterations),
+           measure(callback_after, args, iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Compare the size and encoding cost of the login results kept for
+``auth_info`` with and without a ``result.serializer``.
+
+For a typical result of several providers, normalized by the providers'
+own extraction functions where they have one, report the bytes per entry
+a backend stores and the time to encode and decode it. Without a
+serializer the backend pickles the result itself (``pickle``); with one
+the backend pickles the serialized string. ``msgpack`` is only measured
+when it is installed.
+
+Usage::
+
+    python benchmarks/result_codecs.py [iterations]
+
+"""
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+import sys
+import time
+
+from velruse import serializers
+from velruse.providers.facebook import extract_fb_data
+from velruse.providers.live import extract_live_data
+from velruse.providers.vk import extract_normalize_vk_data
+
+
+def result(provider_type, profile, credentials):
+    return {
+        'provider_type': provider_type,
+        'provider_name': provider_type,
+        'profile': profile,
+        'credentials': credentials,
+    }
+
+
+def oauth2_credentials():
+    return {'oauthAccessToken': 'AAAC' + 'x' * 180,
+            'oauthExpiresIn': 5183999}
+
+
+def profiles():
+    facebook = extract_fb_data({
+        'id': '100001234567890', 'username': 'jane.doe',
+        'name': 'Jane Doe', 'first_name': 'Jane', 'last_name': 'Doe',
+        'email': 'jane.doe@example.com', 'gender': 'female',
+        'link': 'https://www.facebook.com/jane.doe',
+        'timezone': 2, 'locale': 'en_US', 'verified': True,
+        'updated_time': '2013-01-01T10:00:00+0000',
+    })
+    facebook.pop('birthday', None)
+    vk = extract_normalize_vk_data({
+        'uid': 1234567, 'first_name': u'\u0418\u0432\u0430\u043d',
+        'last_name': u'\u041f\u0435\u0442\u0440\u043e\u0432',
+        'nickname': 'ivan', 'sex': 2,
+        'photo': 'http://cs301.vk.me/u1234567/e_1a2b3c4d.jpg',
+        'photo_medium': 'http://cs301.vk.me/u1234567/b_1a2b3c4d.jpg',
+        'photo_big': 'http://cs301.vk.me/u1234567/a_1a2b3c4d.jpg',
+        'photo_rec': 'http://cs301.vk.me/u1234567/d_1a2b3c4d.jpg',
+        'mobile_phone': '+7 912 345 67 89', 'home_phone': '+7 495 123 45 67',
+    })
+    live = extract_live_data({
+        'id': '8c8ce076ca27823f', 'name': 'Jane Doe',
+        'first_name': 'Jane', 'last_name': 'Doe', 'gender': 'female',
+        'updated_time': '2013-01-01T10:00:00+0000',
+        'link': 'https://profile.live.com/cid-8c8ce076ca27823f/',
+        'emails': {'preferred': 'jane@example.com',
+                   'account': 'jane@example.com',
+                   'personal': 'jane.doe@example.net',
+                   'business': 'jane@example.org'},
+    })
+    github = {
+        'accounts': [{'domain': 'github.com', 'username': 'janedoe',
+                      'userid': 583231}],
+        'displayName': 'Jane Doe', 'preferredUsername': 'janedoe',
+        'emails': [{'value': 'jane@example.com'}],
+    }
+    twitter = {
+        'accounts': [{'domain': 'twitter.com', 'userid': '783214'}],
+        'displayName': 'janedoe', 'preferredUsername': 'janedoe',
+        'photos': [{'value': 'https://pbs.twimg.com/profile_images/'
+                             '1234567890/avatar_normal.png'}],
+    }
+    openid = {
+        'accounts': [{'domain': 'google.com',
+                      'username': 'https://www.google.com/accounts/o8/id'
+                                  '?id=AItOawmL2JbOJZXPIVNsZ8XWJk0rQxMW'}],
+        'displayName': 'Jane Doe', 'verifiedEmail': 'jane@example.com',
+        'emails': [{'value': 'jane@example.com'}],
+        'name': {'givenName': 'Jane', 'familyName': 'Doe',
+                 'formatted': 'Jane Doe'},
+    }
+    return {
+        'facebook': result('facebook', facebook, oauth2_credentials()),
+        'github': result('github', github, oauth2_credentials()),
+        'google': result('google', openid, {}),
+        'live': result('live', live, oauth2_credentials()),
+        'twitter': result('twitter', twitter, {
+            'oauthAccessToken': '783214-' + 'x' * 43,
+            'oauthAccessTokenSecret': 'y' * 43}),
+        'vk': result('vk', vk, oauth2_credentials()),
+    }
+
+
+class BackendPickle(object):
+    """What a backend does with a result when no serializer is set"""
+
+    def dumps(self, appstruct):
+        return pickle.dumps(appstruct, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, bstruct):
+        return pickle.loads(bstruct)
+
+
+class Stored(object):
+    """A serializer whose output is then pickled by the backend"""
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def dumps(self, appstruct):
+        return pickle.dumps(self.serializer.dumps(appstruct),
+                            pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, bstruct):
+        return self.serializer.loads(pickle.loads(bstruct))
+
+
+def codecs():
+    found = [('pickle', BackendPickle())]
+    names = ['json']
+    if serializers.msgpack is not None:
+        names.append('msgpack')
+    for name in names:
+        serializer = serializers.serializers[name]()
+        found.append((name, Stored(serializer)))
+        found.append((name + '+zlib', Stored(
+            serializers.CompressingSerializer(serializer, threshold=0))))
+    return found
+
+
+def measure(func, arg, iterations):
+    func(arg)
+    start = time.time()
+    for i in range(iterations):
+        func(arg)
+    return (time.time() - start) / iterations
+
+
+def main(argv=sys.argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 10000
+    print '%-10s %-14s %6s %9s %9s' % (
+        'provider', 'serializer', 'bytes', 'encode', 'decode')
+    for provider, data in sorted(profiles().items()):
+        for label, codec in codecs():
+            stored = codec.dumps(data)
+            print '%-10s %-14s %6d %7.1fus %7.1fus' % (
+                provider, label, len(stored),
+                measure(codec.dumps, data, iterations) * 1e6,
+                measure(codec.loads, stored, iterations) * 1e6)
+
+
+if __name__ == '__main__':
+    main()
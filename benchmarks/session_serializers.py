@@ -0,0 +1,142 @@
+"""Compare the session cookie of each kind of provider login, as produced
+by Pyramid's pickle-based ``UnencryptedCookieSessionFactoryConfig`` and by
+``SignedCookieSessionFactory`` with the serializers of
+:mod:`velruse.serializers`.
+
+For every provider family (OAuth2 ``state``, OAuth1 request token, OpenID
+consumer session) the session a login leaves behind is encoded into a
+cookie value and decoded again, reporting the cookie size and the time
+taken by each step. ``msgpack`` is only measured when it is installed.
+
+Usage::
+
+    python benchmarks/session_serializers.py [iterations]
+
+"""
+import sys
+import time
+import uuid
+
+from openid.consumer.discover import OPENID_2_0_TYPE
+from openid.consumer.discover import OpenIDServiceEndpoint
+from openid.extensions import ax
+from openid.extensions import sreg
+from openid.yadis.manager import YadisServiceManager
+from pyramid.session import signed_deserialize
+from pyramid.session import signed_serialize
+from webob.cookies import SignedSerializer
+
+from velruse import serializers
+
+
+SECRET = 'a' * 64
+
+PROVIDERS = {
+    'bitbucket': 'oauth1',
+    'douban': 'oauth1',
+    'linkedin': 'oauth1',
+    'twitter': 'oauth1',
+    'facebook': 'oauth2',
+    'github': 'oauth2',
+    'google_oauth2': 'oauth2',
+    'mailru': 'oauth2',
+    'vk': 'oauth2',
+    'weibo': 'oauth2',
+    'yandex': 'oauth2',
+    'google': 'openid',
+    'openid': 'openid',
+    'yahoo': 'openid',
+}
+
+
+def openid_session():
+    endpoint = OpenIDServiceEndpoint.fromOPEndpointURL(
+        'https://www.google.com/accounts/o8/ud')
+    endpoint.type_uris = [OPENID_2_0_TYPE, ax.AXMessage.ns_uri,
+                          sreg.ns_uri_1_1,
+                          'http://specs.openid.net/extensions/ui/1.0/mode'
+                          '/popup']
+    endpoint.claimed_id = 'http://specs.openid.net/auth/2.0/' \
+                          'identifier_select'
+    endpoint.local_id = endpoint.claimed_id
+    manager = YadisServiceManager(
+        'https://www.google.com/accounts/o8/id',
+        'https://www.google.com/accounts/o8/id', [],
+        '_openid_consumer_')
+    manager._current = endpoint
+    return {
+        'openid_session': {
+            '_openid_consumer_last_token': endpoint,
+            '_yadis_services__openid_consumer_': manager,
+        },
+    }
+
+
+STATES = {
+    'oauth1': {'token': 'oauth_token=%s&oauth_token_secret=%s'
+                        '&oauth_callback_confirmed=true'
+                        % ('N' * 43, 'S' * 43)},
+    'oauth2': {'state': uuid.uuid4().hex},
+    'openid': openid_session(),
+}
+
+
+class PickleCookie(object):
+    """The current ``UnencryptedCookieSessionFactoryConfig`` encoding"""
+
+    def dumps(self, appstruct):
+        return signed_serialize(appstruct, SECRET)
+
+    def loads(self, bstruct):
+        return signed_deserialize(bstruct, SECRET)
+
+
+def codecs():
+    found = [('pickle', PickleCookie())]
+    names = ['json']
+    if serializers.msgpack is not None:
+        names.append('msgpack')
+    for name in names:
+        serializer = serializers.serializers[name]()
+        for label, value in ((name, serializer),
+                             (name + '+zlib',
+                              serializers.CompressingSerializer(serializer,
+                                                                threshold=0))):
+            found.append((label, SignedSerializer(
+                SECRET, 'velruse.session.', 'sha256', serializer=value)))
+    return found
+
+
+def measure(func, arg, iterations):
+    func(arg)
+    start = time.time()
+    for i in range(iterations):
+        func(arg)
+    return (time.time() - start) / iterations
+
+
+def main(argv=sys.argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 10000
+    now = time.time()
+    results = {}
+    for family, state in sorted(STATES.items()):
+        # pyramid's cookie sessions keep (accessed, created, state)
+        appstruct = (now, now, state)
+        for label, codec in codecs():
+            cookie = codec.dumps(appstruct)
+            results[family, label] = (
+                len(cookie),
+                measure(codec.dumps, appstruct, iterations),
+                measure(codec.loads, cookie, iterations))
+
+    print '%-14s %-8s %-14s %6s %9s %9s' % (
+        'provider', 'family', 'serializer', 'bytes', 'encode', 'decode')
+    for provider, family in sorted(PROVIDERS.items()):
+        for label, codec in codecs():
+            size, encode, decode = results[family, label]
+            print '%-14s %-8s %-14s %6d %7.1fus %7.1fus' % (
+                provider, family, label, size, encode * 1e6, decode * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,18 @@ testing_extras = [
     'selenium',
 ]
 
+async_extras = [
+    'tornado',
+]
+
+msgpack_extras = [
+    'msgpack',
+]
+
+state_extras = [
+    'cryptography',
+]
+
 docs_extras = [
     'Sphinx',
     'docutils',
@@ -47,8 +59,12 @@ setup(name='velruse',
       zip_safe=False,
       install_requires=requires,
       extras_require={
+          'async': async_extras,
           'docs': docs_extras,
+          'msgpack': msgpack_extras,
+          'state': state_extras,
           'testing': testing_extras,
+          'tornado': async_extras,
       },
       entry_points="""
       [paste.app_factory]
@@ -0,0 +1,122 @@
+import unittest2 as unittest
+
+try:
+    import tornado
+except ImportError:  # pragma: no cover
+    tornado = None
+
+
+class DummyClient(object):
+    """Answer fetches at once, streaming ``chunks`` to the request"""
+
+    def __init__(self, chunks, code=200):
+        self.chunks = chunks
+        self.code = code
+        self.requests = []
+
+    def fetch(self, request, callback):
+        from tornado.httpclient import HTTPResponse
+        from tornado.httputil import HTTPHeaders
+        self.requests.append(request)
+        error = None
+        try:
+            for chunk in self.chunks:
+                request.streaming_callback(chunk)
+        except Exception as e:
+            error = e
+        code = self.code if error is None else 599
+        callback(HTTPResponse(request, code, headers=HTTPHeaders(),
+                              error=error))
+
+
+class DummyProvider(object):
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def callback_flow(self, request):
+        from velruse.transport import Call
+        token = yield Call('POST', 'http://a/token', phase='access_token',
+                           data={'code': request})
+        profile = yield Call('GET', 'http://a/me', phase='profile')
+        yield (token.content, profile.content)
+
+
+@unittest.skipIf(tornado is None, 'tornado is not installed')
+class TestRunFlow(unittest.TestCase):
+
+    def _callFUT(self, flow, client, transport=None):
+        from velruse.aio import run_flow
+        return run_flow(flow, client, transport)
+
+    def _makeTransport(self, **kw):
+        from velruse.transport import Transport
+        return Transport(name='dummy', **kw)
+
+    def test_result(self):
+        from velruse.aio import callback
+        client = DummyClient(['ab', 'c'])
+        transport = self._makeTransport(timeout=7)
+        future = callback(DummyProvider(transport), 'xyz', client)
+        self.assertEqual(future.result(), ('abc', 'abc'))
+        token, profile = client.requests
+        self.assertEqual(token.method, 'POST')
+        self.assertEqual(token.body, 'code=xyz')
+        self.assertEqual(profile.request_timeout, 7)
+
+    def test_transport_max_size(self):
+        from velruse.exceptions import ResponseTooLarge
+        transport = self._makeTransport(
+            max_response_sizes={'access_token': 2})
+        flow = DummyProvider(transport).callback_flow('xyz')
+        future = self._callFUT(flow, DummyClient(['ab', 'c']), transport)
+        try:
+            future.result()
+        except ResponseTooLarge as e:
+            self.assertEqual((e.phase, e.limit), ('access_token', 2))
+        else:
+            self.fail('ResponseTooLarge not raised')
+
+    def test_default_max_size(self):
+        flow = DummyProvider(None).callback_flow('xyz')
+        future = self._callFUT(flow, DummyClient(['x' * 1000]))
+        self.assertEqual(future.result(), ('x' * 1000, 'x' * 1000))
+
+    def test_failure(self):
+        from velruse.exceptions import ThirdPartyFailure
+        client = DummyClient([])
+        client.code = 599
+        flow = DummyProvider(None).callback_flow('xyz')
+        future = self._callFUT(flow, client)
+        self.assertRaises(ThirdPartyFailure, future.result)
+
+    def test_breaker(self):
+        from velruse.exceptions import CircuitOpen
+        transport = self._makeTransport(breaker={'minimum_calls': 1,
+                                                 'failure_rate': 0.5})
+        client = DummyClient([], code=503)
+        flow = DummyProvider(transport).callback_flow('xyz')
+        future = self._callFUT(flow, client, transport)
+        # the failed token call opens the circuit before the profile call
+        self.assertRaises(CircuitOpen, future.result)
+        self.assertEqual(len(client.requests), 1)
+        flow = DummyProvider(transport).callback_flow('xyz')
+        future = self._callFUT(flow, client, transport)
+        self.assertRaises(CircuitOpen, future.result)
+        self.assertEqual(len(client.requests), 1)
+
+
+@unittest.skipIf(tornado is None, 'tornado is not installed')
+class TestConfigureClient(unittest.TestCase):
+
+    def tearDown(self):
+        from tornado.httpclient import AsyncHTTPClient
+        AsyncHTTPClient.configure(None)
+
+    def test_max_clients_setting(self):
+        from tornado.httpclient import AsyncHTTPClient
+        from velruse.aio import configure_client
+        configure_client(settings={'aio.max_clients': '200'})
+        client = AsyncHTTPClient(force_instance=True)
+        self.assertEqual(client.max_clients, 200)
+        client.close()
@@ -0,0 +1,68 @@
+import unittest2 as unittest
+
+from pyramid import testing
+
+
+class DummyProvider(object):
+    pass
+
+
+class DummyOAuth1Provider(object):
+    saves_request_token = True
+
+
+class TestRegisterProvider(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp(settings={
+            'provider.facebook.timeout': '9',
+            'provider.work.timeout': '5',
+            'provider.work.retries': '2',
+            'provider.work.state_secret': 'secret',
+        })
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, name, provider):
+        from velruse.api import register_provider
+        register_provider(self.config, name, provider)
+        self.config.commit()
+
+    def test_settings_of_registered_name(self):
+        from velruse.state import SignedState
+        provider = DummyProvider()
+        self._callFUT('work', provider)
+        registry = self.config.registry
+        self.assertTrue(registry.velruse_providers['work'] is provider)
+        self.assertTrue(registry.velruse_transports['work'] is
+                        provider.transport)
+        self.assertEqual(provider.transport.name, 'work')
+        self.assertEqual(provider.transport.timeout, 5)
+        self.assertEqual(provider.transport.retries, 2)
+        self.assertTrue(isinstance(provider.signed_state, SignedState))
+
+    def test_defaults(self):
+        provider = DummyProvider()
+        self._callFUT('other', provider)
+        self.assertEqual(provider.transport.timeout, None)
+        self.assertFalse(hasattr(provider, 'signed_state'))
+
+    def test_plaintext_request_tokens_refused(self):
+        from pyramid.exceptions import ConfigurationError
+        from velruse.api import register_provider
+        self.assertRaises(ConfigurationError, register_provider, self.config,
+                          'work', DummyOAuth1Provider())
+        self.assertFalse(hasattr(self.config.registry, 'velruse_providers'))
+
+    def test_encrypted_request_tokens(self):
+        self.config.registry.settings['provider.work.state_encrypt'] = 'true'
+        provider = DummyOAuth1Provider()
+        self._callFUT('work', provider)
+        self.assertTrue(provider.signed_state.encrypted)
+
+    def test_twitter_refused(self):
+        from pyramid.exceptions import ConfigurationError
+        from velruse.providers.twitter import add_twitter_login
+        self.assertRaises(ConfigurationError, add_twitter_login, self.config,
+                          'key', 'secret', name='work')
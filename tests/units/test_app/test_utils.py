@@ -0,0 +1,86 @@
+import unittest2 as unittest
+
+
+class DummyPipeline(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.commands = []
+
+    def get(self, key):
+        self.commands.append(('get', key))
+        return self
+
+    def delete(self, key):
+        self.commands.append(('delete', key))
+        return self
+
+    def execute(self):
+        results = []
+        for command, key in self.commands:
+            if command == 'get':
+                results.append(self.data.get(key))
+            else:
+                results.append(int(self.data.pop(key, None) is not None))
+        return results
+
+
+class DummyConnection(object):
+
+    def __init__(self):
+        self.data = {}
+        self.pipelines = []
+
+    def pipeline(self, transaction=True):
+        pipe = DummyPipeline(self.data)
+        self.pipelines.append(pipe)
+        return pipe
+
+
+class TestConsume(unittest.TestCase):
+
+    def _callFUT(self, storage, key):
+        from velruse.app.utils import consume
+        return consume(storage, key)
+
+    def test_memory(self):
+        from anykeystore.backends.memory import MemoryStore
+        storage = MemoryStore()
+        storage.store('token', {'a': 1}, expires=300)
+        self.assertEqual(self._callFUT(storage, 'token'), {'a': 1})
+        self.assertRaises(KeyError, storage.retrieve, 'token')
+        self.assertRaises(KeyError, self._callFUT, storage, 'token')
+
+    def test_memory_expired(self):
+        from datetime import datetime
+        from anykeystore.backends.memory import MemoryStore
+        storage = MemoryStore()
+        storage._store['token'] = ({'a': 1}, datetime(2000, 1, 1))
+        self.assertRaises(KeyError, self._callFUT, storage, 'token')
+        self.assertFalse(storage._store)
+
+    def test_redis(self):
+        from anykeystore.backends.redis import RedisStore
+        from anykeystore.compat import pickle
+        conn = DummyConnection()
+        storage = RedisStore(key_prefix='p.')
+        storage._get_conn = lambda: conn
+        conn.data['p.token'] = pickle.dumps({'a': 1})
+        self.assertEqual(self._callFUT(storage, 'token'), {'a': 1})
+        self.assertEqual(conn.data, {})
+        self.assertEqual(conn.pipelines[0].commands,
+                         [('get', 'p.token'), ('delete', 'p.token')])
+        self.assertRaises(KeyError, self._callFUT, storage, 'token')
+
+    def test_fallback(self):
+        from anykeystore.backends.memory import MemoryStore
+
+        class OtherStore(object):
+            def __init__(self):
+                self.store = MemoryStore()
+                self.retrieve = self.store.retrieve
+                self.delete = self.store.delete
+        storage = OtherStore()
+        storage.store.store('token', 'value')
+        self.assertEqual(self._callFUT(storage, 'token'), 'value')
+        self.assertRaises(KeyError, self._callFUT, storage, 'token')
@@ -0,0 +1,63 @@
+import unittest2 as unittest
+
+from pyramid import testing
+
+
+class DummyContext(object):
+    provider_type = 'dummy'
+    provider_name = 'dummy'
+    profile = {'displayName': 'Jane'}
+    credentials = {'oauthAccessToken': 'token'}
+
+
+class TestResultViews(unittest.TestCase):
+
+    def setUp(self):
+        from velruse.memstore import BoundedMemoryStore
+        self.config = testing.setUp(settings={'endpoint': 'http://a/'})
+        self.store = BoundedMemoryStore()
+        self.config.registry.velruse_store = self.store
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _complete(self):
+        import re
+        from velruse.app import auth_complete_view
+        request = testing.DummyRequest()
+        response = auth_complete_view(DummyContext(), request)
+        return re.search('name="token" value="([^"]+)"',
+                         response.body).group(1)
+
+    def _info(self, token):
+        from velruse.app import auth_info_view
+        request = testing.DummyRequest(params={'token': token})
+        return auth_info_view(request), request
+
+    def test_plain(self):
+        token = self._complete()
+        self.assertTrue(isinstance(self.store.retrieve(token), dict))
+        result, request = self._info(token)
+        self.assertEqual(result['profile'], {'displayName': 'Jane'})
+
+    def test_serializer(self):
+        from velruse.serializers import CompressingSerializer
+        from velruse.serializers import JSONSerializer
+        self.config.registry.velruse_result_serializer = \
+            CompressingSerializer(JSONSerializer(), threshold=10)
+        token = self._complete()
+        self.assertEqual(self.store.retrieve(token)[0], 'z')
+        result, request = self._info(token)
+        self.assertEqual(result['credentials'],
+                         {'oauthAccessToken': 'token'})
+
+    def test_ttl_and_consume(self):
+        self.config.registry.settings['result.ttl'] = '60'
+        self.config.registry.settings['result.consume'] = 'true'
+        token = self._complete()
+        self.assertEqual(len(self.store.slots), 1)
+        result, request = self._info(token)
+        self.assertEqual(result['provider_type'], 'dummy')
+        result, request = self._info(token)
+        self.assertEqual(result, None)
+        self.assertEqual(request.response.status_int, 400)
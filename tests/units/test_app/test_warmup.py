@@ -0,0 +1,83 @@
+import unittest2 as unittest
+
+from pyramid import testing
+
+
+class DummyProvider(object):
+    upstream_urls = ('https://graph.facebook.com/oauth/access_token',)
+
+
+class TestSetupWarmup(unittest.TestCase):
+
+    def setUp(self):
+        from velruse import dnscache
+        self.dnscache = dnscache
+        self.config = testing.setUp(settings={'dns_cache': 'true',
+                                              'dns_cache.ttl': '60'})
+
+    def tearDown(self):
+        testing.tearDown()
+        if self.dnscache._dns_cache is not None:
+            self.dnscache._dns_cache.uninstall()
+            self.dnscache._dns_cache = None
+
+    def _callFUT(self):
+        from velruse.app import setup_warmup
+        setup_warmup(self.config)
+
+    def test_no_providers(self):
+        self._callFUT()
+        self.assertEqual(self.dnscache._dns_cache.hosts, set())
+        self.assertEqual(self.dnscache._dns_cache.ttl, 60)
+
+    def test_provider_hosts(self):
+        self.config.registry.velruse_providers = {'facebook': DummyProvider()}
+        self._callFUT()
+        self.assertEqual(self.dnscache._dns_cache.hosts,
+                         set(['graph.facebook.com']))
+
+
+class DummyTransport(object):
+
+    def __init__(self):
+        self.preconnected = []
+
+    def preconnect(self, url, timeout=None):
+        self.preconnected.append(url)
+
+
+class DummyRegistry(object):
+
+    def __init__(self, providers, transports):
+        self.velruse_providers = providers
+        self.velruse_transports = transports
+
+
+class LocalProvider(object):
+    upstream_urls = ('http://localhost/token',)
+
+
+class TestWarmUp(unittest.TestCase):
+
+    def _callFUT(self, registry, **kw):
+        from velruse.warmup import warm_up
+        return warm_up(registry, **kw)
+
+    def _makeRegistry(self):
+        self.transport = DummyTransport()
+        return DummyRegistry({'local': LocalProvider()},
+                             {'local': self.transport})
+
+    def test_connects(self):
+        results = self._callFUT(self._makeRegistry())
+        self.assertEqual(self.transport.preconnected, ['http://localhost/'])
+        stats = results[('local', 'http://localhost/')]
+        self.assertNotEqual(stats['connect'], None)
+
+    def test_resolve_only(self):
+        results = self._callFUT(self._makeRegistry(), connect=False)
+        self.assertEqual(self.transport.preconnected, [])
+        stats = results[('local', 'http://localhost/')]
+        self.assertEqual(stats['error'], None)
+        self.assertNotEqual(stats['dns'], None)
+        self.assertEqual(stats['connect'], None)
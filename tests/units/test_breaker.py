@@ -0,0 +1,73 @@
+import unittest2 as unittest
+
+
+class DummyClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.breaker import CircuitBreaker
+        self.clock = DummyClock()
+        kw.setdefault('minimum_calls', 4)
+        kw.setdefault('failure_rate', 0.5)
+        kw.setdefault('reset_timeout', 10)
+        return CircuitBreaker(name='test', clock=self.clock, **kw)
+
+    def _fail(self, breaker, count):
+        for i in range(count):
+            breaker.before_call()
+            breaker.record(False)
+
+    def test_stays_closed_below_minimum_calls(self):
+        breaker = self._makeOne()
+        self._fail(breaker, 3)
+        self.assertEqual(breaker.state, 'closed')
+        breaker.before_call()
+
+    def test_opens_on_failure_rate(self):
+        from velruse.exceptions import CircuitOpen
+        from velruse.exceptions import ThirdPartyFailure
+        breaker = self._makeOne()
+        breaker.before_call()
+        breaker.record(True)
+        self._fail(breaker, 3)
+        self.assertEqual(breaker.state, 'open')
+        self.assertRaises(CircuitOpen, breaker.before_call)
+        self.assertTrue(issubclass(CircuitOpen, ThirdPartyFailure))
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = self._makeOne(slow_call=1.0)
+        for i in range(4):
+            breaker.before_call()
+            breaker.record(True, duration=2.0)
+        self.assertEqual(breaker.state, 'open')
+
+    def test_half_open_probe_closes(self):
+        from velruse.exceptions import CircuitOpen
+        breaker = self._makeOne()
+        self._fail(breaker, 4)
+        self.clock.now += 11
+        breaker.before_call()
+        self.assertEqual(breaker.state, 'half-open')
+        # only one probe is let through at a time
+        self.assertRaises(CircuitOpen, breaker.before_call)
+        breaker.record(True)
+        self.assertEqual(breaker.state, 'closed')
+        breaker.before_call()
+
+    def test_half_open_probe_failure_reopens(self):
+        from velruse.exceptions import CircuitOpen
+        breaker = self._makeOne()
+        self._fail(breaker, 4)
+        self.clock.now += 11
+        breaker.before_call()
+        breaker.record(False)
+        self.assertEqual(breaker.state, 'open')
+        self.assertRaises(CircuitOpen, breaker.before_call)
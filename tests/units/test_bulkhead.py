@@ -0,0 +1,46 @@
+import threading
+
+import unittest2 as unittest
+
+
+class TestBulkhead(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.bulkhead import Bulkhead
+        return Bulkhead(name='test', **kw)
+
+    def test_rejects_when_full(self):
+        from velruse.exceptions import BulkheadFull
+        from velruse.exceptions import ThirdPartyFailure
+        bulkhead = self._makeOne(max_concurrent=2)
+        bulkhead.acquire()
+        bulkhead.acquire()
+        self.assertRaises(BulkheadFull, bulkhead.acquire)
+        self.assertEqual(bulkhead.rejected, 1)
+        self.assertTrue(issubclass(BulkheadFull, ThirdPartyFailure))
+        bulkhead.release()
+        bulkhead.acquire()
+
+    def test_waiting_times_out(self):
+        from velruse.exceptions import BulkheadFull
+        bulkhead = self._makeOne(max_concurrent=1, max_waiting=1,
+                                 wait_timeout=0.01)
+        bulkhead.acquire()
+        self.assertRaises(BulkheadFull, bulkhead.acquire)
+        self.assertEqual(bulkhead.waiting, 0)
+
+    def test_waiter_gets_released_slot(self):
+        bulkhead = self._makeOne(max_concurrent=1, max_waiting=1)
+        bulkhead.acquire()
+        acquired = []
+
+        def wait():
+            bulkhead.acquire(timeout=5)
+            acquired.append(True)
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        bulkhead.release()
+        thread.join(5)
+        self.assertEqual(acquired, [True])
+        self.assertEqual(bulkhead.active, 1)
@@ -0,0 +1,53 @@
+import unittest2 as unittest
+
+
+class DummyResponse(object):
+
+    def __init__(self, content):
+        self.content = content
+
+
+class TestJSONBody(unittest.TestCase):
+
+    def _callFUT(self, content):
+        from velruse.decoding import json_body
+        return json_body(DummyResponse(content))
+
+    def test_decodes_json(self):
+        self.assertEqual(self._callFUT(' {"id": 1}\n'), {'id': 1})
+
+    def test_malformed(self):
+        from velruse.exceptions import MalformedResponse
+        self.assertRaises(MalformedResponse, self._callFUT, '<html>')
+        self.assertRaises(MalformedResponse, self._callFUT, '{"id": 1} x')
+
+
+class TestJSONPBody(unittest.TestCase):
+
+    def _callFUT(self, content):
+        from velruse.decoding import jsonp_body
+        return jsonp_body(DummyResponse(content))
+
+    def test_decodes_padding(self):
+        self.assertEqual(
+            self._callFUT('callback( {"openid": "ABC"} );\n'),
+            {'openid': 'ABC'})
+
+    def test_not_jsonp(self):
+        from velruse.exceptions import MalformedResponse
+        self.assertRaises(MalformedResponse, self._callFUT, '{"openid": 1}')
+
+
+class TestFormBody(unittest.TestCase):
+
+    def _callFUT(self, content):
+        from velruse.decoding import form_body
+        return form_body(DummyResponse(content))
+
+    def test_decodes_form(self):
+        self.assertEqual(self._callFUT('access_token=abc&expires=10'),
+                         {'access_token': ['abc'], 'expires': ['10']})
+
+    def test_empty(self):
+        from velruse.exceptions import MalformedResponse
+        self.assertRaises(MalformedResponse, self._callFUT, '')
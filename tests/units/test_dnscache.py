@@ -0,0 +1,106 @@
+import unittest2 as unittest
+
+
+class TestDNSCache(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse import dnscache
+        self.now = 1000.0
+        self.lookups = []
+        cache = dnscache.DNSCache(clock=lambda: self.now, **kw)
+        cache._getaddrinfo = self._getaddrinfo
+        cache.record_ttl = lambda host: 60
+        return cache
+
+    def _getaddrinfo(self, host, port, *args):
+        self.lookups.append(host)
+        return [(host, port, len(self.lookups))]
+
+    def test_unknown_hosts_are_not_cached(self):
+        cache = self._makeOne()
+        cache.getaddrinfo('example.com', 443)
+        cache.getaddrinfo('example.com', 443)
+        self.assertEqual(self.lookups, ['example.com', 'example.com'])
+
+    def test_known_hosts_are_cached_until_expired(self):
+        cache = self._makeOne()
+        cache.add_host('graph.facebook.com')
+        first = cache.getaddrinfo('graph.facebook.com', 443)
+        self.assertEqual(cache.getaddrinfo('graph.facebook.com', 443), first)
+        self.assertEqual(len(self.lookups), 1)
+        self.now += 61
+        self.assertNotEqual(cache.getaddrinfo('graph.facebook.com', 443),
+                            first)
+        self.assertEqual(len(self.lookups), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_lock_not_held_while_looking_up_ttl(self):
+        cache = self._makeOne()
+        cache.add_host('graph.facebook.com')
+        held = []
+
+        def record_ttl(host):
+            held.append(cache.lock.locked())
+            return 60
+        cache.record_ttl = record_ttl
+        cache.getaddrinfo('graph.facebook.com', 443)
+        self.assertEqual(held, [False])
+        self.assertFalse(cache.lock.locked())
+
+
+class DummyAnswer(object):
+
+    def __init__(self, ttl):
+        self.rrset = self
+        self.ttl = ttl
+
+
+class DummyResolver(object):
+
+    def __init__(self, result):
+        self.result = result
+        self.queries = []
+
+    def query(self, host, rdtype, lifetime=None):
+        self.queries.append((host, rdtype, lifetime))
+        if isinstance(self.result, Exception):
+            raise self.result
+        return DummyAnswer(self.result)
+
+
+class TestRecordTTL(unittest.TestCase):
+
+    def setUp(self):
+        from velruse import dnscache
+        self.module = dnscache
+        self._original = dnscache.dns
+
+    def tearDown(self):
+        self.module.dns = self._original
+
+    def _makeOne(self, result, **kw):
+        resolver = DummyResolver(result)
+        self.module.dns = type('dns', (object,), {'resolver': resolver})
+        self.now = 1000.0
+        return self.module.DNSCache(clock=lambda: self.now, **kw), resolver
+
+    def test_record_ttl_cached(self):
+        cache, resolver = self._makeOne(120, lookup_timeout=0.5)
+        self.assertEqual(cache.record_ttl('a.example.com'), 120)
+        self.now += 20
+        self.assertEqual(cache.record_ttl('a.example.com'), 100)
+        self.assertEqual(resolver.queries, [('a.example.com', 'A', 0.5)])
+        self.now += 101
+        cache.record_ttl('a.example.com')
+        self.assertEqual(len(resolver.queries), 2)
+
+    def test_clamped(self):
+        cache, resolver = self._makeOne(5, min_ttl=30)
+        self.assertEqual(cache.record_ttl('a.example.com'), 30)
+
+    def test_timeout_falls_back(self):
+        cache, resolver = self._makeOne(Exception('timed out'), ttl=90)
+        self.assertEqual(cache.record_ttl('a.example.com'), 90)
+        self.assertEqual(cache.record_ttl('a.example.com'), 90)
+        self.assertEqual(len(resolver.queries), 1)
+        self.assertEqual(resolver.queries[0][2], 1.0)
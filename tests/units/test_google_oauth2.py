@@ -0,0 +1,138 @@
+import base64
+import json
+
+import unittest2 as unittest
+
+from pyramid import testing
+
+
+def make_id_token(claims):
+    payload = base64.urlsafe_b64encode(json.dumps(claims)).rstrip('=')
+    return 'eyJhbGciOiJSUzI1NiJ9.%s.signature' % payload
+
+
+class DummyResponse(object):
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+
+class DummySession(object):
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kw):
+        self.calls.append((method, url))
+        return self.responses.pop(0)
+
+
+USERINFO = json.dumps({'id': '1234', 'email': 'jane@example.com',
+                       'name': 'Jane Doe'})
+
+
+class TestIdTokenClaims(unittest.TestCase):
+
+    def _callFUT(self, id_token):
+        from velruse.providers.google_oauth2 import id_token_claims
+        return id_token_claims(id_token)
+
+    def test_claims(self):
+        claims = {'sub': '1234', 'email': 'jane@example.com'}
+        self.assertEqual(self._callFUT(make_id_token(claims)), claims)
+
+    def test_missing(self):
+        self.assertEqual(self._callFUT(None), {})
+
+    def test_malformed(self):
+        self.assertEqual(self._callFUT('not-a-jwt'), {})
+        self.assertEqual(self._callFUT('a.!!!.c'), {})
+        self.assertEqual(self._callFUT('a.%s.c' % base64.urlsafe_b64encode(
+            '{"sub": ')), {})
+        self.assertEqual(self._callFUT(u'a.\xe9t\xe9.c'), {})
+
+
+class TestGoogleOAuth2Callback(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route('velruse.google-callback',
+                              '/login/google/callback')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeOne(self, lazy_profile):
+        from velruse.providers.google_oauth2 import GoogleOAuth2Provider
+        provider = GoogleOAuth2Provider('google', 'key', 'secret', None,
+                                        lazy_profile=lazy_profile)
+        provider.transport.session = DummySession(DummyResponse(USERINFO))
+        return provider
+
+    def _callFUT(self, provider, token_data):
+        from velruse.transport import advance_flow
+        request = testing.DummyRequest(params={'code': 'abc',
+                                               'state': 'xyz'})
+        request.session['state'] = 'xyz'
+        flows = [provider.callback_flow(request)]
+        call = advance_flow(flows)
+        self.assertEqual(call.phase, 'access_token')
+        item = advance_flow(flows, DummyResponse(json.dumps(token_data)))
+        while flows:
+            item = advance_flow(flows,
+                                provider.transport.session.responses.pop(0))
+        return item
+
+    def test_lazy_profile_not_fetched_until_read(self):
+        provider = self._makeOne(True)
+        context = self._callFUT(provider, {
+            'access_token': 'token',
+            'id_token': make_id_token({'sub': '1234',
+                                       'email': 'jane@example.com'})})
+        self.assertFalse(context.profile_loaded)
+        self.assertEqual(provider.transport.session.calls, [])
+        self.assertEqual(context.account, {'domain': 'accounts.google.com',
+                                           'userid': '1234',
+                                           'username': 'jane@example.com'})
+        self.assertEqual(context.credentials['oauthAccessToken'], 'token')
+
+        profile = context.profile
+        self.assertEqual(profile['displayName'], 'Jane Doe')
+        self.assertTrue(context.profile_loaded)
+        self.assertEqual(len(provider.transport.session.calls), 1)
+        method, url = provider.transport.session.calls[0]
+        self.assertTrue(url.startswith(
+            'https://www.googleapis.com/oauth2/v1/userinfo'))
+        self.assertTrue(context.profile is profile)
+        self.assertEqual(len(provider.transport.session.calls), 1)
+
+    def test_lazy_account_without_email(self):
+        provider = self._makeOne(True)
+        context = self._callFUT(provider, {
+            'access_token': 'token',
+            'id_token': make_id_token({'sub': '1234'})})
+        self.assertEqual(context.account, {'domain': 'accounts.google.com',
+                                           'userid': '1234'})
+
+    def test_lazy_malformed_id_token(self):
+        provider = self._makeOne(True)
+        context = self._callFUT(provider, {'access_token': 'token',
+                                           'id_token': 'garbage'})
+        self.assertEqual(context.account, None)
+        self.assertFalse(context.profile_loaded)
+
+    def test_eager_profile(self):
+        provider = self._makeOne(False)
+        context = self._callFUT(provider, {'access_token': 'token'})
+        self.assertTrue(context.profile_loaded)
+        self.assertEqual(context.profile['accounts'],
+                         [{'domain': 'accounts.google.com',
+                           'username': 'jane@example.com',
+                           'userid': '1234'}])
+        self.assertEqual(context.account, None)
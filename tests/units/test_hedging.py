@@ -0,0 +1,164 @@
+import threading
+
+import unittest2 as unittest
+
+
+class TestHedger(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.hedging import Hedger
+        return Hedger(**kw)
+
+    def test_no_delay_until_enough_samples(self):
+        hedger = self._makeOne(min_samples=3)
+        hedger.record('key', 0.1)
+        hedger.record('key', 0.2)
+        self.assertEqual(hedger.delay('key'), None)
+        hedger.record('key', 0.3)
+        self.assertEqual(hedger.delay('key'), 0.3)
+
+    def test_delay_is_percentile(self):
+        hedger = self._makeOne(min_samples=1, percentile=50)
+        for i in range(1, 102):
+            hedger.record('key', i / 100.0)
+        self.assertEqual(hedger.delay('key'), 0.51)
+        self.assertEqual(hedger.delay('other'), None)
+
+    def test_min_delay(self):
+        hedger = self._makeOne(min_samples=1, min_delay=1.0)
+        hedger.record('key', 0.1)
+        self.assertEqual(hedger.delay('key'), 1.0)
+
+    def test_budget(self):
+        hedger = self._makeOne(budget=0.5, max_tokens=1)
+        self.assertTrue(hedger.spend())
+        self.assertFalse(hedger.spend())
+        hedger.delay('key')
+        self.assertFalse(hedger.spend())
+        hedger.delay('key')
+        self.assertTrue(hedger.spend())
+        self.assertEqual((hedger.hedged, hedger.denied), (2, 2))
+
+
+class DummyResponse(object):
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        yield self.body
+
+    def close(self):
+        pass
+
+
+class BlockingSession(object):
+    """Answer the n-th request with the n-th result, once its event is set
+    (immediately when it is ``None``)"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kw):
+        with self.lock:
+            self.calls.append((method, url))
+            event, result = self.results.pop(0)
+        if event is not None:
+            event.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class DummyHedger(object):
+
+    def __init__(self, delay, tokens=1):
+        self._delay = delay
+        self.tokens = tokens
+        self.delays = []
+        self.spent = []
+        self.recorded = []
+
+    def delay(self, key):
+        self.delays.append(key)
+        return self._delay
+
+    def spend(self):
+        spent = self.tokens > 0
+        self.tokens -= spent
+        self.spent.append(spent)
+        return spent
+
+    def record(self, key, duration):
+        self.recorded.append(key)
+
+
+class TestHedgedAttempt(unittest.TestCase):
+
+    def setUp(self):
+        self.primary = threading.Event()
+
+    def tearDown(self):
+        # let the abandoned primary call finish
+        self.primary.set()
+
+    def _makeOne(self, hedger, *results):
+        from velruse.transport import Transport
+        transport = Transport(name='dummy')
+        transport.hedger = hedger
+        transport.session = BlockingSession(*results)
+        return transport
+
+    def test_hedge_beats_slow_primary(self):
+        hedger = DummyHedger(0.01)
+        transport = self._makeOne(hedger,
+                                  (self.primary, DummyResponse('slow')),
+                                  (None, DummyResponse('fast')))
+        response = transport.request('GET', 'https://example.com/me',
+                                     phase='profile', idempotent=True)
+        self.assertEqual(response.body, 'fast')
+        self.assertEqual(len(transport.session.calls), 2)
+        self.assertEqual(hedger.delays, [('example.com', 'profile')])
+        self.assertEqual(hedger.spent, [True])
+
+    def test_no_hedge_once_budget_spent(self):
+        hedger = DummyHedger(0.01, tokens=0)
+        transport = self._makeOne(hedger,
+                                  (self.primary, DummyResponse('slow')))
+        threading.Timer(0.05, self.primary.set).start()
+        response = transport.request('GET', 'https://example.com/me',
+                                     phase='profile', idempotent=True)
+        self.assertEqual(response.body, 'slow')
+        self.assertEqual(len(transport.session.calls), 1)
+        self.assertEqual(hedger.spent, [False])
+        self.assertEqual(hedger.recorded, [('example.com', 'profile')])
+
+    def test_primary_failure_before_delay_is_raised(self):
+        import requests
+        hedger = DummyHedger(5.0)
+        transport = self._makeOne(
+            hedger, (None, requests.ConnectionError('refused')))
+        self.assertRaises(requests.ConnectionError, transport.request,
+                          'GET', 'https://example.com/me', phase='profile',
+                          idempotent=True)
+        self.assertEqual(len(transport.session.calls), 1)
+        self.assertEqual(hedger.spent, [])
+        self.assertEqual(hedger.recorded, [])
+
+    def test_non_idempotent_calls_are_not_hedged(self):
+        hedger = DummyHedger(0.0)
+        transport = self._makeOne(hedger,
+                                  (None, DummyResponse('token')),
+                                  (None, DummyResponse('me')))
+        response = transport.request('POST', 'https://example.com/token',
+                                     phase='access_token')
+        self.assertEqual(response.body, 'token')
+        response = transport.request('GET', 'https://example.com/me',
+                                     phase='profile')
+        self.assertEqual(response.body, 'me')
+        self.assertEqual(len(transport.session.calls), 2)
+        self.assertEqual((hedger.delays, hedger.spent), ([], []))
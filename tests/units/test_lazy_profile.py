@@ -0,0 +1,140 @@
+import json
+
+import unittest2 as unittest
+
+from pyramid import testing
+
+
+class DummyResponse(object):
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+
+class DummySession(object):
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kw):
+        self.calls.append((method, url))
+        return self.responses.pop(0)
+
+
+class TestAuthenticationComplete(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse import AuthenticationComplete
+        return AuthenticationComplete(**kw)
+
+    def test_profile(self):
+        context = self._makeOne(profile={'displayName': 'Jane'})
+        self.assertTrue(context.profile_loaded)
+        self.assertEqual(context.profile, {'displayName': 'Jane'})
+
+    def test_loader_called_once(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {'displayName': 'Jane'}
+        context = self._makeOne(profile_loader=loader, account={'userid': 1})
+        self.assertFalse(context.profile_loaded)
+        self.assertEqual(calls, [])
+        self.assertEqual(context.account, {'userid': 1})
+        self.assertEqual(context.profile, {'displayName': 'Jane'})
+        self.assertEqual(context.profile, {'displayName': 'Jane'})
+        self.assertEqual(calls, [1])
+        self.assertTrue(context.profile_loaded)
+
+    def test_set_profile_drops_loader(self):
+        context = self._makeOne(profile_loader=lambda: 1 / 0)
+        context.profile = {'displayName': 'Jane'}
+        self.assertTrue(context.profile_loaded)
+        self.assertEqual(context.profile, {'displayName': 'Jane'})
+
+
+class LazyCallbackTests(object):
+    """Run a provider's lazy callback, feeding it ``token_response``"""
+
+    callback_route = None
+    token_response = None
+    profile_response = None
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route(self.callback_route, '/callback')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, provider):
+        from velruse.transport import advance_flow
+        provider.transport.session = DummySession(
+            DummyResponse(self.profile_response))
+        request = testing.DummyRequest(params={'code': 'abc',
+                                               'state': 'xyz'})
+        request.session['state'] = 'xyz'
+        flows = [provider.callback_flow(request)]
+        call = advance_flow(flows)
+        self.assertEqual(call.phase, 'access_token')
+        context = advance_flow(flows, DummyResponse(self.token_response))
+        self.assertEqual(flows, [])
+        return context
+
+    def test_profile_fetched_on_access(self):
+        provider = self._makeOne()
+        context = self._callFUT(provider)
+        self.assertFalse(context.profile_loaded)
+        self.assertEqual(provider.transport.session.calls, [])
+        self.assertTrue(context.profile['accounts'])
+        self.assertEqual(len(provider.transport.session.calls), 1)
+
+
+class TestFacebookLazyProfile(LazyCallbackTests, unittest.TestCase):
+
+    callback_route = 'velruse.facebook-callback'
+    token_response = 'access_token=token&expires=5000'
+    profile_response = json.dumps({'id': '42', 'name': 'Jane Doe'})
+
+    def _makeOne(self):
+        from velruse.providers.facebook import FacebookProvider
+        return FacebookProvider('facebook', 'key', 'secret', None,
+                                lazy_profile=True)
+
+
+class TestGithubLazyProfile(LazyCallbackTests, unittest.TestCase):
+
+    callback_route = 'velruse.github-callback'
+    token_response = 'access_token=token&token_type=bearer'
+    profile_response = json.dumps({'id': 42, 'login': 'jane',
+                                   'name': 'Jane Doe'})
+
+    def _makeOne(self):
+        from velruse.providers.github import GithubProvider
+        return GithubProvider('github', 'key', 'secret', None, True,
+                              'github.com', lazy_profile=True)
+
+
+class TestLiveLazyProfile(LazyCallbackTests, unittest.TestCase):
+
+    callback_route = 'velruse.live-callback'
+    token_response = json.dumps({'access_token': 'token',
+                                 'user_id': 'abc123'})
+    profile_response = json.dumps({'id': 'abc123', 'name': 'Jane Doe'})
+
+    def _makeOne(self):
+        from velruse.providers.live import LiveProvider
+        return LiveProvider('live', 'key', 'secret', None,
+                            lazy_profile=True)
+
+    def test_account_from_user_id(self):
+        context = self._callFUT(self._makeOne())
+        self.assertEqual(context.account,
+                         {'domain': 'live.com', 'userid': 'abc123'})
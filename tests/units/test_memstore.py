@@ -0,0 +1,121 @@
+import unittest2 as unittest
+
+
+class TestBoundedMemoryStore(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.memstore import BoundedMemoryStore
+        self.now = 1000.0
+        return BoundedMemoryStore(clock=lambda: self.now, **kw)
+
+    def test_store_retrieve_delete(self):
+        store = self._makeOne()
+        store.store('a', {'x': 1})
+        self.assertEqual(store.retrieve('a'), {'x': 1})
+        store.delete('a')
+        self.assertRaises(KeyError, store.retrieve, 'a')
+        store.delete('a')
+        self.assertEqual(store.stats['hits'], 1)
+        self.assertEqual(store.stats['misses'], 1)
+
+    def test_expiry(self):
+        store = self._makeOne()
+        store.store('a', 1, expires=10)
+        store.store('b', 2, expires=20)
+        store.store('c', 3)
+        self.now += 10
+        self.assertRaises(KeyError, store.retrieve, 'a')
+        self.assertEqual(store.retrieve('b'), 2)
+        self.now += 100
+        store.purge_expired()
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.retrieve('c'), 3)
+        self.assertEqual(store.stats['expired'], 2)
+        self.assertEqual(store.slots, {})
+
+    def test_default_ttl(self):
+        store = self._makeOne(ttl=5)
+        store.store('a', 1)
+        self.now += 6
+        self.assertRaises(KeyError, store.retrieve, 'a')
+
+    def test_restore_moves_slot(self):
+        store = self._makeOne()
+        store.store('a', 1, expires=10)
+        store.store('a', 2, expires=100)
+        self.now += 50
+        self.assertEqual(store.retrieve('a'), 2)
+
+    def test_max_entries(self):
+        store = self._makeOne(max_entries=2)
+        for key in 'abc':
+            store.store(key, key, expires=300)
+        self.assertRaises(KeyError, store.retrieve, 'a')
+        self.assertEqual(store.retrieve('c'), 'c')
+        self.assertEqual(store.stats['evicted'], 1)
+        self.assertEqual(len(store), 2)
+
+    def test_max_bytes(self):
+        store = self._makeOne(max_bytes=10)
+        store.store('a', 'x' * 6)
+        store.store('b', 'y' * 6)
+        self.assertRaises(KeyError, store.retrieve, 'a')
+        self.assertEqual(store.bytes, 6)
+        store.store('c', {'big': 'z' * 20})
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.bytes, 0)
+
+    def test_consume(self):
+        store = self._makeOne()
+        store.store('a', 1, expires=300)
+        self.assertEqual(store.consume('a'), 1)
+        self.assertRaises(KeyError, store.consume, 'a')
+        self.assertEqual(store.slots[int(self.now + 300)], set())
+
+    def test_namespaces_bounded_separately(self):
+        store = self._makeOne(max_entries=2, namespaces={
+            'velruse.session.': {'max_entries': 3}})
+        store.store('result.a', 'a')
+        store.store('result.b', 'b')
+        for i in range(10):
+            store.store('velruse.session.%d' % i, i)
+        self.assertEqual(store.retrieve('result.a'), 'a')
+        self.assertEqual(store.retrieve('result.b'), 'b')
+        self.assertRaises(KeyError, store.retrieve, 'velruse.session.6')
+        self.assertEqual(store.retrieve('velruse.session.9'), 9)
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.stats['evicted'], 7)
+        store.store('result.c', 'c')
+        self.assertRaises(KeyError, store.retrieve, 'result.a')
+        self.assertEqual(store.retrieve('velruse.session.7'), 7)
+
+    def test_namespace_max_bytes(self):
+        store = self._makeOne(namespaces={'n.': {'max_bytes': 10}})
+        store.store('n.a', 'x' * 6)
+        store.store('n.b', 'y' * 6)
+        store.store('other', 'z' * 100)
+        self.assertRaises(KeyError, store.retrieve, 'n.a')
+        self.assertEqual(store.retrieve('other'), 'z' * 100)
+        self.assertEqual(store.bytes, 6)
+
+
+class TestMemoryStoreFromSettings(unittest.TestCase):
+
+    def test_it(self):
+        from velruse.memstore import memory_store_from_settings
+        store = memory_store_from_settings({'store.max_entries': '5',
+                                            'store.ttl': '60'})
+        self.assertEqual(store.max_entries, 5)
+        self.assertEqual(store.max_bytes, None)
+        self.assertEqual(store.ttl, 60)
+
+    def test_namespaces(self):
+        from velruse.memstore import memory_store_from_settings
+        store = memory_store_from_settings({
+            'store.session.max_entries': '7',
+            'store.openid.max_bytes': '1000'})
+        self.assertEqual(store.max_entries, 10000)
+        bounds = dict((prefix, (p.max_entries, p.max_bytes))
+                      for prefix, p in store.namespaces)
+        self.assertEqual(bounds, {'velruse.session.': (7, None),
+                                  'velruse.openid.': (10000, 1000)})
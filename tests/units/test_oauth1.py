@@ -0,0 +1,69 @@
+import unittest2 as unittest
+
+
+class DummyHttp(object):
+    """Capture what ``oauth.Client`` sends instead of sending it"""
+
+    def __init__(self):
+        self.sent = None
+
+    def request(self, client, uri, method='GET', body=None, headers=None,
+                **kw):
+        self.sent = (method, uri, body, headers)
+        return None, ''
+
+
+class TestOAuth1Signer(unittest.TestCase):
+
+    def setUp(self):
+        import httplib2
+        import oauth2 as oauth
+        self.http = DummyHttp()
+        self._patches = [
+            (oauth.Request, 'make_nonce', oauth.Request.__dict__['make_nonce']),
+            (oauth.Request, 'make_timestamp',
+             oauth.Request.__dict__['make_timestamp']),
+            (httplib2.Http, 'request', httplib2.Http.__dict__['request']),
+        ]
+        oauth.Request.make_nonce = classmethod(lambda cls: '12345678')
+        oauth.Request.make_timestamp = classmethod(lambda cls: '1350000000')
+        httplib2.Http.request = \
+            lambda client, *args, **kw: self.http.request(client, *args,
+                                                          **kw)
+
+    def tearDown(self):
+        for obj, name, original in self._patches:
+            setattr(obj, name, original)
+
+    def _makeOne(self):
+        from velruse.oauth1 import OAuth1Signer
+        return OAuth1Signer('key', 'secret')
+
+    def _client(self, method, url):
+        import oauth2 as oauth
+        client = oauth.Client(oauth.Consumer('key', 'secret'),
+                              oauth.Token('token', 'token-secret'))
+        client.request(url, method)
+        return self.http.sent
+
+    def _token(self):
+        import oauth2 as oauth
+        return oauth.Token('token', 'token-secret')
+
+    def test_get_matches_client(self):
+        url = 'https://api.example.com/profile?format=json'
+        method, expected_url, body, headers = self._client('GET', url)
+        call = self._makeOne().call('GET', url, token=self._token())
+        self.assertEqual(call.method, 'GET')
+        self.assertEqual(call.url, expected_url)
+
+    def test_post_matches_client(self):
+        url = 'https://api.example.com/oauth/access_token'
+        method, uri, expected_body, headers = self._client('POST', url)
+        call = self._makeOne().call('POST', url, token=self._token())
+        self.assertEqual(call.method, 'POST')
+        self.assertEqual(call.url, uri)
+        self.assertEqual(call.kw['data'], expected_body)
+        self.assertEqual(call.kw['headers']['Content-Type'],
+                         headers['Content-Type'])
+        self.assertNotIn('oauth_body_hash', call.kw['data'])
@@ -0,0 +1,85 @@
+import time
+
+import unittest2 as unittest
+
+
+class DummyEndpoint(object):
+
+    def __init__(self, server_url):
+        self.server_url = server_url
+
+
+class DummyDiscoveryCache(object):
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.calls = 0
+
+    def discover(self, identifier):
+        self.calls += 1
+        return identifier, [self.endpoint]
+
+
+class TestAssociationKeeper(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from openid.store.memstore import MemoryStore
+        from velruse.providers.oid_associations import AssociationKeeper
+        self.now = int(time.time())
+        self.endpoint = DummyEndpoint('http://op/server')
+        self.cache = DummyDiscoveryCache(self.endpoint)
+        keeper = AssociationKeeper(['http://op/'],
+                                   discovery_cache=self.cache,
+                                   clock=lambda: self.now, **kw)
+        keeper.store = MemoryStore()
+        self.negotiated = []
+
+        def negotiate(consumer, endpoint):
+            from openid.association import Association
+            self.negotiated.append(endpoint.server_url)
+            return Association('h%d' % len(self.negotiated), 'secret',
+                               self.now, 1000, 'HMAC-SHA1')
+        from openid.consumer.consumer import GenericConsumer
+        original = GenericConsumer._negotiateAssociation
+        GenericConsumer._negotiateAssociation = negotiate
+        self.addCleanup(setattr, GenericConsumer, '_negotiateAssociation',
+                        original)
+        return keeper
+
+    def _storeAssociation(self, keeper, lifetime):
+        from openid.association import Association
+        assoc = Association('old', 'secret', self.now, lifetime, 'HMAC-SHA1')
+        keeper.store.storeAssociation(self.endpoint.server_url, assoc)
+
+    def test_never_negotiates_inline(self):
+        keeper = self._makeOne()
+        self.assertEqual(keeper.get_association(self.endpoint), None)
+        self.assertTrue(keeper.wakeup.is_set())
+        self.assertEqual(self.negotiated, [])
+
+    def test_renew(self):
+        keeper = self._makeOne()
+        self.assertTrue(keeper.renew())
+        self.assertEqual(self.negotiated, ['http://op/server'])
+        assoc = keeper.get_association(self.endpoint)
+        self.assertEqual(assoc.handle, 'h1')
+        self.assertFalse(keeper.wakeup.is_set())
+        self.assertTrue(keeper.renew())
+        self.assertEqual(len(self.negotiated), 1)
+        self.assertEqual(self.cache.calls, 1)
+
+    def test_renews_before_expiry(self):
+        keeper = self._makeOne(renew_before=600)
+        self._storeAssociation(keeper, 300)
+        self.assertEqual(keeper.get_association(self.endpoint).handle, 'old')
+        self.assertTrue(keeper.wakeup.is_set())
+        keeper.renew()
+        self.assertEqual(keeper.get_association(self.endpoint).handle, 'h1')
+
+    def test_failure(self):
+        keeper = self._makeOne()
+
+        def discover(identifier):
+            raise ValueError
+        self.cache.discover = discover
+        self.assertFalse(keeper.renew())
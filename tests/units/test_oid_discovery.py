@@ -0,0 +1,201 @@
+import unittest2 as unittest
+
+
+class DummyResponse(object):
+
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class DummyStore(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def store(self, key, value, expires=None):
+        self.data[key] = value
+
+    def retrieve(self, key):
+        return self.data[key]
+
+
+class TestResponseTTL(unittest.TestCase):
+
+    def _callFUT(self, headers, default=60):
+        from velruse.providers.oid_discovery import response_ttl
+        return response_ttl(DummyResponse(headers), default)
+
+    def test_no_headers(self):
+        self.assertEqual(self._callFUT({}), 60)
+
+    def test_max_age(self):
+        self.assertEqual(
+            self._callFUT({'Cache-Control': 'public, max-age=600'}), 600)
+
+    def test_no_cache(self):
+        self.assertEqual(self._callFUT({'cache-control': 'no-cache'}), 0)
+
+    def test_expires(self):
+        headers = {'Date': 'Mon, 01 Oct 2012 10:00:00 GMT',
+                   'Expires': 'Mon, 01 Oct 2012 10:05:00 GMT'}
+        self.assertEqual(self._callFUT(headers), 300)
+
+    def test_invalid_expires(self):
+        self.assertEqual(self._callFUT({'Expires': '0'}), 0)
+
+
+class TestDiscoveryCache(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.providers.oid_discovery import DiscoveryCache
+        self.now = 1000.0
+        cache = DiscoveryCache(clock=lambda: self.now, **kw)
+        self.calls = []
+
+        def discover(identifier):
+            self.calls.append(identifier)
+            return identifier, ['service']
+        from velruse.providers import oid_discovery
+        original = oid_discovery.discover.discover
+        oid_discovery.discover.discover = discover
+        self.addCleanup(setattr, oid_discovery.discover, 'discover',
+                        original)
+        return cache
+
+    def test_caches_by_normalized_identifier(self):
+        cache = self._makeOne(ttl=60)
+        cache.discover('example.com')
+        claimed_id, services = cache.discover('http://example.com/')
+        self.assertEqual(services, ['service'])
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_expires(self):
+        cache = self._makeOne(ttl=60)
+        cache.discover('http://example.com/')
+        self.now += 61
+        cache.discover('http://example.com/')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_shared(self):
+        store = DummyStore()
+        cache = self._makeOne(shared=True)
+        cache.discover('http://example.com/', store)
+        other = self._makeOne(shared=True)
+        other.discover('http://example.com/', store)
+        self.assertEqual(len(self.calls), 0)
+        self.assertEqual(other.hits, 1)
+
+
+class DummyTransportResponse(object):
+
+    def __init__(self, url, content, headers=None):
+        self.url = url
+        self.status_code = 200
+        self.headers = headers or {'Content-Type': 'text/html'}
+        self.content = content
+
+
+class DummyTransport(object):
+
+    def __init__(self, content=None, exc=None):
+        self.content = content
+        self.exc = exc
+        self.calls = []
+
+    def request(self, method, url, deadline=None, phase=None, **kw):
+        self.calls.append((method, url, deadline, phase))
+        if self.exc is not None:
+            raise self.exc
+        return DummyTransportResponse(url, self.content)
+
+
+class TestBoundedDiscovery(unittest.TestCase):
+
+    def _makeOne(self, transport, **kw):
+        from velruse.providers.oid_discovery import DiscoveryCache
+        self.now = 1000.0
+        return DiscoveryCache(transport=transport, timeout=5,
+                              clock=lambda: self.now, **kw)
+
+    def test_fetches_through_transport(self):
+        html = ('<html><head><link rel="openid2.provider" '
+                'href="http://op.example.com/server"></head></html>')
+        transport = DummyTransport(html)
+        cache = self._makeOne(transport, ttl=0)
+        claimed_id, services = cache.discover('http://example.com/')
+        self.assertEqual(services[0].server_url,
+                         'http://op.example.com/server')
+        method, url, deadline, phase = transport.calls[0]
+        self.assertEqual(phase, 'discovery')
+        self.assertEqual(deadline.timeout, 5)
+
+    def test_failures_cached_per_host(self):
+        from openid.consumer.consumer import DiscoveryFailure
+        from openid.fetchers import HTTPFetchingError
+        from velruse.exceptions import DeadlineExceeded
+        transport = DummyTransport(exc=DeadlineExceeded('slow'))
+        cache = self._makeOne(transport, failure_ttl=60)
+        self.assertRaises(HTTPFetchingError, cache.discover,
+                          'http://example.com/alice')
+        self.assertRaises(DiscoveryFailure, cache.discover,
+                          'http://example.com/bob')
+        self.assertEqual(len(transport.calls), 1)
+        self.now += 61
+        self.assertRaises(HTTPFetchingError, cache.discover,
+                          'http://example.com/bob')
+        self.assertEqual(len(transport.calls), 2)
+
+    def test_other_failures_cached_per_identifier(self):
+        from openid.consumer.consumer import DiscoveryFailure
+        transport = DummyTransport('<html></html>')
+        cache = self._makeOne(transport, failure_ttl=60)
+        self.assertRaises(DiscoveryFailure, cache.discover,
+                          'http://example.com/bogus')
+        calls = len(transport.calls)
+        self.assertRaises(DiscoveryFailure, cache.discover,
+                          'http://example.com/bogus')
+        self.assertEqual(len(transport.calls), calls)
+        # other identifiers of the same host are still discovered
+        transport.content = (
+            '<html><head><link rel="openid2.provider" '
+            'href="http://op.example.com/server"></head></html>')
+        claimed_id, services = cache.discover('http://example.com/alice')
+        self.assertEqual(len(services), 1)
+        self.assertTrue(len(transport.calls) > calls)
+
+    def test_response_errors_not_cached_per_host(self):
+        from openid.fetchers import HTTPFetchingError
+        from velruse.exceptions import ResponseTooLarge
+        transport = DummyTransport(exc=ResponseTooLarge('big'))
+        cache = self._makeOne(transport, failure_ttl=60)
+        self.assertRaises(HTTPFetchingError, cache.discover,
+                          'http://example.com/alice')
+        self.assertRaises(HTTPFetchingError, cache.discover,
+                          'http://example.com/bob')
+        self.assertEqual(len(transport.calls), 2)
+
+
+class TestUnreachableHost(unittest.TestCase):
+
+    def _refused_port(self):
+        import socket
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_refused_connection_cached_per_host(self):
+        from openid.consumer.consumer import DiscoveryFailure
+        from openid.fetchers import HTTPFetchingError
+        from velruse.providers.oid_discovery import DiscoveryCache
+        from velruse.providers.oid_discovery import HostUnreachable
+        port = self._refused_port()
+        cache = DiscoveryCache(failure_ttl=60)
+        self.assertRaises(HostUnreachable, cache.discover,
+                          'http://127.0.0.1:%d/alice' % port)
+        self.assertEqual(list(cache.failures), [('host', '127.0.0.1')])
+        self.assertRaises(DiscoveryFailure, cache.discover,
+                          'http://127.0.0.1:%d/bob' % port)
+        self.assertTrue(issubclass(HostUnreachable, HTTPFetchingError))
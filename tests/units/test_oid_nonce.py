@@ -0,0 +1,132 @@
+import unittest2 as unittest
+
+
+class DummyStore(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def store(self, key, value, expires=None):
+        self.data[key] = (value, expires)
+
+    def retrieve(self, key):
+        return self.data[key][0]
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def _makeOne(self, capacity=1000, error_rate=0.01):
+        from velruse.providers.oid_nonce import BloomFilter
+        return BloomFilter(capacity, error_rate)
+
+    def test_add(self):
+        bloom = self._makeOne()
+        self.assertFalse(bloom.add('a'))
+        self.assertTrue(bloom.add('a'))
+        self.assertTrue(bloom.add('a'))
+
+    def test_error_rate(self):
+        bloom = self._makeOne()
+        false_positives = sum(bloom.add(str(i)) for i in range(1000))
+        self.assertTrue(false_positives < 30)
+
+
+class TestNonceStore(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.providers.oid_nonce import NonceStore
+        self.now = 1000000
+        return NonceStore(clock=lambda: self.now, **kw)
+
+    def test_replay(self):
+        store = self._makeOne()
+        self.assertTrue(store.useNonce('http://op/', self.now, 'a'))
+        self.assertFalse(store.useNonce('http://op/', self.now, 'a'))
+        self.assertTrue(store.useNonce('http://op/', self.now, 'b'))
+        self.assertTrue(store.useNonce('http://other/', self.now, 'a'))
+
+    def test_skew(self):
+        store = self._makeOne(skew=60)
+        self.assertFalse(store.useNonce('http://op/', self.now - 61, 'a'))
+        self.assertFalse(store.useNonce('http://op/', self.now + 61, 'a'))
+        self.assertEqual(len(store), 0)
+
+    def test_drops_expired_buckets(self):
+        store = self._makeOne(bucket_size=10, skew=60)
+        for i in range(10):
+            store.useNonce('http://op/', self.now - 50 + i * 10, 'a')
+        self.assertEqual(len(store), 10)
+        self.now += 30
+        self.assertEqual(store.cleanupNonces(), 2)
+        self.assertEqual(len(store), 8)
+        self.now += 10000
+        store.useNonce('http://op/', self.now, 'a')
+        self.assertEqual(len(store), 1)
+
+    def test_bloom(self):
+        store = self._makeOne(bloom=True, capacity=100)
+        self.assertTrue(store.useNonce('http://op/', self.now, 'a'))
+        self.assertFalse(store.useNonce('http://op/', self.now, 'a'))
+
+
+class TestSharedNonceStore(unittest.TestCase):
+
+    def _makeOne(self, backend, **kw):
+        from velruse.providers.oid_nonce import SharedNonceStore
+        self.now = 1000000
+        return SharedNonceStore(backend, clock=lambda: self.now, **kw)
+
+    def test_replay_across_instances(self):
+        backend = DummyStore()
+        store = self._makeOne(backend, bucket_size=10, skew=60)
+        other = self._makeOne(backend, bucket_size=10, skew=60)
+        self.assertTrue(store.useNonce('http://op/', self.now + 5, 'a'))
+        self.assertFalse(other.useNonce('http://op/', self.now + 5, 'a'))
+        self.assertFalse(other.useNonce('http://op/', self.now - 61, 'b'))
+        (value, expires), = backend.data.values()
+        self.assertEqual(expires, 71)
+
+    def test_backend_add(self):
+        from velruse.memstore import BoundedMemoryStore
+        backend = BoundedMemoryStore()
+        store = self._makeOne(backend, bucket_size=10, skew=60)
+        self.assertTrue(store.useNonce('http://op/', self.now, 'a'))
+        self.assertFalse(store.useNonce('http://op/', self.now, 'a'))
+        self.assertEqual(store.local, None)
+
+    def test_redis_set_nx(self):
+        from anykeystore.backends.redis import RedisStore
+        calls = []
+
+        class DummyConnection(object):
+            data = {}
+
+            def set(self, key, value, ex=None, nx=False):
+                calls.append((key, ex, nx))
+                if nx and key in self.data:
+                    return None
+                self.data[key] = value
+                return True
+        backend = RedisStore(key_prefix='p.')
+        conn = DummyConnection()
+        backend._get_conn = lambda: conn
+        store = self._makeOne(backend, bucket_size=10, skew=60)
+        self.assertTrue(store.useNonce('http://op/', self.now, 'a'))
+        self.assertFalse(store.useNonce('http://op/', self.now, 'a'))
+        key, expires, nx = calls[0]
+        self.assertTrue(key.startswith('p.velruse.openid.nonce.'))
+        self.assertEqual((expires, nx), (71, True))
+
+    def test_memory_store(self):
+        from anykeystore.backends.memory import MemoryStore
+        store = self._makeOne(MemoryStore())
+        self.assertTrue(store.useNonce('http://op/', self.now, 'a'))
+        self.assertFalse(store.useNonce('http://op/', self.now, 'a'))
+
+    def test_fallback_checks_local_store(self):
+        backend = DummyStore()
+        store = self._makeOne(backend)
+        self.assertTrue(store.local is not None)
+        self.assertTrue(store.useNonce('http://op/', self.now, 'a'))
+        backend.data.clear()
+        self.assertFalse(store.useNonce('http://op/', self.now, 'a'))
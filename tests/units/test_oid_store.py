@@ -0,0 +1,85 @@
+import unittest2 as unittest
+
+
+class DummyStore(object):
+
+    def __init__(self):
+        self.data = {}
+        self.reads = 0
+
+    def store(self, key, value, expires=None):
+        self.data[key] = value
+
+    def retrieve(self, key):
+        self.reads += 1
+        return self.data[key]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class DummyRegistry(object):
+
+    def __init__(self, store):
+        self.velruse_store = store
+
+
+class TestAnyKeyOpenIDStore(unittest.TestCase):
+
+    def _makeOne(self, store=None, **kw):
+        from velruse.providers.oid_store import AnyKeyOpenIDStore
+        self.now = 1000000000
+        return AnyKeyOpenIDStore(store, clock=lambda: self.now, **kw)
+
+    def _makeAssociation(self, handle, lifetime=600):
+        from openid.association import Association
+        return Association(handle, 'secret', self.now, lifetime,
+                           'HMAC-SHA1')
+
+    def test_shared_between_instances(self):
+        backend = DummyStore()
+        store = self._makeOne(backend)
+        other = self._makeOne(backend)
+        self.assertEqual(other.getAssociation('http://op/'), None)
+        store.storeAssociation('http://op/', self._makeAssociation('h1'))
+        # an unknown handle bypasses the local cache
+        assoc = other.getAssociation('http://op/', 'h1')
+        self.assertEqual(assoc.handle, 'h1')
+
+    def test_read_through_cache(self):
+        backend = DummyStore()
+        store = self._makeOne(backend, cache_ttl=30)
+        store.storeAssociation('http://op/', self._makeAssociation('h1'))
+        reads = backend.reads
+        store.getAssociation('http://op/')
+        store.getAssociation('http://op/', 'h1')
+        self.assertEqual(backend.reads, reads)
+
+    def test_latest_and_expired(self):
+        store = self._makeOne(DummyStore())
+        store.storeAssociation('http://op/', self._makeAssociation('h1', 60))
+        self.now += 10
+        store.storeAssociation('http://op/', self._makeAssociation('h2'))
+        self.assertEqual(store.getAssociation('http://op/').handle, 'h2')
+        self.now += 100
+        self.assertEqual(store.getAssociation('http://op/', 'h1'), None)
+
+    def test_remove(self):
+        store = self._makeOne(DummyStore())
+        store.storeAssociation('http://op/', self._makeAssociation('h1'))
+        self.assertTrue(store.removeAssociation('http://op/', 'h1'))
+        self.assertFalse(store.removeAssociation('http://op/', 'h1'))
+        self.assertEqual(store.getAssociation('http://op/'), None)
+
+    def test_use_nonce(self):
+        store = self._makeOne(DummyStore())
+        self.assertTrue(store.useNonce('http://op/', self.now, 'salt'))
+        self.assertFalse(store.useNonce('http://op/', self.now, 'salt'))
+        self.assertFalse(store.useNonce('http://op/', 0, 'salt'))
+
+    def test_bind(self):
+        backend = DummyStore()
+        store = self._makeOne()
+        bound = store.bind(DummyRegistry(backend))
+        self.assertTrue(bound.store is backend)
+        self.assertTrue(store.bind(DummyRegistry(backend)) is bound)
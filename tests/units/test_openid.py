@@ -0,0 +1,223 @@
+import unittest2 as unittest
+
+
+class TestExtractOpenIDData(unittest.TestCase):
+
+    def _callFUT(self, identifier, sreg_data=None, ax_data=None):
+        from openid.extensions import ax
+        from openid.extensions import sreg
+        from velruse.providers.openid import extract_openid_data
+        sreg_resp = ax_resp = None
+        if sreg_data is not None:
+            sreg_resp = sreg.SRegResponse(sreg_data)
+        if ax_data is not None:
+            ax_resp = ax.FetchResponse()
+            for type_uri, value in ax_data.items():
+                ax_resp.addValue(type_uri, value)
+        return extract_openid_data(identifier, sreg_resp, ax_resp)
+
+    def test_ax_takes_precedence(self):
+        profile = self._callFUT(
+            'http://example.com/',
+            sreg_data={'nickname': 'sreg', 'fullname': 'S Reg',
+                       'dob': '1980-01-02'},
+            ax_data={'http://axschema.org/namePerson/friendly': 'ax'})
+        self.assertEqual(profile['preferredUsername'], 'ax')
+        self.assertEqual(profile['displayName'], 'S Reg')
+        self.assertEqual(profile['birthday'].year, 1980)
+
+    def test_verified_email_is_ax_only(self):
+        profile = self._callFUT(
+            'https://me.yahoo.com/a/b',
+            sreg_data={'email': 'sreg@example.com'},
+            ax_data={'http://axschema.org/namePerson/first': 'Jane',
+                     'http://axschema.org/namePerson/last': 'Doe'})
+        self.assertFalse('verifiedEmail' in profile)
+        self.assertEqual(profile['name']['formatted'], 'Jane Doe')
+
+    def test_empty_responses(self):
+        profile = self._callFUT('http://example.com/')
+        self.assertEqual(profile['accounts'][0]['domain'], 'openid.net')
+
+
+class TestPrebuiltExtension(unittest.TestCase):
+
+    def _makeOne(self, extension):
+        from velruse.providers.oid_extensions import PrebuiltExtension
+        return PrebuiltExtension(extension)
+
+    def test_same_message(self):
+        from openid.extensions import sreg
+        from openid.message import Message
+        from openid.message import OPENID2_NS
+        request = sreg.SRegRequest(optional=['email', 'nickname'])
+        prebuilt = self._makeOne(request)
+        expected = request.toMessage(Message(OPENID2_NS)).toPostArgs()
+        for i in range(2):
+            message = prebuilt.toMessage(Message(OPENID2_NS))
+            self.assertEqual(message.toPostArgs(), expected)
+
+
+class DummyStore(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def store(self, key, value, expires=None):
+        self.data[key] = (value, expires)
+
+    def retrieve(self, key):
+        return self.data[key][0]
+
+    def delete(self, key):
+        del self.data[key]
+
+
+class TestOpenIDSession(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.providers.openid import OpenIDConsumer
+        return OpenIDConsumer('openid', **kw)
+
+    def _makeRequest(self):
+        from pyramid.testing import DummyRequest
+        request = DummyRequest()
+        request.registry.velruse_store = self.store = DummyStore()
+        return request
+
+    def test_cookie_session(self):
+        provider = self._makeOne()
+        request = self._makeRequest()
+        provider._save_openid_session(request, {'endpoint': 'e'})
+        self.assertEqual(request.session['openid_session'], {'endpoint': 'e'})
+        self.assertEqual(provider._load_openid_session(request),
+                         {'endpoint': 'e'})
+        self.assertEqual(provider._load_openid_session(request), None)
+
+    def test_server_session(self):
+        provider = self._makeOne(server_session=True, server_session_ttl=60)
+        request = self._makeRequest()
+        provider._save_openid_session(request, {'endpoint': 'e'})
+        self.assertEqual(list(request.session), ['openid_session_key'])
+        (value, expires), = self.store.data.values()
+        self.assertEqual(expires, 60)
+        self.assertEqual(provider._load_openid_session(request),
+                         {'endpoint': 'e'})
+        self.assertEqual(self.store.data, {})
+        self.assertEqual(provider._load_openid_session(request), None)
+
+    def test_server_session_expired(self):
+        provider = self._makeOne(server_session=True)
+        request = self._makeRequest()
+        provider._save_openid_session(request, {'endpoint': 'e'})
+        self.store.data.clear()
+        self.assertEqual(provider._load_openid_session(request), None)
+
+
+class DummySuccess(object):
+
+    def __init__(self, extensions):
+        from openid.consumer.consumer import SUCCESS
+        from openid.message import Message, OPENID2_NS
+        self.status = SUCCESS
+        self.identity_url = 'https://www.google.com/accounts/o8/id?id=me'
+        self.endpoint = self
+        self.canonicalID = None
+        self.message = Message(OPENID2_NS)
+        self.extensions = extensions
+
+    def getSignedNS(self, ns_uri):
+        return None
+
+    def extensionResponse(self, ns_uri, require_signed):
+        return self.extensions.get(ns_uri, {})
+
+
+class DummyOIDConsumer(object):
+
+    def __init__(self, info):
+        self.info = info
+
+    def complete(self, params, return_to):
+        return self.info
+
+
+class DummyResponse(object):
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+class DummyTransport(object):
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.deadlines = []
+        self.calls = []
+
+    def deadline(self):
+        deadline = object()
+        self.deadlines.append(deadline)
+        return deadline
+
+    def send(self, call):
+        self.calls.append(call)
+        return self.responses.pop(0)
+
+
+class TestCallbackDeadline(unittest.TestCase):
+
+    def _makeRequest(self):
+        from pyramid.testing import DummyRequest
+        request = DummyRequest()
+        request.route_url = lambda name: 'http://example.com/callback'
+        return request
+
+    def _prepare(self, provider, *responses):
+        info = DummySuccess({
+            'http://specs.openid.net/extensions/oauth/1.0':
+                {'request_token': 'request'},
+        })
+        provider._load_openid_session = lambda request: {'openid': 'data'}
+        provider._get_consumer = \
+            lambda request, session: DummyOIDConsumer(info)
+        provider.transport = DummyTransport(*responses)
+        return provider
+
+    def test_google_hybrid(self):
+        from velruse.providers.google_hybrid import GoogleConsumer
+        provider = self._prepare(
+            GoogleConsumer('google', oauth_key='key', oauth_secret='secret'),
+            DummyResponse('oauth_token=access&oauth_token_secret=s'),
+            DummyResponse('{"entry": {"id": "1", "accounts": [{}]}}'))
+        context = provider.callback(self._makeRequest())
+        self.assertEqual(context.credentials['oauthAccessToken'], 'access')
+        transport = provider.transport
+        self.assertEqual(len(transport.deadlines), 1)
+        self.assertEqual([call.phase for call in transport.calls],
+                         ['access_token', 'profile'])
+        self.assertEqual([call.deadline for call in transport.calls],
+                         transport.deadlines * 2)
+
+    def test_yahoo(self):
+        from velruse.providers.yahoo import YahooConsumer
+        provider = self._prepare(
+            YahooConsumer('yahoo', oauth_key='key', oauth_secret='secret'),
+            DummyResponse('oauth_token=access&oauth_token_secret=s'))
+        provider.callback(self._makeRequest())
+        transport = provider.transport
+        self.assertEqual(len(transport.deadlines), 1)
+        self.assertEqual([call.deadline for call in transport.calls],
+                         transport.deadlines)
+
+    def test_no_transport(self):
+        from velruse.providers.openid import OpenIDConsumer
+        provider = OpenIDConsumer('openid')
+        deadlines = []
+        provider._get_access_token = \
+            lambda token, deadline=None: deadlines.append(deadline)
+        self._prepare(provider)
+        provider.transport = None
+        provider.callback(self._makeRequest())
+        self.assertEqual(deadlines, [None])
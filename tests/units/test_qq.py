@@ -0,0 +1,55 @@
+import unittest2 as unittest
+
+from pyramid import testing
+
+
+class DummyResponse(object):
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+class TestQQCallback(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route('velruse.qq-callback', '/login/qq/callback')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeOne(self):
+        from velruse.providers.qq import QQProvider
+        return QQProvider('qq', 'key', 'secret', None)
+
+    def _callFUT(self, *responses):
+        from velruse.transport import advance_flow
+        request = testing.DummyRequest(params={'code': 'abc'})
+        flows = [self._makeOne().callback_flow(request)]
+        item = advance_flow(flows)
+        for response in responses:
+            item = advance_flow(flows, response)
+        return item
+
+    def test_complete(self):
+        context = self._callFUT(
+            DummyResponse('access_token=token'),
+            DummyResponse('callback( {"openid": "42"} );'),
+            DummyResponse('{"nickname": "Jane"}'))
+        self.assertEqual(context.profile['accounts'],
+                         [{'domain': 'qq.com', 'userid': '42'}])
+        self.assertEqual(context.profile['displayName'], 'Jane')
+
+    def test_openid_not_an_object(self):
+        from velruse.exceptions import MalformedResponse
+        self.assertRaises(MalformedResponse, self._callFUT,
+                          DummyResponse('access_token=token'),
+                          DummyResponse('callback( ["42"] );'))
+
+    def test_profile_not_an_object(self):
+        from velruse.exceptions import MalformedResponse
+        self.assertRaises(MalformedResponse, self._callFUT,
+                          DummyResponse('access_token=token'),
+                          DummyResponse('callback( {"openid": "42"} );'),
+                          DummyResponse('"Jane"'))
@@ -0,0 +1,87 @@
+import unittest2 as unittest
+
+
+class TestJSONSerializer(unittest.TestCase):
+
+    def _makeOne(self):
+        from velruse.serializers import JSONSerializer
+        return JSONSerializer()
+
+    def test_round_trip(self):
+        serializer = self._makeOne()
+        value = serializer.dumps((1, 2, {'state': 'abc'}))
+        self.assertEqual(serializer.loads(value), [1, 2, {'state': 'abc'}])
+
+    def test_openid_session(self):
+        from openid.consumer.discover import OpenIDServiceEndpoint
+        from openid.yadis.manager import YadisServiceManager
+        endpoint = OpenIDServiceEndpoint.fromOPEndpointURL(
+            'https://example.com/op')
+        manager = YadisServiceManager('https://example.com/',
+                                      'https://example.com/', [endpoint],
+                                      '_openid_consumer_')
+        serializer = self._makeOne()
+        session = serializer.loads(serializer.dumps(
+            {'last': endpoint, 'services': manager}))
+        self.assertTrue(isinstance(session['last'], OpenIDServiceEndpoint))
+        self.assertEqual(session['last'].server_url, 'https://example.com/op')
+        self.assertTrue(isinstance(session['last'].server_url, str))
+        self.assertEqual(session['services'].services[0].server_url,
+                         'https://example.com/op')
+
+    def test_unknown_object(self):
+        self.assertRaises(TypeError, self._makeOne().dumps, object())
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self._makeOne().loads, '{')
+
+
+class TestCompressingSerializer(unittest.TestCase):
+
+    def _makeOne(self, threshold):
+        from velruse.serializers import CompressingSerializer
+        from velruse.serializers import JSONSerializer
+        return CompressingSerializer(JSONSerializer(), threshold=threshold)
+
+    def test_small_value(self):
+        serializer = self._makeOne(100)
+        value = serializer.dumps({'state': 'abc'})
+        self.assertEqual(value, '.{"state":"abc"}')
+        self.assertEqual(serializer.loads(value), {'state': 'abc'})
+
+    def test_large_value(self):
+        serializer = self._makeOne(100)
+        data = {'token': 'x' * 200}
+        value = serializer.dumps(data)
+        self.assertEqual(value[0], 'z')
+        self.assertTrue(len(value) < 100)
+        self.assertEqual(serializer.loads(value), data)
+
+    def test_invalid(self):
+        serializer = self._makeOne(100)
+        self.assertRaises(ValueError, serializer.loads, 'zabc')
+        self.assertRaises(ValueError, serializer.loads, '?{}')
+
+
+class TestSerializerFromSettings(unittest.TestCase):
+
+    def _callFUT(self, settings):
+        from velruse.serializers import serializer_from_settings
+        return serializer_from_settings(settings)
+
+    def test_default(self):
+        self.assertEqual(self._callFUT({}), None)
+
+    def test_json(self):
+        from velruse.serializers import CompressingSerializer
+        from velruse.serializers import JSONSerializer
+        serializer = self._callFUT({'session.serializer': 'json',
+                                    'session.compress': 'true',
+                                    'session.compress_threshold': '64'})
+        self.assertTrue(isinstance(serializer, CompressingSerializer))
+        self.assertTrue(isinstance(serializer.serializer, JSONSerializer))
+        self.assertEqual(serializer.threshold, 64)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, self._callFUT,
+                          {'session.serializer': 'yaml'})
@@ -0,0 +1,121 @@
+import unittest2 as unittest
+
+
+class DummyStore(object):
+
+    def __init__(self):
+        self.data = {}
+        self.retrieves = 0
+
+    def retrieve(self, key):
+        self.retrieves += 1
+        return self.data[key]
+
+    def store(self, key, value, expires=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestStoreSessionFactory(unittest.TestCase):
+
+    def setUp(self):
+        self.store = DummyStore()
+
+    def _makeOne(self, request, **kw):
+        from velruse.session import StoreSessionFactory
+        return StoreSessionFactory('secret', store=self.store, **kw)(request)
+
+    def _makeRequest(self, response=None):
+        from pyramid.testing import DummyRequest
+        request = DummyRequest()
+        request.response_callbacks = []
+        request.add_response_callback = request.response_callbacks.append
+        if response is not None:
+            for header in response.headers.getall('Set-Cookie'):
+                name, value = header.split(';')[0].split('=', 1)
+                request.cookies[name] = value
+        return request
+
+    def _respond(self, request):
+        from pyramid.response import Response
+        response = Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        return response
+
+    def test_untouched(self):
+        request = self._makeRequest()
+        request.cookies['velruse.session'] = 'abc.def'
+        self._makeOne(request)
+        response = self._respond(request)
+        self.assertEqual(self.store.retrieves, 0)
+        self.assertFalse(response.headers.getall('Set-Cookie'))
+
+    def test_round_trip(self):
+        request = self._makeRequest()
+        session = self._makeOne(request)
+        self.assertTrue(session.new)
+        session['state'] = 'abc'
+        response = self._respond(request)
+        self.assertEqual(len(self.store.data), 1)
+
+        request = self._makeRequest(response)
+        session = self._makeOne(request)
+        self.assertFalse(session.new)
+        self.assertEqual(session['state'], 'abc')
+        self.assertEqual(self.store.retrieves, 1)
+        # reading does not write the session back
+        self.assertEqual(request.response_callbacks, [])
+
+    def test_forged_cookie(self):
+        request = self._makeRequest()
+        request.cookies['velruse.session'] = 'abc.def'
+        session = self._makeOne(request)
+        self.assertTrue(session.new)
+        self.assertEqual(self.store.retrieves, 0)
+
+    def test_emptied_session_is_deleted(self):
+        request = self._makeRequest()
+        self._makeOne(request)['state'] = 'abc'
+        response = self._respond(request)
+        request = self._makeRequest(response)
+        del self._makeOne(request)['state']
+        response = self._respond(request)
+        self.assertEqual(self.store.data, {})
+        self.assertIn('Max-Age=0',
+                      response.headers.getall('Set-Cookie')[0])
+
+    def test_invalidate(self):
+        request = self._makeRequest()
+        self._makeOne(request)['state'] = 'abc'
+        response = self._respond(request)
+        old_keys = set(self.store.data)
+        request = self._makeRequest(response)
+        session = self._makeOne(request)
+        session.invalidate()
+        session['token'] = 'xyz'
+        self._respond(request)
+        self.assertEqual(len(self.store.data), 1)
+        self.assertFalse(old_keys & set(self.store.data))
+        self.assertEqual(list(self.store.data.values())[0][1],
+                         {'token': 'xyz'})
+
+    def test_flash(self):
+        session = self._makeOne(self._makeRequest())
+        session.flash('hello')
+        session.flash('hello', allow_duplicate=False)
+        self.assertEqual(session.peek_flash(), ['hello'])
+        self.assertEqual(session.pop_flash(), ['hello'])
+        self.assertEqual(session.pop_flash(), [])
+
+    def test_serializer(self):
+        from velruse.serializers import JSONSerializer
+        request = self._makeRequest()
+        self._makeOne(request, serializer=JSONSerializer())['state'] = 'abc'
+        response = self._respond(request)
+        self.assertTrue(isinstance(list(self.store.data.values())[0], str))
+        request = self._makeRequest(response)
+        session = self._makeOne(request, serializer=JSONSerializer())
+        self.assertEqual(session['state'], 'abc')
@@ -0,0 +1,106 @@
+import unittest2 as unittest
+
+
+class DummyProvider(object):
+
+    def __init__(self, signed_state=None):
+        self.name = 'dummy'
+        self.signed_state = signed_state
+
+
+class TestSignedState(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.state import SignedState
+        self.now = 1000.0
+        return SignedState('secret', clock=lambda: self.now, **kw)
+
+    def test_round_trip(self):
+        state = self._makeOne()
+        value = state.dumps({'a': [1, 2]})
+        self.assertEqual(state.loads(value), {'a': [1, 2]})
+
+    def test_tampered(self):
+        from velruse.exceptions import CSRFError
+        state = self._makeOne()
+        value = state.dumps('x')
+        payload, signature = value.split('.')
+        other = self._makeOne().dumps('y').split('.')[0]
+        self.assertRaises(CSRFError, state.loads, other + '.' + signature)
+        self.assertRaises(CSRFError, state.loads, payload + '.!!')
+        self.assertRaises(CSRFError, state.loads, '')
+
+    def test_other_secret(self):
+        from velruse.exceptions import CSRFError
+        from velruse.state import SignedState
+        value = SignedState('other').dumps('x')
+        self.assertRaises(CSRFError, self._makeOne().loads, value)
+
+    def test_expired(self):
+        from velruse.exceptions import CSRFError
+        state = self._makeOne(max_age=60)
+        value = state.dumps('x')
+        self.now += 61
+        self.assertRaises(CSRFError, state.loads, value)
+
+
+class TestProviderState(unittest.TestCase):
+
+    def _makeProvider(self, **kw):
+        from velruse.state import SignedState
+        return DummyProvider(SignedState('secret', **kw))
+
+    def _makeRequest(self, response=None, **GET):
+        from pyramid.testing import DummyRequest
+        request = DummyRequest(params=GET)
+        if response is not None:
+            for header in response.headers.getall('Set-Cookie'):
+                name, value = header.split(';')[0].split('=', 1)
+                request.cookies[name] = value
+        return request
+
+    def test_session_state(self):
+        from pyramid.response import Response
+        from velruse.exceptions import CSRFError
+        from velruse.state import issue_state
+        from velruse.state import verify_state
+        provider = DummyProvider()
+        request = self._makeRequest()
+        state = issue_state(provider, request, Response())
+        self.assertEqual(request.session['state'], state)
+        callback = self._makeRequest(state=state)
+        callback.session = request.session
+        verify_state(provider, callback)
+        callback = self._makeRequest(state='other')
+        self.assertRaises(CSRFError, verify_state, provider, callback)
+
+    def test_signed_state(self):
+        from pyramid.response import Response
+        from velruse.exceptions import CSRFError
+        from velruse.state import issue_state
+        from velruse.state import verify_state
+        provider = self._makeProvider()
+        request = self._makeRequest()
+        response = Response()
+        state = issue_state(provider, request, response)
+        self.assertFalse(request.session)
+        verify_state(provider, self._makeRequest(response, state=state))
+        # a state issued to another browser
+        other = issue_state(provider, request, Response())
+        self.assertRaises(CSRFError, verify_state, provider,
+                          self._makeRequest(response, state=other))
+
+    def test_signed_request_token(self):
+        from pyramid.response import Response
+        from velruse.exceptions import CSRFError
+        from velruse.state import load_request_token
+        from velruse.state import save_request_token
+        provider = self._makeProvider(encrypt=True)
+        content = 'oauth_token=key&oauth_token_secret=secret'
+        response = Response()
+        save_request_token(provider, self._makeRequest(), response, content)
+        self.assertFalse('secret' in response.headers['Set-Cookie'])
+        request = self._makeRequest(response, oauth_token='key')
+        self.assertEqual(load_request_token(provider, request), content)
+        request = self._makeRequest(response, oauth_token='other')
+        self.assertRaises(CSRFError, load_request_token, provider, request)
@@ -0,0 +1,70 @@
+import unittest2 as unittest
+
+
+class TestRequestTokenPool(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.tokenpool import RequestTokenPool
+        self.now = 1000.0
+        self.fetched = []
+        pool = RequestTokenPool(self._fetch, clock=lambda: self.now, **kw)
+        # keep the refill thread out of the way, tests refill by hand
+        pool._start = lambda: None
+        return pool
+
+    def _fetch(self, callback_url):
+        self.fetched.append(callback_url)
+        return 'oauth_token=%d&oauth_token_secret=s' % len(self.fetched)
+
+    def test_empty_pool_falls_back(self):
+        pool = self._makeOne()
+        self.assertEqual(pool.get('http://a/cb'), None)
+        self.assertEqual(pool.misses, 1)
+
+    def test_refill_per_callback_url(self):
+        pool = self._makeOne(size=2, max_urls=2)
+        pool.get('http://a/cb')
+        pool.get('http://b/cb')
+        pool.refill()
+        self.assertEqual(sorted(self.fetched), ['http://a/cb'] * 2 +
+                                               ['http://b/cb'] * 2)
+        self.assertTrue(pool.get('http://a/cb').startswith('oauth_token='))
+        pool.refill()
+        self.assertEqual(len(self.fetched), 5)
+
+    def test_expired_tokens_are_dropped(self):
+        pool = self._makeOne(size=1, ttl=60)
+        pool.get('http://a/cb')
+        pool.refill()
+        self.now += 61
+        self.assertEqual(pool.get('http://a/cb'), None)
+        pool.refill()
+        self.assertEqual(pool.get('http://a/cb'),
+                         'oauth_token=2&oauth_token_secret=s')
+
+    def test_fetch_failure(self):
+        pool = self._makeOne()
+        pool.fetch = lambda url: 1 / 0
+        pool.get('http://a/cb')
+        self.assertFalse(pool.refill())
+
+    def test_only_first_urls_are_pooled(self):
+        pool = self._makeOne(size=1)
+        pool.get('http://a/cb')
+        for i in range(100):
+            self.assertEqual(pool.get('http://spoofed%d/cb' % i), None)
+        pool.refill()
+        self.assertEqual(self.fetched, ['http://a/cb'])
+        self.assertEqual(list(pool.tokens), ['http://a/cb'])
+
+    def test_idle_urls_are_dropped(self):
+        pool = self._makeOne(size=1, ttl=60)
+        pool.get('http://a/cb')
+        self.now += 30
+        pool.get('http://b/cb')
+        self.assertEqual(list(pool.tokens), ['http://a/cb'])
+        self.now += 31
+        pool.get('http://b/cb')
+        self.assertEqual(list(pool.tokens), ['http://b/cb'])
+        pool.refill()
+        self.assertEqual(self.fetched, ['http://b/cb'])
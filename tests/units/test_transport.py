@@ -0,0 +1,570 @@
+import unittest2 as unittest
+
+
+class DummyResponse(object):
+
+    def __init__(self, chunks, status_code=200, headers=None, tick=None):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.tick = tick
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            if self.tick is not None:
+                self.tick()
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class DummySession(object):
+    """Answer each request with the next queued response or exception"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    def request(self, method, url, **kw):
+        self.calls.append((method, url, kw))
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class TestDeadline(unittest.TestCase):
+
+    def _makeOne(self, timeout):
+        from velruse.transport import Deadline
+        self.now = 1000.0
+        return Deadline(timeout, clock=lambda: self.now)
+
+    def test_unlimited(self):
+        deadline = self._makeOne(None)
+        self.now += 1000
+        self.assertEqual(deadline.remaining(), None)
+        self.assertFalse(deadline.expired)
+        self.assertEqual(deadline.elapsed(), 1000)
+
+    def test_remaining(self):
+        deadline = self._makeOne(5)
+        self.now += 2
+        self.assertEqual(deadline.remaining(), 3)
+        self.assertFalse(deadline.expired)
+        self.now += 3
+        self.assertEqual(deadline.remaining(), 0)
+        self.assertTrue(deadline.expired)
+        self.now += 1
+        self.assertEqual(deadline.remaining(), 0)
+
+
+class TestTransportDeadline(unittest.TestCase):
+
+    def _makeOne(self, *results):
+        from velruse.transport import Transport
+        transport = Transport(name='dummy')
+        transport.session = DummySession(*results)
+        return transport
+
+    def _makeDeadline(self, timeout):
+        from velruse.transport import Deadline
+        self.now = 1000.0
+        return Deadline(timeout, clock=lambda: self.now)
+
+    def test_timeout_from_remaining(self):
+        transport = self._makeOne(DummyResponse(['ok']))
+        deadline = self._makeDeadline(5)
+        self.now += 2
+        response = transport.get('http://a/', deadline=deadline,
+                                 phase='profile')
+        self.assertEqual(response._content, 'ok')
+        method, url, kw = transport.session.calls[0]
+        self.assertEqual(kw['timeout'], 3)
+        self.assertTrue(kw['stream'])
+
+    def test_expired_before_sending(self):
+        from velruse.exceptions import DeadlineExceeded
+        transport = self._makeOne()
+        deadline = self._makeDeadline(5)
+        self.now += 5
+        self.assertRaises(DeadlineExceeded, transport.get, 'http://a/',
+                          deadline=deadline, phase='profile')
+        self.assertEqual(transport.session.calls, [])
+
+    def test_timeout_becomes_deadline_exceeded(self):
+        import requests
+        from velruse.exceptions import DeadlineExceeded
+        transport = self._makeOne(requests.Timeout('slow'))
+        deadline = self._makeDeadline(5)
+        try:
+            transport.post('http://a/', deadline=deadline,
+                           phase='access_token')
+        except DeadlineExceeded as e:
+            self.assertEqual(e.phase, 'access_token')
+        else:
+            self.fail('DeadlineExceeded not raised')
+
+    def test_timeout_without_deadline(self):
+        import requests
+        transport = self._makeOne(requests.Timeout('slow'))
+        self.assertRaises(requests.Timeout, transport.get, 'http://a/')
+
+
+class TestReadBody(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from velruse.transport import Transport
+        return Transport(name='dummy', **kw)
+
+    def _makeDeadline(self, timeout):
+        from velruse.transport import Deadline
+        self.now = 1000.0
+        return Deadline(timeout, clock=lambda: self.now)
+
+    def test_reads_body(self):
+        transport = self._makeOne()
+        response = DummyResponse(['ab', 'cd'])
+        transport._read_body(response, 10, 'profile')
+        self.assertEqual(response._content, 'abcd')
+
+    def test_too_large(self):
+        from velruse.exceptions import ResponseTooLarge
+        transport = self._makeOne()
+        response = DummyResponse(['abc', 'def'])
+        self.assertRaises(ResponseTooLarge, transport._read_body, response,
+                          4, 'profile')
+        self.assertTrue(response.closed)
+
+    def test_deadline_checked_per_chunk(self):
+        from velruse.exceptions import DeadlineExceeded
+        transport = self._makeOne()
+        deadline = self._makeDeadline(5)
+
+        def tick():
+            self.now += 2
+        response = DummyResponse(['a'] * 10, tick=tick)
+        try:
+            transport._read_body(response, 100, 'profile', deadline)
+        except DeadlineExceeded as e:
+            self.assertEqual(e.phase, 'profile')
+        else:
+            self.fail('DeadlineExceeded not raised')
+        self.assertTrue(response.closed)
+        self.assertEqual(self.now, 1006.0)
+
+
+class DummyRandom(object):
+    """Always pick the upper bound, recording it"""
+
+    def __init__(self):
+        self.bounds = []
+
+    def uniform(self, low, high):
+        self.bounds.append((low, high))
+        return high
+
+
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        import velruse.transport
+        self.module = velruse.transport
+        self.random = DummyRandom()
+        self.slept = []
+        self._original = (velruse.transport.random,
+                          velruse.transport.time.sleep)
+        velruse.transport.random = self.random
+        velruse.transport.time.sleep = self.slept.append
+
+    def tearDown(self):
+        self.module.random, self.module.time.sleep = self._original
+
+    def _makeOne(self, *results, **kw):
+        from velruse.transport import Transport
+        kw.setdefault('retry_backoff', 0.1)
+        kw.setdefault('retry_backoff_max', 0.3)
+        transport = Transport(name='dummy', retries=3, **kw)
+        transport.session = DummySession(*results)
+        return transport
+
+    def _makeDeadline(self, timeout):
+        from velruse.transport import Deadline
+        return Deadline(timeout, clock=lambda: 1000.0)
+
+    def test_idempotent_retried(self):
+        import requests
+        transport = self._makeOne(requests.ConnectionError('reset'),
+                                  DummyResponse([], status_code=503),
+                                  requests.ConnectionError('reset'),
+                                  DummyResponse(['ok']))
+        response = transport.get('http://a/', idempotent=True)
+        self.assertEqual(response._content, 'ok')
+        self.assertEqual(len(transport.session.calls), 4)
+        # full jitter: up to the base doubling each attempt, capped
+        self.assertEqual(self.random.bounds,
+                         [(0, 0.1), (0, 0.2), (0, 0.3)])
+        self.assertEqual(self.slept, [0.1, 0.2, 0.3])
+
+    def test_gives_up_after_retries(self):
+        transport = self._makeOne(*[DummyResponse([], status_code=500)
+                                    for i in range(4)])
+        response = transport.get('http://a/', idempotent=True)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(transport.session.calls), 4)
+        self.assertEqual(len(self.slept), 3)
+
+    def test_not_idempotent_not_retried(self):
+        import requests
+        transport = self._makeOne(requests.ConnectionError('reset'),
+                                  DummyResponse(['ok']))
+        self.assertRaises(requests.ConnectionError, transport.post,
+                          'http://a/')
+        transport = self._makeOne(DummyResponse([], status_code=502),
+                                  DummyResponse(['ok']))
+        response = transport.post('http://a/')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(transport.session.calls), 1)
+        self.assertEqual(self.slept, [])
+
+    def test_client_error_not_retried(self):
+        transport = self._makeOne(DummyResponse([], status_code=404))
+        response = transport.get('http://a/', idempotent=True)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.slept, [])
+
+    def test_backoff_must_fit_deadline(self):
+        import requests
+        transport = self._makeOne(requests.ConnectionError('reset'),
+                                  DummyResponse(['ok']),
+                                  retry_backoff=1, retry_backoff_max=2)
+        self.assertRaises(requests.ConnectionError, transport.get,
+                          'http://a/', idempotent=True,
+                          deadline=self._makeDeadline(0.5))
+        self.assertEqual(self.slept, [])
+
+    def test_send_uses_call_flags(self):
+        from velruse.transport import Call
+        transport = self._makeOne(DummyResponse([], status_code=500),
+                                  DummyResponse(['ok']))
+        call = Call('GET', 'http://a/', phase='profile', idempotent=True,
+                    headers={'Accept': 'application/json'})
+        response = transport.send(call)
+        self.assertEqual(response._content, 'ok')
+        method, url, kw = transport.session.calls[1]
+        self.assertEqual(kw['headers'], {'Accept': 'application/json'})
+
+
+class TestAdvanceFlow(unittest.TestCase):
+
+    def _callFUT(self, flows, value=None, exc_info=None):
+        from velruse.transport import advance_flow
+        return advance_flow(flows, value, exc_info)
+
+    def test_yields_calls_then_result(self):
+        from velruse.transport import Call
+
+        def flow():
+            response = yield Call('GET', 'http://a/')
+            yield 'result: %s' % response
+        flows = [flow()]
+        call = self._callFUT(flows)
+        self.assertEqual(call.url, 'http://a/')
+        self.assertEqual(self._callFUT(flows, 'ok'), 'result: ok')
+        self.assertEqual(flows, [])
+
+    def test_flow_without_result(self):
+        def flow():
+            return
+            yield
+        self.assertEqual(self._callFUT([flow()]), None)
+
+    def test_subflow(self):
+        from velruse.transport import Call
+
+        def inner():
+            response = yield Call('GET', 'http://inner/')
+            yield response.upper()
+
+        def outer():
+            value = yield inner()
+            yield 'outer: %s' % value
+        flows = [outer()]
+        call = self._callFUT(flows)
+        self.assertEqual(call.url, 'http://inner/')
+        self.assertEqual(len(flows), 2)
+        self.assertEqual(self._callFUT(flows, 'ok'), 'outer: OK')
+
+    def test_subflow_exception_propagates(self):
+        def inner():
+            raise ValueError('bad')
+            yield
+
+        def outer():
+            try:
+                yield inner()
+            except ValueError as e:
+                yield 'handled: %s' % e
+        self.assertEqual(self._callFUT([outer()]), 'handled: bad')
+
+    def test_unhandled_exception(self):
+        def inner():
+            raise ValueError('bad')
+            yield
+
+        def outer():
+            yield inner()
+        flows = [outer()]
+        self.assertRaises(ValueError, self._callFUT, flows)
+        self.assertEqual(flows, [])
+
+    def test_exc_info_thrown_into_flow(self):
+        import sys
+        from velruse.transport import Call
+
+        def flow():
+            try:
+                yield Call('GET', 'http://a/')
+            except KeyError:
+                yield 'recovered'
+        flows = [flow()]
+        self._callFUT(flows)
+        try:
+            raise KeyError('x')
+        except KeyError:
+            exc_info = sys.exc_info()
+        self.assertEqual(self._callFUT(flows, exc_info=exc_info),
+                         'recovered')
+
+
+class TestRun(unittest.TestCase):
+
+    def _makeOne(self, *results):
+        from velruse.transport import Transport
+        transport = Transport(name='dummy')
+        transport.session = DummySession(*results)
+        return transport
+
+    def test_sends_calls(self):
+        from velruse.transport import Call
+
+        def flow():
+            token = yield Call('POST', 'http://a/token', phase='access_token')
+            profile = yield Call('GET', 'http://a/me', phase='profile')
+            yield (token._content, profile._content)
+        transport = self._makeOne(DummyResponse(['t']),
+                                  DummyResponse(['p']))
+        self.assertEqual(transport.run(flow()), ('t', 'p'))
+        self.assertEqual([c[:2] for c in transport.session.calls],
+                         [('POST', 'http://a/token'), ('GET', 'http://a/me')])
+
+    def test_failure_raised_into_flow(self):
+        import requests
+        from velruse.transport import Call
+
+        def flow():
+            try:
+                yield Call('GET', 'http://a/')
+            except requests.ConnectionError:
+                yield 'failed'
+        transport = self._makeOne(requests.ConnectionError('reset'))
+        self.assertEqual(transport.run(flow()), 'failed')
+
+    def test_unhandled_failure(self):
+        import requests
+        from velruse.transport import Call
+
+        def flow():
+            yield Call('GET', 'http://a/')
+        transport = self._makeOne(requests.ConnectionError('reset'))
+        self.assertRaises(requests.ConnectionError, transport.run, flow())
+
+
+class TestTransportBreaker(unittest.TestCase):
+
+    def _makeOne(self, *results, **kw):
+        from velruse.transport import Transport
+        kw.setdefault('minimum_calls', 1)
+        kw.setdefault('failure_rate', 0.5)
+        transport = Transport(name='dummy', breaker=kw)
+        transport.session = DummySession(*results)
+        return transport
+
+    def test_disabled(self):
+        from velruse.transport import Transport
+        transport = Transport(name='dummy')
+        self.assertEqual(transport.breaker_for('https://a/'), None)
+
+    def test_keyed_by_provider_and_host(self):
+        transport = self._makeOne()
+        breaker = transport.breaker_for('https://api.example.com/token')
+        self.assertEqual(breaker.name, 'dummy:api.example.com')
+        self.assertEqual(breaker.failure_rate, 0.5)
+        self.assertTrue(
+            transport.breaker_for('https://api.example.com/me') is breaker)
+        other = transport.breaker_for('https://www.example.com/me')
+        self.assertEqual(other.name, 'dummy:www.example.com')
+        self.assertFalse(other is breaker)
+
+    def test_5xx_is_a_failure(self):
+        from velruse.breaker import OPEN
+        transport = self._makeOne(DummyResponse(['down'], status_code=503))
+        response = transport.request('GET', 'https://a/me')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(transport.breaker_for('https://a/').state, OPEN)
+
+    def test_4xx_is_not_a_failure(self):
+        from velruse.breaker import CLOSED
+        transport = self._makeOne(DummyResponse(['no'], status_code=404))
+        transport.request('GET', 'https://a/me')
+        self.assertEqual(transport.breaker_for('https://a/').state, CLOSED)
+
+    def test_open_breaker_skips_session(self):
+        import requests
+        from velruse.exceptions import CircuitOpen
+        from velruse.exceptions import ThirdPartyFailure
+        transport = self._makeOne(requests.ConnectionError('refused'),
+                                  DummyResponse(['ok']))
+        self.assertRaises(requests.ConnectionError, transport.request,
+                          'GET', 'https://a/me')
+        self.assertRaises(CircuitOpen, transport.request,
+                          'GET', 'https://a/me')
+        self.assertTrue(issubclass(CircuitOpen, ThirdPartyFailure))
+        self.assertEqual(len(transport.session.calls), 1)
+        # other hosts are not affected
+        transport.session.results.insert(0, DummyResponse(['ok']))
+        transport.request('GET', 'https://b/me')
+        self.assertEqual(len(transport.session.calls), 2)
+
+
+class TestTransportBulkhead(unittest.TestCase):
+
+    def _makeOne(self, *results, **kw):
+        from velruse.transport import Transport
+        kw.setdefault('max_concurrent', 1)
+        transport = Transport(name='dummy', bulkhead=kw)
+        transport.session = DummySession(*results)
+        active = []
+        request = transport.session.request
+
+        def record_active(method, url, **kw):
+            active.append(transport.bulkhead.active)
+            return request(method, url, **kw)
+        transport.session.request = record_active
+        return transport, active
+
+    def test_slot_held_during_call(self):
+        transport, active = self._makeOne(DummyResponse(['ok']),
+                                          DummyResponse(['ok']))
+        transport.request('GET', 'https://a/me')
+        transport.request('GET', 'https://a/me')
+        self.assertEqual(active, [1, 1])
+        self.assertEqual(transport.bulkhead.active, 0)
+
+    def test_slot_released_on_failure(self):
+        import requests
+        transport, active = self._makeOne(requests.ConnectionError('reset'))
+        self.assertRaises(requests.ConnectionError, transport.request,
+                          'GET', 'https://a/me')
+        self.assertEqual(active, [1])
+        self.assertEqual(transport.bulkhead.active, 0)
+
+    def test_slot_released_per_retry(self):
+        import requests
+        transport, active = self._makeOne(requests.ConnectionError('reset'),
+                                          DummyResponse(['ok']))
+        transport.retries = 1
+        transport.retry_backoff = 0
+        response = transport.request('GET', 'https://a/me',
+                                     idempotent=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(active, [1, 1])
+        self.assertEqual(transport.bulkhead.active, 0)
+
+    def test_saturated_skips_session(self):
+        from velruse.exceptions import BulkheadFull
+        from velruse.exceptions import ThirdPartyFailure
+        transport, active = self._makeOne(DummyResponse(['ok']))
+        transport.bulkhead.acquire()
+        self.assertRaises(BulkheadFull, transport.request,
+                          'GET', 'https://a/me')
+        self.assertTrue(issubclass(BulkheadFull, ThirdPartyFailure))
+        self.assertEqual(transport.session.calls, [])
+        self.assertEqual(transport.bulkhead.rejected, 1)
+        transport.bulkhead.release()
+        transport.request('GET', 'https://a/me')
+        self.assertEqual(len(transport.session.calls), 1)
+
+    def test_wait_bounded_by_deadline(self):
+        from velruse.exceptions import BulkheadFull
+        from velruse.transport import Deadline
+        transport, active = self._makeOne(DummyResponse(['ok']),
+                                          max_waiting=1)
+        transport.bulkhead.acquire()
+        self.assertRaises(BulkheadFull, transport.request,
+                          'GET', 'https://a/me', deadline=Deadline(0.01))
+        self.assertEqual(transport.session.calls, [])
+        self.assertEqual(transport.bulkhead.waiting, 0)
+
+
+class TestTransportFromSettings(unittest.TestCase):
+
+    def _callFUT(self, settings, prefix='provider.dummy.'):
+        from velruse.transport import transport_from_settings
+        return transport_from_settings(settings, prefix, name='dummy')
+
+    def test_defaults(self):
+        transport = self._callFUT({})
+        self.assertEqual(transport.name, 'dummy')
+        self.assertEqual(transport.breaker, None)
+        self.assertEqual(transport.bulkhead, None)
+        self.assertEqual(transport.hedger, None)
+
+    def test_breaker(self):
+        transport = self._callFUT({
+            'provider.dummy.breaker': 'true',
+            'provider.dummy.breaker.failure_rate': '0.25',
+            'provider.dummy.breaker.minimum_calls': '4',
+            'provider.dummy.breaker.window': '8',
+            'provider.dummy.breaker.reset_timeout': '2.5',
+            'provider.dummy.breaker.slow_call': '1.5',
+            'provider.dummy.breaker.half_open_calls': '2',
+            'provider.other.breaker.window': '99',
+        })
+        self.assertEqual(transport.breaker, {
+            'failure_rate': 0.25,
+            'minimum_calls': 4,
+            'window': 8,
+            'reset_timeout': 2.5,
+            'slow_call': 1.5,
+            'half_open_calls': 2,
+        })
+        breaker = transport.breaker_for('https://a/')
+        self.assertEqual((breaker.minimum_calls, breaker.outcomes.maxlen),
+                         (4, 8))
+
+    def test_bulkhead(self):
+        transport = self._callFUT({
+            'provider.dummy.max_concurrent': '4',
+            'provider.dummy.max_waiting': '2',
+            'provider.dummy.wait_timeout': '0.5',
+        })
+        bulkhead = transport.bulkhead
+        self.assertEqual(bulkhead.name, 'dummy')
+        self.assertEqual((bulkhead.max_concurrent, bulkhead.max_waiting,
+                          bulkhead.wait_timeout), (4, 2, 0.5))
+
+    def test_bulkhead_defaults(self):
+        transport = self._callFUT({'provider.dummy.max_concurrent': '4'})
+        bulkhead = transport.bulkhead
+        self.assertEqual((bulkhead.max_concurrent, bulkhead.max_waiting,
+                          bulkhead.wait_timeout), (4, 0, None))
+
+    def test_breaker_disabled(self):
+        transport = self._callFUT({
+            'provider.dummy.breaker': 'false',
+            'provider.dummy.breaker.window': '8',
+        })
+        self.assertEqual(transport.breaker, None)
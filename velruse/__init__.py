@@ -1,17 +1,47 @@
 class AuthenticationComplete(object):
-    """ An AuthenticationComplete context object"""
+    """ An AuthenticationComplete context object
+
+    Providers configured with ``lazy_profile`` don't fetch the user's
+    profile during the callback. Instead they pass a ``profile_loader``
+    callable which is invoked (once) the first time :attr:`profile` is
+    read. ``account`` carries whatever identity the provider returned
+    alongside the credentials (e.g. ``{'domain': 'live.com', 'userid': ..}``)
+    and is ``None`` if the provider doesn't return one without a profile
+    request.
+    """
 
     def __init__(self,
                  profile=None,
                  credentials=None,
                  provider_name=None,
-                 provider_type=None):
+                 provider_type=None,
+                 profile_loader=None,
+                 account=None):
         """Create an AuthenticationComplete object with user data"""
-        self.profile = profile
+        self._profile = profile
+        self._profile_loader = profile_loader
+        self.account = account
         self.credentials = credentials
         self.provider_name = provider_name
         self.provider_type = provider_type
 
+    def _get_profile(self):
+        if self._profile_loader is not None:
+            self._profile = self._profile_loader()
+            self._profile_loader = None
+        return self._profile
+
+    def _set_profile(self, value):
+        self._profile_loader = None
+        self._profile = value
+
+    profile = property(_get_profile, _set_profile)
+
+    @property
+    def profile_loaded(self):
+        """Whether the profile is available without an upstream request"""
+        return self._profile_loader is None
+
 
 class AuthenticationDenied(object):
     """ An AuthenticationDenied context object. Used when the provider
@@ -0,0 +1,227 @@
+"""Asynchronous execution of provider flows on Tornado's IOLoop
+
+Provider logins and callbacks are written as flows (see
+:class:`velruse.transport.Call`), so they can be driven without holding a
+thread while waiting on the provider:
+
+.. code-block:: python
+
+    from velruse.aio import run_flow
+
+    future = run_flow(provider.callback_flow(request))
+    future.add_done_callback(on_complete)
+
+The future resolves to the same context object the synchronous
+``provider.callback(request)`` returns, or raises the same exceptions.
+
+:func:`callback` applies the provider's ``timeout`` and
+``max_response_size`` settings and its circuit breakers. Its bulkhead
+(``max_concurrent``), ``retries`` and ``hedge`` settings do not apply:
+asynchronous calls are neither queued by the bulkhead, retried nor
+hedged.
+
+Fetches go through Tornado's shared ``AsyncHTTPClient``, which runs at
+most ``max_clients`` requests at a time (``10`` by default) and queues the
+others. Time spent queued counts against the request timeout, so a
+process serving many concurrent callbacks should raise the limit with
+:func:`configure_client` before the client is first used.
+
+Requires the optional ``tornado`` dependency, installed by the
+``velruse[tornado]`` (or ``velruse[async]``) extra.
+"""
+from __future__ import absolute_import
+
+import logging
+import sys
+import time
+import urllib
+
+from tornado.concurrent import Future
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPRequest
+
+from velruse.exceptions import CircuitOpen
+from velruse.exceptions import DeadlineExceeded
+from velruse.exceptions import ResponseTooLarge
+from velruse.exceptions import ThirdPartyFailure
+from velruse.transport import DEFAULT_MAX_RESPONSE_SIZE
+from velruse.transport import DEFAULT_PHASE_RESPONSE_SIZES
+from velruse.transport import advance_flow
+
+
+log = logging.getLogger(__name__)
+
+
+def configure_client(max_clients=None, settings=None, prefix='aio.'):
+    """Set how many requests the shared ``AsyncHTTPClient`` runs at once,
+    from ``max_clients`` or the ``max_clients`` setting under ``prefix``.
+
+    Must be called before the shared client is first created.
+
+    """
+    if max_clients is None and settings is not None:
+        max_clients = settings.get(prefix + 'max_clients')
+    if max_clients is not None:
+        AsyncHTTPClient.configure(None, max_clients=int(max_clients))
+
+
+class AsyncResponse(object):
+    """Expose a Tornado response through the subset of the ``requests``
+    response API used by provider flows"""
+    def __init__(self, response, content=None):
+        self.status_code = response.code
+        if content is None:
+            content = response.body or ''
+        self.content = content
+        self.headers = response.headers
+
+
+def _build_request(call, timeout, streaming_callback=None):
+    kw = dict(call.kw)
+    kw.pop('max_size', None)
+    headers = dict(kw.pop('headers', None) or {})
+    body = None
+    data = kw.pop('data', None)
+    if data is not None:
+        if isinstance(data, dict):
+            data = urllib.urlencode(data)
+            headers.setdefault('Content-Type',
+                               'application/x-www-form-urlencoded')
+        body = data
+    elif call.method == 'POST':
+        body = ''
+    return HTTPRequest(call.url, method=call.method, headers=headers,
+                       body=body, request_timeout=timeout,
+                       connect_timeout=timeout,
+                       streaming_callback=streaming_callback)
+
+
+def _max_size(call, transport):
+    limit = call.kw.get('max_size')
+    if limit:
+        return limit
+    if transport is not None:
+        return transport.max_size_for(call.phase)
+    return DEFAULT_PHASE_RESPONSE_SIZES.get(call.phase,
+                                            DEFAULT_MAX_RESPONSE_SIZE)
+
+
+def run_flow(flow, client=None, transport=None):
+    """Drive a provider flow on the current IOLoop.
+
+    Every :class:`~velruse.transport.Call` yielded by the flow is fetched
+    with ``client`` (an ``AsyncHTTPClient``, the shared instance by
+    default) and its response is sent back into the flow. Returns a
+    ``Future`` resolved with the flow's result.
+
+    Response bodies are streamed and the call fails with
+    :class:`~velruse.exceptions.ResponseTooLarge` once they grow past the
+    call's ``max_size`` or the limit for its phase.
+
+    When the provider's :class:`~velruse.transport.Transport` is given as
+    ``transport`` its ``max_response_size`` settings set those limits, its
+    ``timeout`` bounds calls made without a deadline and its circuit
+    breakers guard every call. Its bulkhead, retries and hedging are not
+    used.
+
+    """
+    if client is None:
+        client = AsyncHTTPClient()
+    future = Future()
+
+    flows = [flow]
+
+    def step(response=None, exc_info=None):
+        try:
+            item = advance_flow(flows, response, exc_info)
+        except Exception:
+            future.set_exc_info(sys.exc_info())
+            return
+        if not flows:
+            future.set_result(item)
+            return
+        fetch(item)
+
+    def fail(exc):
+        try:
+            raise exc
+        except Exception:
+            step(exc_info=sys.exc_info())
+
+    def fetch(call):
+        timeout = None
+        if call.deadline is not None:
+            timeout = call.deadline.remaining()
+            if timeout is not None and timeout <= 0:
+                fail(overrun(call))
+                return
+        elif transport is not None:
+            timeout = transport.timeout
+
+        breaker = None
+        if transport is not None:
+            breaker = transport.breaker_for(call.url)
+        if breaker is not None:
+            try:
+                breaker.before_call()
+            except CircuitOpen, e:
+                fail(e)
+                return
+        start = time.time()
+
+        limit = _max_size(call, transport)
+        chunks = []
+        received = [0]
+
+        def too_large():
+            return ResponseTooLarge(
+                'Upstream "%s" response exceeded %d bytes' % (
+                    call.phase, limit),
+                phase=call.phase, limit=limit)
+
+        def on_chunk(chunk):
+            received[0] += len(chunk)
+            if received[0] > limit:
+                # aborts the request, reported as a 599 response
+                raise too_large()
+            chunks.append(chunk)
+
+        def on_response(response):
+            if breaker is not None:
+                breaker.record(received[0] <= limit and response.code < 500,
+                               time.time() - start)
+            if received[0] > limit:
+                log.warning('"%s" response larger than %d bytes',
+                            call.phase, limit)
+                fail(too_large())
+                return
+            if response.code == 599:
+                if call.deadline is not None and call.deadline.expired:
+                    fail(overrun(call))
+                else:
+                    fail(ThirdPartyFailure('Upstream %s failed: %s' % (
+                        call.phase, response.error)))
+                return
+            step(AsyncResponse(response, ''.join(chunks)))
+
+        client.fetch(_build_request(call, timeout, on_chunk),
+                     callback=on_response)
+
+    def overrun(call):
+        deadline = call.deadline
+        log.warning('%.2fs deadline exceeded during "%s" (%.2fs elapsed)',
+                    deadline.timeout, call.phase, deadline.elapsed())
+        return DeadlineExceeded(
+            'Upstream deadline of %ss exceeded during "%s"' % (
+                deadline.timeout, call.phase),
+            phase=call.phase)
+
+    step()
+    return future
+
+
+def callback(provider, request, client=None):
+    """Asynchronous counterpart of ``provider.callback(request)`` for
+    providers exposing a ``callback_flow``"""
+    return run_flow(provider.callback_flow(request), client,
+                    getattr(provider, 'transport', None))
@@ -1,16 +1,47 @@
 """Velruse Authentication API"""
+from pyramid.exceptions import ConfigurationError
+
 from velruse import (
     AuthenticationComplete,
     AuthenticationDenied,
     login_url,
 )  # bw compat
+from velruse.state import signed_state_from_settings
+from velruse.transport import transport_from_settings
 
 
 def register_provider(config, name, provider):
     """
     Add a provider to the registry. This will also provide conflict
     detection by detecting duplicate provider names.
+
+    The provider is also given a pooled :class:`velruse.transport.Transport`
+    as ``provider.transport``, configured from the ``provider.<name>.pool_*``
+    and ``provider.<name>.timeout`` settings. It is shared by every request
+    served by the provider and stored in ``registry.velruse_transports``.
+
+    ``<name>`` is always the ``name`` the provider is registered under
+    here, i.e. the ``name`` argument of ``config.add_<provider>_login``
+    (``facebook``, ``twitter``... by default), regardless of the prefix its
+    other settings were read from. A provider added with ``name='work'``
+    reads ``provider.work.timeout``.
+
+    When the ``provider.<name>.state_secret`` setting is present the
+    provider is also given a :class:`velruse.state.SignedState` as
+    ``provider.signed_state``, to carry its login state in signed values
+    instead of the session. Providers keeping OAuth1 request tokens there
+    (those with a true ``saves_request_token`` attribute) also need
+    ``provider.<name>.state_encrypt``, as the token includes its secret;
+    ``ConfigurationError`` is raised otherwise.
     """
+    signed_state = signed_state_from_settings(
+        config.registry.settings or {}, prefix='provider.%s.' % name)
+    if (signed_state is not None and not signed_state.encrypted and
+            getattr(provider, 'saves_request_token', False)):
+        raise ConfigurationError(
+            'provider %s keeps OAuth1 request tokens in cookies when '
+            'provider.%s.state_secret is set, which requires '
+            'provider.%s.state_encrypt = true' % (name, name, name))
 
     def register():
         registry = config.registry
@@ -19,6 +50,18 @@ def register_provider(config, name, provider):
             providers = {}
             registry.velruse_providers = providers
 
+        if not hasattr(registry, 'velruse_transports'):
+            registry.velruse_transports = {}
+
+        transport = transport_from_settings(registry.settings or {},
+                                            prefix='provider.%s.' % name,
+                                            name=name)
+        registry.velruse_transports[name] = transport
+        provider.transport = transport
+
+        if signed_state is not None:
+            provider.signed_state = signed_state
+
         registry.velruse_providers[name] = provider
 
     config.action(('velruse-provider', name), register)
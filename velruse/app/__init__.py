@@ -1,5 +1,6 @@
 import logging
 import os
+from urlparse import urlsplit
 
 from anykeystore import create_store_from_settings
 
@@ -7,13 +8,43 @@ from pyramid.config import Configurator
 from pyramid.exceptions import ConfigurationError
 from pyramid.response import Response
 
+from velruse.app.utils import consume
 from velruse.app.utils import generate_token
 from velruse.app.utils import redirect_form
+from velruse.dnscache import install_dns_cache
+from velruse.memstore import memory_store_from_settings
+from velruse.serializers import serializer_from_settings
+from velruse.session import StoreSessionFactory
+from velruse.transport import asbool
+from velruse.warmup import warm_up
 
 
 log = logging.getLogger(__name__)
 
 
+def result_ttl(request):
+    """Return the number of seconds results are kept for, set by the
+    ``result.ttl`` setting"""
+    return int(request.registry.settings.get('result.ttl', 300))
+
+
+def encode_result(request, result):
+    """Serialize ``result`` with the ``result.serializer`` configured for
+    stored results, if any"""
+    serializer = getattr(request.registry, 'velruse_result_serializer', None)
+    if serializer is None:
+        return result
+    return serializer.dumps(result)
+
+
+def decode_result(request, value):
+    """Reverse :func:`encode_result`"""
+    serializer = getattr(request.registry, 'velruse_result_serializer', None)
+    if serializer is None:
+        return value
+    return serializer.loads(value)
+
+
 def auth_complete_view(context, request):
     endpoint = request.registry.settings.get('endpoint')
     token = generate_token()
@@ -27,7 +58,8 @@ def auth_complete_view(context, request):
         'profile': context.profile,
         'credentials': context.credentials,
     }
-    storage.store(token, result_data, expires=300)
+    storage.store(token, encode_result(request, result_data),
+                  expires=result_ttl(request))
     form = redirect_form(endpoint, token)
     return Response(body=form)
 
@@ -41,7 +73,8 @@ def auth_denied_view(context, request):
         'provider_name': context.provider_name,
         'error': context.reason,
     }
-    storage.store(token, error_dict, expires=300)
+    storage.store(token, encode_result(request, error_dict),
+                  expires=result_ttl(request))
     form = redirect_form(endpoint, token)
     return Response(body=form)
 
@@ -51,11 +84,15 @@ def auth_info_view(request):
     storage = request.registry.velruse_store
     token = request.GET.get('token')
     try:
-        return storage.retrieve(token)
+        if asbool(request.registry.settings.get('result.consume', False)):
+            result = consume(storage, token)
+        else:
+            result = storage.retrieve(token)
     except KeyError:
         log.info('auth_info requested invalid token "%s"')
         request.response.status = 400
         return None
+    return decode_result(request, result)
 
 
 def default_setup(config):
@@ -66,42 +103,84 @@ def default_setup(config):
 
     Relevant settings:
 
+    ``session.type`` is ``cookie`` (the default) to keep session data in
+    the cookie itself, or ``store`` to keep it in the storage backend with
+    only a signed session id in the cookie, see
+    :func:`velruse.session.StoreSessionFactory`.
+
     ``session.secret`` controls the secret used when signing the session
     cookies and will be randomly generated if unspecified.
 
     ``session.cookie_name`` is the name of the cookie stored on a client's
     browser and will default to 'velruse.session'.
 
+    ``session.serializer`` is ``pickle``, ``json`` or ``msgpack`` and
+    ``session.compress`` zlib-compresses serialized sessions of at least
+    ``session.compress_threshold`` bytes (``256``), see
+    :func:`velruse.serializers.serializer_from_settings`. When either is
+    set, cookie sessions are signed by Pyramid's
+    ``SignedCookieSessionFactory``.
+
+    ``session.timeout`` is the number of seconds a ``store`` session is
+    kept after it was last changed and defaults to ``1200``.
+
     ``store.*`` settings are used by the `anykeystore` library to construct
     a storage backend for user credentials. If no storage settings are
-    specified then an in-memory storage backend will be used.
+    specified then a bounded in-memory storage backend will be used, see
+    :class:`velruse.memstore.BoundedMemoryStore`.
 
     """
+    from pyramid.session import SignedCookieSessionFactory
     from pyramid.session import UnencryptedCookieSessionFactoryConfig
 
-    log.info('Using an unencrypted cookie-based session. This can be '
-             'changed by pointing the "velruse.setup" setting at a different '
-             'function for configuring the session factory.')
-
     settings = config.registry.settings
+
+    # setup backing storage
+    storage_string = settings.get('store', 'bounded_memory')
+    if storage_string == 'bounded_memory':
+        store = memory_store_from_settings(settings, prefix='store.')
+    else:
+        settings['store.store'] = storage_string
+        store = create_store_from_settings(settings, prefix='store.')
+    config.register_velruse_store(store)
+
+    session_type = settings.get('session.type', 'cookie')
+    if session_type not in ('cookie', 'store'):
+        raise ConfigurationError(
+            'unknown session type "%s", expected "cookie" or "store"'
+            '' % session_type)
+    if session_type == 'cookie':
+        log.info('Using an unencrypted cookie-based session. This can be '
+                 'changed by pointing the "velruse.setup" setting at a '
+                 'different function for configuring the session factory.')
+
     secret = settings.get('session.secret')
     cookie_name = settings.get('session.cookie_name', 'velruse.session')
     if secret is None:
-        log.warn('Configuring unencrypted cookie-based session with a '
-                 'random secret which will invalidate old cookies when '
-                 'restarting the app.')
+        log.warn('Configuring %s session with a random secret which will '
+                 'invalidate old cookies when restarting the app.',
+                 'unencrypted cookie-based' if session_type == 'cookie'
+                 else 'store-based')
         secret = ''.join('%02x' % ord(x) for x in os.urandom(16))
         log.info('autogenerated session secret: %s', secret)
-    factory = UnencryptedCookieSessionFactoryConfig(
-        secret, cookie_name=cookie_name)
+    try:
+        serializer = serializer_from_settings(settings, prefix='session.')
+    except (ImportError, ValueError), e:
+        raise ConfigurationError(str(e))
+    if session_type == 'store':
+        factory = StoreSessionFactory(
+            secret, store=store, cookie_name=cookie_name,
+            timeout=int(settings.get('session.timeout', 1200)),
+            serializer=serializer)
+    elif serializer is not None:
+        factory = SignedCookieSessionFactory(
+            secret, cookie_name=cookie_name, hashalg='sha256',
+            salt='velruse.session.', serializer=serializer)
+    else:
+        factory = UnencryptedCookieSessionFactoryConfig(
+            secret, cookie_name=cookie_name)
     config.set_session_factory(factory)
 
-    # setup backing storage
-    storage_string = settings.get('store', 'memory')
-    settings['store.store'] = storage_string
-    store = create_store_from_settings(settings, prefix='store.')
-    config.register_velruse_store(store)
-
 
 def register_velruse_store(config, storage):
     """Add key/value store for Velruse to the Pyramid application.
@@ -153,11 +232,59 @@ def load_provider(config, provider):
     loader(prefix='provider.%s.' % provider)
 
 
+def setup_warmup(config):
+    """Install the DNS cache and warm up provider connections.
+
+    Relevant settings:
+
+    ``dns_cache`` caches the resolution of every provider host in-process,
+    honoring the TTL of its DNS record (when ``dnspython`` is installed,
+    otherwise ``dns_cache.ttl`` seconds) clamped between
+    ``dns_cache.min_ttl`` and ``dns_cache.max_ttl``. Record lookups give up
+    after ``dns_cache.lookup_timeout`` seconds (default ``1``).
+
+    ``warmup`` resolves and opens a pooled connection to every provider
+    host, waiting at most ``warmup.timeout`` seconds (default ``5``).
+    ``warmup.connect = false`` only resolves them, which is what an
+    application preloaded before its server forks workers should use.
+
+    """
+    settings = config.registry.settings
+    dns_cache = None
+    if asbool(settings.get('dns_cache', False)):
+        kw = {}
+        for key in ('ttl', 'min_ttl', 'max_ttl'):
+            value = settings.get('dns_cache.' + key)
+            if value is not None:
+                kw[key] = int(value)
+        value = settings.get('dns_cache.lookup_timeout')
+        if value is not None:
+            kw['lookup_timeout'] = float(value)
+        dns_cache = install_dns_cache(**kw)
+    if asbool(settings.get('warmup', False)):
+        timeout = float(settings.get('warmup.timeout', 5))
+        connect = asbool(settings.get('warmup.connect', True))
+        warm_up(config.registry, timeout=timeout, dns_cache=dns_cache,
+                connect=connect)
+    elif dns_cache is not None:
+        providers = getattr(config.registry, 'velruse_providers', {})
+        for provider in providers.values():
+            for url in getattr(provider, 'upstream_urls', ()):
+                dns_cache.add_host(urlsplit(url).hostname)
+
+
 def includeme(config):
     """Add the Velruse standalone app configuration to a Pyramid app."""
     settings = config.registry.settings
     config.add_directive('register_velruse_store', register_velruse_store)
 
+    # optionally encode the results kept for auth_info
+    try:
+        config.registry.velruse_result_serializer = serializer_from_settings(
+            settings, prefix='result.')
+    except (ImportError, ValueError), e:
+        raise ConfigurationError(str(e))
+
     # setup application
     setup = settings.get('setup') or default_setup
     if setup:
@@ -171,6 +298,12 @@ def includeme(config):
     for provider in find_providers(settings):
         load_provider(config, provider)
 
+    # optionally resolve and connect to provider hosts before serving
+    if asbool(settings.get('warmup', False)) or \
+            asbool(settings.get('dns_cache', False)):
+        config.action('velruse-warmup', setup_warmup, args=(config,),
+                      order=1)
+
     # check for required settings
     if not settings.get('endpoint'):
         raise ConfigurationError(
@@ -1,5 +1,10 @@
+from datetime import datetime
 import uuid
 
+from anykeystore.backends.memory import MemoryStore
+from anykeystore.backends.redis import RedisStore
+from anykeystore.compat import pickle
+
 from velruse.app.baseconvert import base_encode
 
 
@@ -29,3 +34,35 @@ for (var i = 0; i < elements.length; i++) {
 def generate_token():
     """Generate a random token"""
     return base_encode(uuid.uuid4().int)
+
+
+def consume(storage, key):
+    """Retrieve the value of ``key`` from ``storage`` and delete it in a
+    single operation, raising ``KeyError`` if it is missing.
+
+    Backends may provide their own ``consume(key)``. For anykeystore's
+    memory backend the entry is popped at once and for Redis both commands
+    are sent in one ``MULTI`` transaction, so a value can only ever be
+    consumed once. Other backends fall back to a retrieve followed by a
+    delete.
+
+    """
+    if hasattr(storage, 'consume'):
+        return storage.consume(key)
+    if isinstance(storage, MemoryStore):
+        data = storage._store.pop(key, None)
+        if data:
+            value, expires = data
+            if expires is None or datetime.utcnow() < expires:
+                return value
+        raise KeyError(key)
+    if isinstance(storage, RedisStore):
+        pipe = storage._get_conn().pipeline(transaction=True)
+        redis_key = storage._make_key(key)
+        data, _ = pipe.get(redis_key).delete(redis_key).execute()
+        if data:
+            return pickle.loads(data)
+        raise KeyError(key)
+    value = storage.retrieve(key)
+    storage.delete(key)
+    return value
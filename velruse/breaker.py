@@ -0,0 +1,104 @@
+"""Circuit breaker guarding calls to an upstream host"""
+from collections import deque
+import logging
+import threading
+import time
+
+from velruse.exceptions import CircuitOpen
+
+
+log = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """Track the health of an upstream host and fail fast while it is down.
+
+    The outcome of the last ``window`` calls is kept. Once at least
+    ``minimum_calls`` have been seen and the share of failures reaches
+    ``failure_rate`` the circuit opens: for the next ``reset_timeout``
+    seconds :meth:`before_call` raises
+    :class:`velruse.exceptions.CircuitOpen` without touching the network.
+    Afterwards the circuit is half-open and lets ``half_open_calls`` probes
+    through; if they all succeed the circuit closes again, otherwise it
+    re-opens.
+
+    Calls taking longer than ``slow_call`` seconds count as failures even
+    if they eventually succeed.
+
+    """
+    def __init__(self,
+                 name=None,
+                 failure_rate=0.5,
+                 minimum_calls=10,
+                 window=50,
+                 reset_timeout=30.0,
+                 slow_call=None,
+                 half_open_calls=1,
+                 clock=time.time):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+
+        self.state = CLOSED
+        self.opened_at = None
+        self.outcomes = deque(maxlen=window)
+        self.probes = 0
+        self.probe_successes = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raise :class:`CircuitOpen` unless a call may go through"""
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpen(
+                        'Circuit for %s is open' % self.name)
+                self.state = HALF_OPEN
+                self.probes = self.probe_successes = 0
+                log.info('circuit %s half-open, probing', self.name)
+            if self.probes >= self.half_open_calls:
+                raise CircuitOpen(
+                    'Circuit for %s is half-open, probe in flight' % self.name)
+            self.probes += 1
+
+    def record(self, success, duration=None):
+        """Record the outcome of a call let through by :meth:`before_call`"""
+        if (success and self.slow_call is not None and
+                duration is not None and duration > self.slow_call):
+            success = False
+        with self.lock:
+            if self.state == HALF_OPEN:
+                if not success:
+                    self._open()
+                    return
+                self.probe_successes += 1
+                if self.probe_successes >= self.half_open_calls:
+                    log.info('circuit %s closed', self.name)
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                return
+            if self.state == OPEN:
+                return
+            self.outcomes.append(success)
+            total = len(self.outcomes)
+            if total < self.minimum_calls:
+                return
+            failures = total - sum(self.outcomes)
+            if float(failures) / total >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        log.warning('circuit %s opened', self.name)
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.outcomes.clear()
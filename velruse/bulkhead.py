@@ -0,0 +1,74 @@
+"""Concurrency limits isolating providers from each other"""
+import logging
+import threading
+import time
+
+from velruse.exceptions import BulkheadFull
+
+
+log = logging.getLogger(__name__)
+
+
+class Bulkhead(object):
+    """Limit how many upstream calls to one provider run at once.
+
+    Up to ``max_concurrent`` calls proceed immediately. Up to
+    ``max_waiting`` more wait, for at most ``wait_timeout`` seconds, for one
+    of them to finish. Any other call is rejected straight away with
+    :class:`velruse.exceptions.BulkheadFull`, so a slow provider cannot tie
+    up every worker thread of the process.
+
+    """
+    def __init__(self,
+                 name=None,
+                 max_concurrent=10,
+                 max_waiting=0,
+                 wait_timeout=None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting at most ``timeout`` seconds (further
+        bounded by ``wait_timeout``) when all of them are busy"""
+        if self.wait_timeout is not None:
+            if timeout is None or self.wait_timeout < timeout:
+                timeout = self.wait_timeout
+        with self.cond:
+            if self.active < self.max_concurrent:
+                self.active += 1
+                return
+            if self.waiting >= self.max_waiting:
+                self._reject('%d calls in flight' % self.active)
+            self.waiting += 1
+            try:
+                expires = None
+                if timeout is not None:
+                    expires = time.time() + timeout
+                while self.active >= self.max_concurrent:
+                    remaining = None
+                    if expires is not None:
+                        remaining = expires - time.time()
+                        if remaining <= 0:
+                            self._reject('timed out waiting for a slot')
+                    self.cond.wait(remaining)
+                self.active += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+    def _reject(self, reason):
+        self.rejected += 1
+        log.warning('bulkhead %s full: %s', self.name, reason)
+        raise BulkheadFull('Too many concurrent calls to %s: %s' % (
+            self.name, reason))
@@ -0,0 +1,54 @@
+"""Decoding of upstream response bodies"""
+from json import JSONDecoder
+from json.decoder import WHITESPACE
+from urlparse import parse_qs
+
+from velruse.exceptions import MalformedResponse
+
+
+_decoder = JSONDecoder()
+
+
+def json_body(response):
+    """Decode the JSON body of ``response``"""
+    return _decode_json(response.content, 0, '')
+
+
+def jsonp_body(response):
+    """Decode the JSON wrapped in a ``callback( ... );`` JSON-P body of
+    ``response``.
+
+    The JSON is decoded in place, without slicing the body into a copy
+    first, and any callback name or padding is accepted.
+
+    """
+    content = response.content
+    start = content.find('(')
+    if start < 0:
+        raise MalformedResponse('Expected a JSON-P response, got: %r'
+                                % content[:100])
+    return _decode_json(content, start + 1, ');')
+
+
+def form_body(response):
+    """Decode the ``application/x-www-form-urlencoded`` body of
+    ``response`` into a dict of lists"""
+    data = parse_qs(response.content)
+    if not data:
+        raise MalformedResponse('Expected a form-encoded response, got: %r'
+                                % response.content[:100])
+    return data
+
+
+def _decode_json(content, start, trailer):
+    try:
+        start = WHITESPACE.match(content, start).end()
+        data, end = _decoder.raw_decode(content, start)
+    except ValueError as e:
+        raise MalformedResponse('Invalid JSON response (%s): %r'
+                                % (e, content[:100]))
+    rest = content[end:].strip()
+    if rest and not trailer.startswith(rest.replace(' ', '')):
+        raise MalformedResponse('Unexpected data after JSON response: %r'
+                                % rest[:100])
+    return data
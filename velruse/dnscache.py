@@ -0,0 +1,113 @@
+"""In-process DNS cache for upstream provider hosts"""
+from __future__ import absolute_import
+
+import logging
+import socket
+import threading
+import time
+
+try:
+    import dns.resolver
+except ImportError:  # pragma: no cover
+    dns = None
+
+
+log = logging.getLogger(__name__)
+
+
+class DNSCache(object):
+    """Cache ``socket.getaddrinfo`` results for a known set of hosts.
+
+    Only hosts added with :meth:`add_host` are cached, every other lookup
+    goes straight to the system resolver. Entries are kept for the TTL of
+    the host's ``A`` record when the optional ``dnspython`` package is
+    installed and for ``ttl`` seconds otherwise, clamped between
+    ``min_ttl`` and ``max_ttl``. The record is looked up once per TTL for
+    each host and given up after ``lookup_timeout`` seconds, falling back
+    to ``ttl``.
+
+    The cache only takes effect once :meth:`install` has been called,
+    which routes the process' ``socket.getaddrinfo`` through it.
+
+    """
+    def __init__(self, ttl=300, min_ttl=30, max_ttl=3600, lookup_timeout=1.0,
+                 clock=time.time):
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.lookup_timeout = lookup_timeout
+        self.clock = clock
+
+        self.hosts = set()
+        self.entries = {}
+        self.ttls = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._getaddrinfo = socket.getaddrinfo
+        self.installed = False
+
+    def add_host(self, host):
+        self.hosts.add(host)
+
+    def record_ttl(self, host):
+        """Return how long resolutions of ``host`` may be cached"""
+        now = self.clock()
+        expires = self.ttls.get(host)
+        if expires is not None and expires > now:
+            return expires - now
+        ttl = self.ttl
+        if dns is not None:
+            try:
+                ttl = dns.resolver.query(host, 'A',
+                                         lifetime=self.lookup_timeout
+                                         ).rrset.ttl
+            except Exception:
+                log.debug('could not look up the TTL of %s', host,
+                          exc_info=True)
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        self.ttls[host] = now + ttl
+        return ttl
+
+    def getaddrinfo(self, host, port, *args, **kw):
+        if host not in self.hosts:
+            return self._getaddrinfo(host, port, *args, **kw)
+        key = (host, port, args, tuple(sorted(kw.items())))
+        now = self.clock()
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        result = self._getaddrinfo(host, port, *args, **kw)
+        # the TTL may take a DNS query, keep it out of the lock
+        expires = now + self.record_ttl(host)
+        with self.lock:
+            self.entries[key] = (expires, result)
+        return result
+
+    def install(self):
+        """Route ``socket.getaddrinfo`` through this cache"""
+        if not self.installed:
+            socket.getaddrinfo = self.getaddrinfo
+            self.installed = True
+
+    def uninstall(self):
+        if self.installed:
+            socket.getaddrinfo = self._getaddrinfo
+            self.installed = False
+
+
+_dns_cache = None
+_dns_cache_lock = threading.Lock()
+
+
+def install_dns_cache(**kw):
+    """Install the process-wide :class:`DNSCache`, creating it with ``kw``
+    on first use"""
+    global _dns_cache
+    with _dns_cache_lock:
+        if _dns_cache is None:
+            _dns_cache = DNSCache(**kw)
+            _dns_cache.install()
+    return _dns_cache
@@ -17,3 +17,37 @@ class ThirdPartyFailure(VelruseException):
 
 class CSRFError(VelruseException):
     """Raised when CSRF validation fails"""
+
+
+class DeadlineExceeded(ThirdPartyFailure):
+    """Raised when a provider's upstream calls overrun the time budget of
+    the login or callback being processed. ``phase`` names the upstream
+    call that was in flight (or about to start) when the budget ran out."""
+
+    def __init__(self, message, phase=None):
+        ThirdPartyFailure.__init__(self, message)
+        self.phase = phase
+
+
+class CircuitOpen(ThirdPartyFailure):
+    """Raised without contacting the provider when its circuit breaker is
+    open because the upstream host has recently been failing"""
+
+
+class ResponseTooLarge(ThirdPartyFailure):
+    """Raised when an upstream response body exceeds the size allowed for
+    the call being made. ``limit`` is that size, in bytes."""
+
+    def __init__(self, message, phase=None, limit=None):
+        ThirdPartyFailure.__init__(self, message)
+        self.phase = phase
+        self.limit = limit
+
+
+class MalformedResponse(ThirdPartyFailure):
+    """Raised when an upstream response body cannot be decoded"""
+
+
+class BulkheadFull(ThirdPartyFailure):
+    """Raised without contacting the provider when it already has as many
+    upstream calls in flight, and waiting, as it is allowed"""
@@ -0,0 +1,93 @@
+"""Hedging of slow idempotent upstream calls"""
+from collections import deque
+import threading
+
+
+class LatencyTracker(object):
+    """Keep the latency of the last ``window`` successful calls to one
+    endpoint and report their ``percentile``"""
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, duration):
+        with self.lock:
+            self.samples.append(duration)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, percentile):
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        index = int(round(percentile / 100.0 * (len(samples) - 1)))
+        return samples[index]
+
+
+class Hedger(object):
+    """Decide when a second copy of a slow idempotent call may be sent.
+
+    A call is hedged once it has been waiting longer than the
+    ``percentile`` of the latency learnt for its endpoint (keyed by host
+    and phase) from the last ``window`` calls, but never before
+    ``min_samples`` calls were seen nor earlier than ``min_delay`` seconds.
+
+    Hedges are paid for from a budget: every call earns ``budget`` tokens
+    (up to ``max_tokens``) and every hedge spends one, so at most about
+    ``budget`` of the calls are duplicated and hedging stops when the
+    upstream is slow across the board instead of amplifying the load.
+
+    """
+    def __init__(self,
+                 percentile=95.0,
+                 min_samples=20,
+                 window=200,
+                 budget=0.1,
+                 max_tokens=10.0,
+                 min_delay=0.0):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.budget = budget
+        self.max_tokens = max_tokens
+        self.min_delay = min_delay
+
+        self.trackers = {}
+        self.tokens = max_tokens
+        self.hedged = 0
+        self.denied = 0
+        self.lock = threading.Lock()
+
+    def tracker(self, key):
+        tracker = self.trackers.get(key)
+        if tracker is None:
+            with self.lock:
+                tracker = self.trackers.setdefault(
+                    key, LatencyTracker(self.window))
+        return tracker
+
+    def delay(self, key):
+        """Seconds to wait for a call to ``key`` before hedging it, or
+        ``None`` if not enough is known about the endpoint yet"""
+        with self.lock:
+            self.tokens = min(self.tokens + self.budget, self.max_tokens)
+        tracker = self.tracker(key)
+        if len(tracker) < self.min_samples:
+            return None
+        return max(tracker.percentile(self.percentile), self.min_delay)
+
+    def record(self, key, duration):
+        self.tracker(key).record(duration)
+
+    def spend(self):
+        """Take a hedge from the budget, returning ``False`` when it is
+        exhausted"""
+        with self.lock:
+            if self.tokens < 1:
+                self.denied += 1
+                return False
+            self.tokens -= 1
+            self.hedged += 1
+            return True
@@ -0,0 +1,248 @@
+"""Bounded in-memory storage backend"""
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from anykeystore.compat import pickle
+from anykeystore.interfaces import KeyValueStore
+from anykeystore.utils import coerce_timedelta
+
+
+log = logging.getLogger(__name__)
+
+
+def _timedelta_seconds(expires):
+    delta = coerce_timedelta(expires)
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+# key prefixes of the velruse consumers sharing the store, which
+# memory_store_from_settings bounds separately from the results
+NAMESPACES = {
+    'session': 'velruse.session.',
+    'openid': 'velruse.openid.',
+}
+
+
+class _Partition(object):
+    """The keys of one namespace, oldest first, and their bounds"""
+
+    def __init__(self, max_entries=10000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.keys = OrderedDict()
+        self.bytes = 0
+
+    def full(self):
+        return len(self.keys) > self.max_entries or (
+            self.max_bytes is not None and self.bytes > self.max_bytes)
+
+
+class BoundedMemoryStore(KeyValueStore):
+    """In-process `anykeystore` backend with a hard size limit.
+
+    At most ``max_entries`` entries, and when ``max_bytes`` is set at most
+    that many bytes of values, are kept. Beyond either the oldest entries
+    are evicted. The size of a value is its length for strings and the
+    length of its pickle otherwise.
+
+    ``namespaces`` maps key prefixes to dicts of their own ``max_entries``
+    and ``max_bytes``. Keys under such a prefix are counted and evicted
+    separately from every other key, so that for instance a flood of
+    sessions cannot evict the stored login results.
+
+    Expiry is driven by a time wheel with ``resolution`` seconds per slot:
+    every entry is filed in the slot of its expiry time and whole slots are
+    dropped as time passes, so storing, retrieving, deleting and expiring
+    are all O(1). ``ttl`` is used when ``store`` is called without
+    ``expires``; ``None`` keeps such entries until they are evicted.
+
+    :attr:`stats` counts ``hits``, ``misses``, ``expired`` and ``evicted``
+    entries.
+
+    """
+    def __init__(self,
+                 max_entries=10000,
+                 max_bytes=None,
+                 ttl=None,
+                 resolution=1,
+                 namespaces=None,
+                 clock=time.time,
+                 backend_api=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.resolution = resolution
+        self.clock = clock
+
+        self.default = _Partition(max_entries, max_bytes)
+        # longest prefixes first so nested namespaces win
+        self.namespaces = sorted(
+            ((prefix, _Partition(**bounds))
+             for prefix, bounds in (namespaces or {}).items()),
+            key=lambda item: -len(item[0]))
+
+        self.entries = {}
+        self.slots = {}
+        self.next_slot = None
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = dict(hits=0, misses=0, expired=0, evicted=0)
+
+    @classmethod
+    def backend_api(cls):
+        return None
+
+    def _partition(self, key):
+        for prefix, partition in self.namespaces:
+            if key.startswith(prefix):
+                return partition
+        return self.default
+
+    def _size(self, value, partition):
+        if partition.max_bytes is None:
+            return 0
+        if isinstance(value, basestring):
+            return len(value)
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def _slot(self, expires_at):
+        return int(expires_at // self.resolution)
+
+    def _drop(self, key):
+        value, expires_at, size, partition = self.entries.pop(key)
+        del partition.keys[key]
+        partition.bytes -= size
+        self.bytes -= size
+        return value, expires_at
+
+    def _remove(self, key):
+        value, expires_at = self._drop(key)
+        if expires_at is not None:
+            slot = self.slots.get(self._slot(expires_at))
+            if slot is not None:
+                slot.discard(key)
+        return value, expires_at
+
+    def _expire(self, now):
+        current = self._slot(now)
+        if self.next_slot is None or \
+                current - self.next_slot > len(self.slots):
+            due = [s for s in self.slots if s < current]
+        else:
+            due = range(self.next_slot, current)
+        for index in due:
+            for key in self.slots.pop(index, ()):
+                self._drop(key)
+                self.stats['expired'] += 1
+        # entries in the current slot are checked on access
+        self.next_slot = current
+
+    def _evict(self, partition):
+        while partition.full():
+            self._remove(next(iter(partition.keys)))
+            self.stats['evicted'] += 1
+            if self.stats['evicted'] == 1:
+                log.warning('memory store is full, evicting the oldest '
+                            'entries (max_entries=%s, max_bytes=%s)',
+                            partition.max_entries, partition.max_bytes)
+
+    def _get(self, key, consume):
+        now = self.clock()
+        with self.lock:
+            self._expire(now)
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is not None and \
+                    entry[1] <= now:
+                self._remove(key)
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                raise KeyError(key)
+            if consume:
+                self._remove(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def retrieve(self, key):
+        return self._get(key, False)
+
+    def consume(self, key):
+        """Retrieve and delete ``key`` at once, see
+        :func:`velruse.app.utils.consume`"""
+        return self._get(key, True)
+
+    def _put(self, key, value, expires, replace):
+        now = self.clock()
+        if expires is None:
+            expires = self.ttl
+        expires_at = None
+        if expires is not None:
+            expires_at = now + _timedelta_seconds(expires)
+        partition = self._partition(key)
+        size = self._size(value, partition)
+        with self.lock:
+            self._expire(now)
+            if key in self.entries:
+                entry = self.entries[key]
+                if not replace and (entry[1] is None or entry[1] > now):
+                    return False
+                self._remove(key)
+            self.entries[key] = (value, expires_at, size, partition)
+            partition.keys[key] = None
+            partition.bytes += size
+            self.bytes += size
+            if expires_at is not None:
+                self.slots.setdefault(self._slot(expires_at), set()).add(key)
+            self._evict(partition)
+            return True
+
+    def store(self, key, value, expires=None):
+        self._put(key, value, expires, True)
+
+    def add(self, key, value, expires=None):
+        """Store ``value`` only if ``key`` is absent, returning whether it
+        was stored"""
+        return self._put(key, value, expires, False)
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def purge_expired(self):
+        with self.lock:
+            self._expire(self.clock())
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _bounds(settings, prefix):
+    bounds = {}
+    for key in ('max_entries', 'max_bytes'):
+        value = settings.get(prefix + key)
+        if value is not None:
+            bounds[key] = int(value)
+    return bounds
+
+
+def memory_store_from_settings(settings, prefix='store.'):
+    """Return a :class:`BoundedMemoryStore` configured by the
+    ``max_entries``, ``max_bytes`` and ``ttl`` settings under ``prefix``.
+
+    Sessions and OpenID data (see ``NAMESPACES``) are bounded separately
+    by ``session.max_entries``/``session.max_bytes`` and
+    ``openid.max_entries``/``openid.max_bytes`` under ``prefix``.
+
+    """
+    kw = _bounds(settings, prefix)
+    value = settings.get(prefix + 'ttl')
+    if value is not None:
+        kw['ttl'] = int(value)
+    kw['namespaces'] = dict(
+        (key_prefix, _bounds(settings, '%s%s.' % (prefix, name)))
+        for name, key_prefix in NAMESPACES.items())
+    return BoundedMemoryStore(**kw)
@@ -3,11 +3,8 @@
 http://confluence.atlassian.com/display/BITBUCKET/OAuth+on+Bitbucket
 """
 
-import json
-from urlparse import parse_qs
 
 import oauth2 as oauth
-import requests
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -17,14 +14,24 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
+from velruse.decoding import (
+    form_body,
+    json_body,
+)
 from velruse.exceptions import ThirdPartyFailure
+from velruse.oauth1 import OAuth1Signer
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    load_request_token,
+    save_request_token,
+)
+from velruse.tokenpool import RequestTokenPool
+from velruse.transport import Transport
 
 
 REQUEST_URL = 'https://bitbucket.org/api/1.0/oauth/request_token/'
 ACCESS_URL = 'https://bitbucket.org/api/1.0/oauth/access_token/'
 USER_URL = 'https://bitbucket.org/api/1.0/user'
-SIGMETHOD = oauth.SignatureMethod_HMAC_SHA1()
 
 
 class BitbucketAuthenticationComplete(AuthenticationComplete):
@@ -44,6 +51,8 @@ def add_bitbucket_login_from_settings(config, prefix='velruse.bitbucket.'):
     p.update('consumer_secret', required=True)
     p.update('login_path')
     p.update('callback_path')
+    p.update('request_token_pool')
+    p.update('request_token_ttl')
     config.add_bitbucket_login(**p.kwargs)
 
 
@@ -52,11 +61,18 @@ def add_bitbucket_login(config,
                         consumer_secret,
                         login_path='/bitbucket/login',
                         callback_path='/bitbucket/login/callback',
+                        request_token_pool=0,
+                        request_token_ttl=300,
                         name='bitbucket'):
     """
     Add a Bitbucket login provider to the application.
+
+    When ``request_token_pool`` is set, up to that many request tokens are
+    fetched ahead of time, and kept for at most ``request_token_ttl``
+    seconds, so that logins can redirect without waiting on Bitbucket.
     """
-    provider = BitbucketProvider(name, consumer_key, consumer_secret)
+    provider = BitbucketProvider(name, consumer_key, consumer_secret,
+                                 request_token_pool, request_token_ttl)
 
     config.add_route(provider.login_route, login_path)
     config.add_view(provider, attr='login', route_name=provider.login_route,
@@ -70,60 +86,93 @@ def add_bitbucket_login(config,
 
 
 class BitbucketProvider(object):
-    def __init__(self, name, consumer_key, consumer_secret):
+    # the request token is kept until the callback, see save_request_token
+    saves_request_token = True
+
+    def __init__(self, name, consumer_key, consumer_secret,
+                 request_token_pool=0, request_token_ttl=300):
         self.name = name
         self.type = 'bitbucket'
+        self.transport = Transport(name)
+        self.upstream_urls = [REQUEST_URL, ACCESS_URL, USER_URL]
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
+        self.signer = OAuth1Signer(consumer_key, consumer_secret)
+        self.token_pool = None
+        if request_token_pool:
+            self.token_pool = RequestTokenPool(
+                self._fetch_request_token, size=int(request_token_pool),
+                ttl=int(request_token_ttl), name=name)
 
         self.login_route = 'velruse.%s-login' % name
         self.callback_route = 'velruse.%s-callback' % name
 
     def login(self, request):
         """Initiate a bitbucket login"""
-        # Create the consumer and client, make the request
-        consumer = oauth.Consumer(self.consumer_key, self.consumer_secret)
-        params = {'oauth_callback': request.route_url(self.callback_route)}
-
-        # We go through some shennanigans here to specify a callback url
-        oauth_request = oauth.Request.from_consumer_and_token(consumer,
-            http_url=REQUEST_URL, parameters=params)
-        oauth_request.sign_request(SIGMETHOD, consumer, None)
-        r = requests.get(REQUEST_URL, headers=oauth_request.to_header())
+        return self.transport.run(self.login_flow(request))
+
+    def login_flow(self, request):
+        """Generator form of :meth:`login` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        callback_url = request.route_url(self.callback_route)
+        content = None
+        if self.token_pool is not None:
+            content = self.token_pool.get(callback_url)
+        if content is None:
+            content = yield self.request_token_flow(
+                callback_url, self.transport.deadline())
+        request_token = oauth.Token.from_string(content)
 
+        req_url = 'https://bitbucket.org/api/1.0/oauth/authenticate/'
+        oauth_request = oauth.Request.from_token_and_callback(
+            token=request_token, http_url=req_url)
+        response = HTTPFound(location=oauth_request.to_url())
+        save_request_token(self, request, response, content)
+        yield response
+
+    def request_token_flow(self, callback_url, deadline):
+        """Flow fetching a new request token for ``callback_url``,
+        resulting in the raw token response"""
+        params = {'oauth_callback': callback_url}
+        r = yield self.signer.call('GET', REQUEST_URL, parameters=params,
+                                   header=True, deadline=deadline,
+                                   phase='request_token')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        request_token = oauth.Token.from_string(r.content)
-
-        request.session['token'] = r.content
+        yield r.content
 
-        req_url = 'https://bitbucket.org/api/1.0/oauth/authenticate/'
-        oauth_request = oauth.Request.from_token_and_callback(
-            token=request_token, http_url=req_url)
-        return HTTPFound(location=oauth_request.to_url())
+    def _fetch_request_token(self, callback_url):
+        return self.transport.run(self.request_token_flow(
+            callback_url, self.transport.deadline()))
 
     def callback(self, request):
         """Process the bitbucket redirect"""
-        if 'denied' in request.GET:
-            return AuthenticationDenied("User denied authentication",
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+        return self.transport.run(self.callback_flow(request))
 
-        request_token = oauth.Token.from_string(request.session['token'])
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        if 'denied' in request.GET:
+            yield AuthenticationDenied("User denied authentication",
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
+
+        deadline = self.transport.deadline()
+        request_token = oauth.Token.from_string(
+            load_request_token(self, request))
         verifier = request.GET.get('oauth_verifier')
         if not verifier:
             raise ThirdPartyFailure("No oauth_verifier returned")
         request_token.set_verifier(verifier)
 
-        # Create the consumer and client, make the request
-        consumer = oauth.Consumer(self.consumer_key, self.consumer_secret)
-
-        client = oauth.Client(consumer, request_token)
-        resp, content = client.request(ACCESS_URL, "POST")
-        if resp['status'] != '200':
-            raise ThirdPartyFailure("Status %s: %s" % (resp['status'], content))
-        access_token = dict(parse_qs(content))
+        r = yield self.signer.call('POST', ACCESS_URL, token=request_token,
+                                   deadline=deadline, phase='access_token')
+        if r.status_code != 200:
+            raise ThirdPartyFailure("Status %s: %s" % (
+                r.status_code, r.content))
+        access_token = form_body(r)
 
         cred = {'oauthAccessToken': access_token['oauth_token'][0],
                 'oauthAccessTokenSecret': access_token['oauth_token_secret'][0]}
@@ -131,10 +180,13 @@ class BitbucketProvider(object):
         # Make a request with the data for more user info
         token = oauth.Token(key=cred['oauthAccessToken'],
                             secret=cred['oauthAccessTokenSecret'])
-
-        client = oauth.Client(consumer, token)
-        resp, content = client.request(USER_URL)
-        user_data = json.loads(content)
+        r = yield self.signer.call('GET', USER_URL, token=token,
+                                   deadline=deadline, phase='profile',
+                                   idempotent=True)
+        if r.status_code != 200:
+            raise ThirdPartyFailure("Status %s: %s" % (
+                r.status_code, r.content))
+        user_data = json_body(r)
         data = user_data['user']
         # Setup the normalized contact info
         profile = {}
@@ -149,7 +201,7 @@ class BitbucketProvider(object):
             'familyName': data['last_name'],
             }
         profile['displayName'] = profile['name']['formatted']
-        return BitbucketAuthenticationComplete(profile=profile,
-                                               credentials=cred,
-                                               provider_name=self.name,
-                                               provider_type=self.type)
+        yield BitbucketAuthenticationComplete(profile=profile,
+                                              credentials=cred,
+                                              provider_name=self.name,
+                                              provider_type=self.type)
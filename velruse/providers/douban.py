@@ -1,11 +1,7 @@
 """Douban Authentication Views"""
-import json
-from urlparse import parse_qs
 
 import oauth2 as oauth
 
-import requests
-
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
 
@@ -14,14 +10,24 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
+from velruse.decoding import (
+    form_body,
+    json_body,
+)
 from velruse.exceptions import ThirdPartyFailure
+from velruse.oauth1 import OAuth1Signer
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    load_request_token,
+    save_request_token,
+)
+from velruse.tokenpool import RequestTokenPool
+from velruse.transport import Transport
 
 
 REQUEST_URL = 'http://www.douban.com/service/auth/request_token'
 ACCESS_URL = 'http://www.douban.com/service/auth/access_token'
 USER_URL = 'http://api.douban.com/people/%40me?alt=json'
-SIGMETHOD = oauth.SignatureMethod_HMAC_SHA1()
 
 
 class DoubanAuthenticationComplete(AuthenticationComplete):
@@ -41,6 +47,8 @@ def add_douban_login_from_settings(config, prefix='velruse.douban'):
     p.update('consumer_secret', required=True)
     p.update('login_path')
     p.update('callback_path')
+    p.update('request_token_pool')
+    p.update('request_token_ttl')
     config.add_douban_login(**p.kwargs)
 
 
@@ -49,11 +57,18 @@ def add_douban_login(config,
                      consumer_secret,
                      login_path='/login/douban',
                      callback_path='/login/douban/callback',
+                     request_token_pool=0,
+                     request_token_ttl=300,
                      name='douban'):
     """
     Add a Douban login provider to the application.
+
+    When ``request_token_pool`` is set, up to that many request tokens are
+    fetched ahead of time, and kept for at most ``request_token_ttl``
+    seconds, so that logins can redirect without waiting on Douban.
     """
-    provider = DoubanProvider(name, consumer_key, consumer_secret)
+    provider = DoubanProvider(name, consumer_key, consumer_secret,
+                              request_token_pool, request_token_ttl)
 
     config.add_route(provider.login_route, login_path)
     config.add_view(provider, attr='login', route_name=provider.login_route,
@@ -67,74 +82,113 @@ def add_douban_login(config,
 
 
 class DoubanProvider(object):
-    def __init__(self, name, consumer_key, consumer_secret):
+    # the request token is kept until the callback, see save_request_token
+    saves_request_token = True
+
+    def __init__(self, name, consumer_key, consumer_secret,
+                 request_token_pool=0, request_token_ttl=300):
         self.name = name
         self.type = 'douban'
+        self.transport = Transport(name)
+        self.upstream_urls = [REQUEST_URL, ACCESS_URL, USER_URL]
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
+        self.signer = OAuth1Signer(consumer_key, consumer_secret)
+        self.token_pool = None
+        if request_token_pool:
+            self.token_pool = RequestTokenPool(
+                self._fetch_request_token, size=int(request_token_pool),
+                ttl=int(request_token_ttl), name=name)
 
         self.login_route = 'velruse.%s-login' % name
         self.callback_route = 'velruse.%s-callback' % name
 
     def login(self, request):
         """Initiate a douban login"""
-        consumer = oauth.Consumer(self.consumer_key, self.consumer_secret)
-
-        oauth_request = oauth.Request.from_consumer_and_token(consumer,
-            http_url=REQUEST_URL)
-        oauth_request.sign_request(SIGMETHOD, consumer, None)
-        r = requests.get(REQUEST_URL, headers=oauth_request.to_header())
-
-        if r.status_code != 200:
-            raise ThirdPartyFailure("Status %s: %s" % (
-                r.status_code, r.content))
-        request_token = oauth.Token.from_string(r.content)
-
-        request.session['token'] = r.content
+        return self.transport.run(self.login_flow(request))
+
+    def login_flow(self, request):
+        """Generator form of :meth:`login` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        callback_url = request.route_url(self.callback_route)
+        content = None
+        if self.token_pool is not None:
+            content = self.token_pool.get(callback_url)
+        if content is None:
+            content = yield self.request_token_flow(
+                callback_url, self.transport.deadline())
+        request_token = oauth.Token.from_string(content)
 
         # Send the user to douban now for authorization
         req_url = 'http://www.douban.com/service/auth/authorize'
         oauth_request = oauth.Request.from_token_and_callback(
             token=request_token,
-            callback=request.route_url(self.callback_route),
+            callback=callback_url,
             http_url=req_url)
-        return HTTPFound(location=oauth_request.to_url())
+        response = HTTPFound(location=oauth_request.to_url())
+        save_request_token(self, request, response, content)
+        yield response
+
+    def request_token_flow(self, callback_url, deadline):
+        """Flow fetching a new request token for ``callback_url``,
+        resulting in the raw token response"""
+        r = yield self.signer.call('GET', REQUEST_URL, header=True,
+                                   deadline=deadline, phase='request_token')
+        if r.status_code != 200:
+            raise ThirdPartyFailure("Status %s: %s" % (
+                r.status_code, r.content))
+        yield r.content
+
+    def _fetch_request_token(self, callback_url):
+        return self.transport.run(self.request_token_flow(
+            callback_url, self.transport.deadline()))
 
     def callback(self, request):
         """Process the douban redirect"""
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
         if 'denied' in request.GET:
-            return AuthenticationDenied("User denied authentication",
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied("User denied authentication",
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
-        request_token = oauth.Token.from_string(request.session['token'])
+        deadline = self.transport.deadline()
+        request_token = oauth.Token.from_string(
+            load_request_token(self, request))
 
-        # Create the consumer and client, make the request
-        consumer = oauth.Consumer(self.consumer_key, self.consumer_secret)
-        client = oauth.Client(consumer, request_token)
-        resp, content = client.request(ACCESS_URL)
-        if resp['status'] != '200':
-            raise ThirdPartyFailure("Status %s: %s" % (resp['status'], content))
+        r = yield self.signer.call('GET', ACCESS_URL, token=request_token,
+                                   deadline=deadline, phase='access_token')
+        if r.status_code != 200:
+            raise ThirdPartyFailure("Status %s: %s" % (
+                r.status_code, r.content))
+        access_token = form_body(r)
 
-        access_token = dict(parse_qs(content))
         cred = {'oauthAccessToken': access_token['oauth_token'][0],
                 'oauthAccessTokenSecret': access_token['oauth_token_secret'][0]}
 
         douban_user_id = access_token['douban_user_id'][0]
+
+        # Make a request with the data for more user info
         token = oauth.Token(key=cred['oauthAccessToken'],
                             secret=cred['oauthAccessTokenSecret'])
-
-        client = oauth.Client(consumer, token)
-        resp, content = client.request(USER_URL)
-
-        user_data = json.loads(content)
+        r = yield self.signer.call('GET', USER_URL, token=token,
+                                   deadline=deadline, phase='profile',
+                                   idempotent=True)
+        if r.status_code != 200:
+            raise ThirdPartyFailure("Status %s: %s" % (
+                r.status_code, r.content))
+        user_data = json_body(r)
         # Setup the normalized contact info
         profile = {
             'accounts': [{'domain':'douban.com', 'userid':douban_user_id}],
             'displayName': user_data['title']['$t'],
             'preferredUsername': user_data['title']['$t'],
         }
-        return DoubanAuthenticationComplete(profile=profile,
-                                            credentials=cred,
-                                            provider_name=self.name,
-                                            provider_type=self.type)
+        yield DoubanAuthenticationComplete(profile=profile,
+                                           credentials=cred,
+                                           provider_name=self.name,
+                                           provider_type=self.type)
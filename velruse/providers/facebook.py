@@ -1,10 +1,6 @@
 """Facebook Authentication Views"""
 import datetime
-import uuid
-from json import loads
-from urlparse import parse_qs
-
-import requests
+from functools import partial
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -14,9 +10,20 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
-from velruse.exceptions import CSRFError
+from velruse.decoding import (
+    form_body,
+    json_body,
+)
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    issue_state,
+    verify_state,
+)
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -38,6 +45,7 @@ def add_facebook_login_from_settings(config, prefix='velruse.facebook.'):
     p.update('scope')
     p.update('login_path')
     p.update('callback_path')
+    p.update('lazy_profile')
     config.add_facebook_login(**p.kwargs)
 
 
@@ -47,11 +55,16 @@ def add_facebook_login(config,
                        scope=None,
                        login_path='/login/facebook',
                        callback_path='/login/facebook/callback',
+                       lazy_profile=False,
                        name='facebook'):
     """
     Add a Facebook login provider to the application.
+
+    When ``lazy_profile`` is true the user's profile is only fetched when
+    the ``profile`` of the resulting context is first read.
     """
-    provider = FacebookProvider(name, consumer_key, consumer_secret, scope)
+    provider = FacebookProvider(name, consumer_key, consumer_secret, scope,
+                                lazy_profile)
 
     config.add_route(provider.login_route, login_path)
     config.add_view(provider, attr='login', route_name=provider.login_route,
@@ -65,12 +78,16 @@ def add_facebook_login(config,
 
 
 class FacebookProvider(object):
-    def __init__(self, name, consumer_key, consumer_secret, scope):
+    def __init__(self, name, consumer_key, consumer_secret, scope,
+                 lazy_profile=False):
         self.name = name
         self.type = 'facebook'
+        self.transport = Transport(name)
+        self.upstream_urls = ['https://graph.facebook.com/']
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.scope = scope
+        self.lazy_profile = lazy_profile
 
         self.login_route = 'velruse.%s-login' % name
         self.callback_route = 'velruse.%s-callback' % name
@@ -78,33 +95,33 @@ class FacebookProvider(object):
     def login(self, request):
         """Initiate a facebook login"""
         scope = request.POST.get('scope', self.scope)
-        request.session['state'] = state = uuid.uuid4().hex
+        response = HTTPFound()
+        state = issue_state(self, request, response)
         fb_url = flat_url(
             'https://www.facebook.com/dialog/oauth/',
             scope=scope,
             client_id=self.consumer_key,
             redirect_uri=request.route_url(self.callback_route),
             state=state)
-        return HTTPFound(location=fb_url)
+        response.location = fb_url
+        return response
 
     def callback(self, request):
         """Process the facebook redirect"""
-        sess_state = request.session.get('state')
-        req_state = request.GET.get('state')
-        if not sess_state or sess_state != req_state:
-            raise CSRFError(
-                'CSRF Validation check failed. Request state {req_state} is not '
-                'the same as session state {sess_state}'.format(
-                    req_state=req_state,
-                    sess_state=sess_state
-                )
-            )
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
+        verify_state(self, request)
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error_reason', 'No reason provided.')
-            return AuthenticationDenied(reason=reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason=reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         # Now retrieve the access token with the code
         access_url = flat_url(
@@ -113,27 +130,44 @@ class FacebookProvider(object):
             client_secret=self.consumer_secret,
             redirect_uri=request.route_url(self.callback_route),
             code=code)
-        r = requests.get(access_url)
+        r = yield Call('GET', access_url, deadline=deadline,
+                       phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        access_token = parse_qs(r.content)['access_token'][0]
+        access_token = form_body(r)['access_token'][0]
 
-        # Retrieve profile data
+        cred = {'oauthAccessToken': access_token}
+        if self.lazy_profile:
+            yield FacebookAuthenticationComplete(
+                profile_loader=partial(self.load_profile, access_token),
+                credentials=cred,
+                provider_name=self.name,
+                provider_type=self.type)
+            return
+
+        profile = yield self.profile_flow(access_token, deadline)
+        yield FacebookAuthenticationComplete(profile=profile,
+                                             credentials=cred,
+                                             provider_name=self.name,
+                                             provider_type=self.type)
+
+    def load_profile(self, access_token):
+        """Fetch the profile of the user owning ``access_token``"""
+        return self.transport.run(
+            self.profile_flow(access_token, self.transport.deadline()))
+
+    def profile_flow(self, access_token, deadline):
+        """Flow retrieving and normalizing the user's profile"""
         graph_url = flat_url('https://graph.facebook.com/me',
                              access_token=access_token)
-        r = requests.get(graph_url)
+        r = yield Call('GET', graph_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        fb_profile = loads(r.content)
-        profile = extract_fb_data(fb_profile)
-
-        cred = {'oauthAccessToken': access_token}
-        return FacebookAuthenticationComplete(profile=profile,
-                                              credentials=cred,
-                                              provider_name=self.name,
-                                              provider_type=self.type)
+        fb_profile = json_body(r)
+        yield extract_fb_data(fb_profile)
 
 
 def extract_fb_data(data):
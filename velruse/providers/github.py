@@ -1,9 +1,6 @@
 """Github Authentication Views"""
-from json import loads
-from urlparse import parse_qs
+from functools import partial
 
-import requests
-import uuid
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -13,9 +10,20 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
-from velruse.exceptions import CSRFError
+from velruse.decoding import (
+    form_body,
+    json_body,
+)
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    issue_state,
+    verify_state,
+)
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -39,6 +47,7 @@ def add_github_login_from_settings(config, prefix='velruse.github.'):
     p.update('callback_path')
     p.update('secure')
     p.update('domain')
+    p.update('lazy_profile')
     config.add_github_login(**p.kwargs)
 
 
@@ -50,16 +59,21 @@ def add_github_login(config,
                      callback_path='/login/github/callback',
                      secure=True,
                      domain='github.com',
+                     lazy_profile=False,
                      name='github'):
     """
     Add a Github login provider to the application.
+
+    When ``lazy_profile`` is true the user's profile is only fetched when
+    the ``profile`` of the resulting context is first read.
     """
     provider = GithubProvider(name,
                               consumer_key,
                               consumer_secret,
                               scope,
                               secure,
-                              domain)
+                              domain,
+                              lazy_profile)
 
     config.add_route(provider.login_route, login_path)
     config.add_view(provider, attr='login', route_name=provider.login_route,
@@ -79,14 +93,21 @@ class GithubProvider(object):
                  consumer_secret,
                  scope,
                  secure,
-                 domain):
+                 domain,
+                 lazy_profile=False):
         self.name = name
         self.type = 'github'
+        self.transport = Transport(name)
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.scope = scope
         self.protocol = 'http' if secure is False else 'https'
         self.domain = domain
+        self.upstream_urls = [
+            '%s://%s/' % (self.protocol, self.domain),
+            '%s://api.%s/' % (self.protocol, self.domain),
+        ]
+        self.lazy_profile = lazy_profile
 
         self.login_route = 'velruse.%s-login' % name
         self.callback_route = 'velruse.%s-callback' % name
@@ -94,33 +115,33 @@ class GithubProvider(object):
     def login(self, request):
         """Initiate a github login"""
         scope = request.POST.get('scope', self.scope)
-        request.session['state'] = state = uuid.uuid4().hex
+        response = HTTPFound()
+        state = issue_state(self, request, response)
         gh_url = flat_url(
             '%s://%s/login/oauth/authorize' % (self.protocol, self.domain),
             scope=scope,
             client_id=self.consumer_key,
             redirect_uri=request.route_url(self.callback_route),
             state=state)
-        return HTTPFound(location=gh_url)
+        response.location = gh_url
+        return response
 
     def callback(self, request):
         """Process the github redirect"""
-        sess_state = request.session.get('state')
-        req_state = request.GET.get('state')
-        if not sess_state or sess_state != req_state:
-            raise CSRFError(
-                'CSRF Validation check failed. Request state {req_state} is not '
-                'the same as session state {sess_state}'.format(
-                    req_state=req_state,
-                    sess_state=sess_state
-                )
-            )
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
+        verify_state(self, request)
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error', 'No reason provided.')
-            return AuthenticationDenied(reason=reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason=reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         # Now retrieve the access token with the code
         access_url = flat_url(
@@ -129,21 +150,44 @@ class GithubProvider(object):
             client_secret=self.consumer_secret,
             redirect_uri=request.route_url(self.callback_route),
             code=code)
-        r = requests.get(access_url)
+        r = yield Call('GET', access_url, deadline=deadline,
+                       phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        access_token = parse_qs(r.content)['access_token'][0]
+        access_token = form_body(r)['access_token'][0]
 
-        # Retrieve profile data
+        cred = {'oauthAccessToken': access_token}
+        if self.lazy_profile:
+            yield GithubAuthenticationComplete(
+                profile_loader=partial(self.load_profile, access_token),
+                credentials=cred,
+                provider_name=self.name,
+                provider_type=self.type)
+            return
+
+        profile = yield self.profile_flow(access_token, deadline)
+        yield GithubAuthenticationComplete(profile=profile,
+                                           credentials=cred,
+                                           provider_name=self.name,
+                                           provider_type=self.type)
+
+    def load_profile(self, access_token):
+        """Fetch the profile of the user owning ``access_token``"""
+        return self.transport.run(
+            self.profile_flow(access_token, self.transport.deadline()))
+
+    def profile_flow(self, access_token, deadline):
+        """Flow retrieving and normalizing the user's profile"""
         graph_url = flat_url('%s://api.%s/user' % (self.protocol, self.domain),
                              access_token=access_token)
         graph_headers = dict(Accept='application/vnd.github.v3+json')
-        r = requests.get(graph_url, headers=graph_headers)
+        r = yield Call('GET', graph_url, headers=graph_headers,
+                       deadline=deadline, phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
 
         profile = {}
         profile['accounts'] = [{
@@ -160,8 +204,4 @@ class GithubProvider(object):
         if 'email' in data:
             profile['emails'] = [{'value':data['email']}]
 
-        cred = {'oauthAccessToken': access_token}
-        return GithubAuthenticationComplete(profile=profile,
-                                            credentials=cred,
-                                            provider_name=self.name,
-                                            provider_type=self.type)
+        yield profile
@@ -1,8 +1,6 @@
 from __future__ import absolute_import
 
 import logging
-from json import loads
-from urlparse import parse_qs
 
 import oauth2 as oauth
 from openid.extensions import ax
@@ -10,6 +8,12 @@ from openid.extensions import ax
 from pyramid.security import NO_PERMISSION_REQUIRED
 
 from velruse.api import register_provider
+from velruse.decoding import (
+    form_body,
+    json_body,
+)
+from velruse.oauth1 import OAuth1Signer
+from velruse.providers.oid_associations import AssociationKeeper
 from velruse.providers.oid_extensions import OAuthRequest
 from velruse.providers.oid_extensions import UIRequest
 from velruse.providers.openid import (
@@ -17,10 +21,12 @@ from velruse.providers.openid import (
     OpenIDAuthenticationComplete,
     OpenIDConsumer,
 )
+from velruse.transport import Transport
 
 
 log = logging.getLogger(__name__)
 
+GOOGLE_OPENID = 'https://www.google.com/accounts/o8/id'
 GOOGLE_OAUTH = 'https://www.google.com/accounts/OAuthGetAccessToken'
 
 
@@ -48,6 +54,10 @@ def add_google_login(config,
                      scope=None,
                      login_path='/login/google',
                      callback_path='/login/google/callback',
+                     discovery_cache=None,
+                     association_keeper=None,
+                     server_session=False,
+                     server_session_ttl=600,
                      name='google'):
     """
     Add a Google login provider to the application using the OpenID+OAuth
@@ -60,6 +70,10 @@ def add_google_login(config,
       + ``attrs``
       + ``realm``
       + ``storage``
+      + ``discovery_cache``
+      + ``association_keeper``
+      + ``server_session``
+      + ``server_session_ttl``
     - OAuth parameters
       + ``consumer_key``
       + ``consumer_secret``
@@ -72,7 +86,11 @@ def add_google_login(config,
         storage,
         consumer_key,
         consumer_secret,
-        scope)
+        scope,
+        discovery_cache,
+        association_keeper,
+        server_session,
+        server_session_ttl)
 
 
     config.add_route(provider.login_route, login_path)
@@ -91,24 +109,48 @@ class GoogleConsumer(OpenIDConsumer):
     ]
 
     def __init__(self, name, attrs=None, realm=None, storage=None,
-                 oauth_key=None, oauth_secret=None, oauth_scope=None):
+                 oauth_key=None, oauth_secret=None, oauth_scope=None,
+                 discovery_cache=None, association_keeper=None,
+                 server_session=False, server_session_ttl=600):
         """Handle Google Auth
 
         This also handles making an OAuth request during the OpenID
         authentication.
 
+        ``association_keeper`` may be an
+        :class:`~velruse.providers.oid_associations.AssociationKeeper` or
+        ``True`` to keep an association with Google's endpoint in the
+        background.
+
         """
         OpenIDConsumer.__init__(self, name, 'google_hybrid', realm, storage,
-                                context=GoogleAuthenticationComplete)
+                                context=GoogleAuthenticationComplete,
+                                discovery_cache=discovery_cache,
+                                server_session=server_session,
+                                server_session_ttl=server_session_ttl)
+        if association_keeper is True:
+            association_keeper = AssociationKeeper(
+                [GOOGLE_OPENID], discovery_cache=self.discovery_cache)
+        self.association_keeper = association_keeper
+        self.transport = Transport(name)
         self.oauth_key = oauth_key
         self.oauth_secret = oauth_secret
         self.oauth_scope = oauth_scope
+        self.signer = None
+        if oauth_key is not None:
+            self.signer = OAuth1Signer(oauth_key, oauth_secret)
         if attrs is not None:
             self.openid_attributes = attrs
 
     def _lookup_identifier(self, request, identifier):
         """Return the Google OpenID directed endpoint"""
-        return "https://www.google.com/accounts/o8/id"
+        return GOOGLE_OPENID
+
+    def _extension_requests(self):
+        ax_request = ax.FetchRequest()
+        for attr in self.openid_attributes:
+            ax_request.add(ax.AttrInfo(attributes[attr], required=True))
+        return [ax_request]
 
     def _update_authrequest(self, request, authrequest):
         """Update the authrequest with Attribute Exchange and optionally OAuth
@@ -118,10 +160,7 @@ class GoogleConsumer(OpenIDConsumer):
         access requested.
 
         """
-        ax_request = ax.FetchRequest()
-        for attr in self.openid_attributes:
-            ax_request.add(ax.AttrInfo(attributes[attr], required=True))
-        authrequest.addExtension(ax_request)
+        self._add_extensions(authrequest)
 
         # Add OAuth request?
         oauth_scope = self.oauth_scope
@@ -140,7 +179,8 @@ class GoogleConsumer(OpenIDConsumer):
             authrequest.addExtension(ui_request)
         return None
 
-    def _update_profile_data(self, request, profile, credentials):
+    def _update_profile_data(self, request, profile, credentials,
+                             deadline=None):
         """Update the user data with profile information from Google Contacts
 
         This only works if the oauth_scope included access to Google Contacts
@@ -149,40 +189,39 @@ class GoogleConsumer(OpenIDConsumer):
             http://www-opensocial.googleusercontent.com/api/people
 
         """
-        if self.oauth_key is None:
+        if self.signer is None:
             return
 
-        # Create the consumer and client, make the request
-        consumer = oauth.Consumer(self.oauth_key, self.oauth_secret)
-
         # Make a request with the data for more user info
         token = oauth.Token(key=credentials['oauthAccessToken'],
                             secret=credentials['oauthAccessTokenSecret'])
-        client = oauth.Client(consumer, token)
         profile_url = \
             'https://www-opensocial.googleusercontent.com/api/people/@me/@self'
-        resp, content = client.request(profile_url)
-        if resp['status'] != '200':
+        r = self.transport.send(self.signer.call(
+            'GET', profile_url, token=token,
+            deadline=deadline, phase='profile',
+            idempotent=True))
+        if r.status_code != 200:
             return
-        data = loads(content)
+        data = json_body(r)
         if 'entry' in data:
             profile.update(data['entry'])
 
             # Strip out the id and add it as the user id
             profile['accounts'][0]['userid'] = profile.pop('id', None)
 
-    def _get_access_token(self, request_token):
+    def _get_access_token(self, request_token, deadline=None):
         """Retrieve the access token if OAuth hybrid was used"""
-        consumer = oauth.Consumer(key=self.oauth_key, secret=self.oauth_secret)
         token = oauth.Token(key=request_token, secret='')
-        client = oauth.Client(consumer, token)
-        resp, content = client.request(GOOGLE_OAUTH, "POST")
-        if resp['status'] != '200':
+        r = self.transport.send(self.signer.call(
+            'POST', GOOGLE_OAUTH, token=token,
+            deadline=deadline, phase='access_token'))
+        if r.status_code != 200:
             log.error("OAuth token validation failed. Status: %s, Content: %s",
-                resp['status'], content)
+                r.status_code, r.content)
             return
 
-        access_token = dict(parse_qs(content))
+        access_token = form_body(r)
 
         return {
             'oauthAccessToken': access_token['oauth_token'][0],
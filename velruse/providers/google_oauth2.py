@@ -1,7 +1,6 @@
+import base64
+from functools import partial
 from json import loads
-import uuid
-
-import requests
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -11,9 +10,17 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
-from velruse.exceptions import CSRFError
+from velruse.decoding import json_body
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    issue_state,
+    verify_state,
+)
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -47,6 +54,7 @@ def add_google_login_from_settings(config, prefix='velruse.google.'):
     p.update('scope')
     p.update('login_path')
     p.update('callback_path')
+    p.update('lazy_profile')
     config.add_google_oauth2_login(**p.kwargs)
 
 def add_google_login(config,
@@ -55,16 +63,21 @@ def add_google_login(config,
                      scope=None,
                      login_path='/login/google',
                      callback_path='/login/google/callback',
+                     lazy_profile=False,
                      name='google'):
     """
     Add a Google login provider to the application supporting the new
     OAuth2 protocol.
+
+    When ``lazy_profile`` is true the user's profile is only fetched when
+    the ``profile`` of the resulting context is first read.
     """
     provider = GoogleOAuth2Provider(
         name,
         consumer_key,
         consumer_secret,
-        scope)
+        scope,
+        lazy_profile)
 
     config.add_route(provider.login_route, login_path)
     config.add_view(provider, attr='login', route_name=provider.login_route,
@@ -85,13 +98,20 @@ class GoogleOAuth2Provider(object):
                  name,
                  consumer_key,
                  consumer_secret,
-                 scope):
+                 scope,
+                 lazy_profile=False):
         self.name = name
         self.type = 'google_oauth2'
+        self.transport = Transport(name)
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.protocol = 'https'
         self.domain = GOOGLE_OAUTH2_DOMAIN
+        self.upstream_urls = [
+            '%s://%s/' % (self.protocol, self.domain),
+            '%s://www.googleapis.com/' % self.protocol,
+        ]
+        self.lazy_profile = lazy_profile
 
         self.login_route = 'velruse.%s-login' % name
         self.callback_route = 'velruse.%s-callback' % name
@@ -103,7 +123,8 @@ class GoogleOAuth2Provider(object):
     def login(self, request):
         """Initiate a google login"""
         scope = ' '.join(request.POST.getall('scope')) or self.scope
-        request.session['state'] = state = uuid.uuid4().hex
+        response = HTTPFound()
+        state = issue_state(self, request, response)
         
         approval_prompt = request.POST.get('approval_prompt', 'auto')
 
@@ -116,52 +137,84 @@ class GoogleOAuth2Provider(object):
             approval_prompt=approval_prompt,
             access_type='offline',
             state=state)
-        return HTTPFound(location=auth_url)
+        response.location = auth_url
+        return response
 
     def callback(self, request):
         """Process the google redirect"""
-        sess_state = request.session.get('state')
-        req_state = request.GET.get('state')
-        if not sess_state or sess_state != req_state:
-            raise CSRFError(
-                'CSRF Validation check failed. Request state {req_state} is not '
-                'the same as session state {sess_state}'.format(
-                    req_state=req_state,
-                    sess_state=sess_state
-                )
-            )
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
+        verify_state(self, request)
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error', 'No reason provided.')
-            return AuthenticationDenied(reason=reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason=reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         # Now retrieve the access token with the code
-        r = requests.post('%s://%s/o/oauth2/token' % (self.protocol, self.domain),
-                          data={
-                              'client_id': self.consumer_key,
-                              'client_secret': self.consumer_secret,
-                              'redirect_uri': request.route_url(self.callback_route),
-                              'code': code,
-                              'grant_type': 'authorization_code'
-                          })
+        r = yield Call(
+            'POST',
+            '%s://%s/o/oauth2/token' % (self.protocol, self.domain),
+            data={
+                'client_id': self.consumer_key,
+                'client_secret': self.consumer_secret,
+                'redirect_uri': request.route_url(self.callback_route),
+                'code': code,
+                'grant_type': 'authorization_code'
+            },
+            deadline=deadline, phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        token_data = loads(r.content)
+        token_data = json_body(r)
         access_token = token_data['access_token']
         refresh_token = token_data.get('refresh_token')
 
-        # Retrieve profile data if scopes allow
+        cred = {'oauthAccessToken': access_token,
+                'oauthRefreshToken': refresh_token}
+        if self.lazy_profile:
+            account = None
+            claims = id_token_claims(token_data.get('id_token'))
+            if claims.get('sub'):
+                account = {'domain': self.domain, 'userid': claims['sub']}
+                if claims.get('email'):
+                    account['username'] = claims['email']
+            yield GoogleAuthenticationComplete(
+                profile_loader=partial(self.load_profile, access_token),
+                account=account,
+                credentials=cred,
+                provider_name=self.name,
+                provider_type=self.type)
+            return
+
+        profile = yield self.profile_flow(access_token, deadline)
+        yield GoogleAuthenticationComplete(profile=profile,
+                                           credentials=cred,
+                                           provider_name=self.name,
+                                           provider_type=self.type)
+
+    def load_profile(self, access_token):
+        """Fetch the profile of the user owning ``access_token``"""
+        return self.transport.run(
+            self.profile_flow(access_token, self.transport.deadline()))
+
+    def profile_flow(self, access_token, deadline):
+        """Flow retrieving the user's profile if scopes allow"""
         profile = {}
         user_url = flat_url(
                 '%s://www.googleapis.com/oauth2/v1/userinfo' % self.protocol,
                 access_token=access_token)
-        r = requests.get(user_url)
+        r = yield Call('GET', user_url, deadline=deadline,
+                       phase='profile', idempotent=True)
 
         if r.status_code == 200:
-            data = loads(r.content)
+            data = json_body(r)
             profile['accounts'] = [{
                 'domain': self.domain,
                 'username': data['email'],
@@ -172,9 +225,19 @@ class GoogleOAuth2Provider(object):
             profile['verifiedEmail'] = data['email']
             profile['emails'] = [{'value': data['email']}]
 
-        cred = {'oauthAccessToken': access_token,
-                'oauthRefreshToken': refresh_token}
-        return GoogleAuthenticationComplete(profile=profile,
-                                            credentials=cred,
-                                            provider_name=self.name,
-                                            provider_type=self.type)
+        yield profile
+
+
+def id_token_claims(id_token):
+    """Decode the claims of an ``id_token`` returned by the token endpoint.
+
+    The token is received directly from Google over TLS, so its signature
+    isn't verified. Returns an empty dict if the token is missing or
+    malformed.
+    """
+    try:
+        payload = id_token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return loads(base64.urlsafe_b64decode(payload.encode('ascii')))
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return {}
@@ -1,8 +1,5 @@
 """Last.fm Authentication Views"""
 from hashlib import md5
-from json import loads
-
-import requests
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -12,8 +9,13 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
+from velruse.decoding import json_body
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 API_BASE = 'https://ws.audioscrobbler.com/2.0/'
@@ -65,6 +67,8 @@ class LastfmProvider(object):
     def __init__(self, name, consumer_key, consumer_secret):
         self.name = name
         self.type = 'lastfm'
+        self.transport = Transport(name)
+        self.upstream_urls = [API_BASE]
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
 
@@ -79,15 +83,22 @@ class LastfmProvider(object):
 
     def callback(self, request):
         """Process the LastFM redirect"""
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
         if 'error' in request.GET:
             raise ThirdPartyFailure(request.GET.get('error_description',
                                     'No reason provided.'))
         token = request.GET.get('token')
         if not token:
             reason = request.GET.get('error_reason', 'No reason provided.')
-            return AuthenticationDenied(reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         # Now establish a session with the token
         params = {
@@ -97,11 +108,12 @@ class LastfmProvider(object):
         }
         signed_params = sign_call(params, self.consumer_secret)
         session_url = flat_url(API_BASE, format='json', **signed_params)
-        r = requests.get(session_url)
+        r = yield Call('GET', session_url, deadline=deadline,
+                       phase='session')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
 
         session = data['session']
         cred = {
@@ -111,11 +123,12 @@ class LastfmProvider(object):
         # Fetch the user data
         user_url = flat_url(API_BASE, format='json', method='user.getInfo',
                             user=session['name'], api_key=self.consumer_key)
-        r = requests.get(user_url)
+        r = yield Call('GET', user_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)['user']
+        data = json_body(r)['user']
         profile = {
             'displayName': data['name'],
             'gender': 'male' if data['gender'] == 'm' else 'female',
@@ -142,10 +155,10 @@ class LastfmProvider(object):
         larger = images.get('extralarge', images.get('large'))
         if larger:
             profile['photos'].append({'type': '', 'value': larger})
-        return LastFMAuthenticationComplete(profile=profile,
-                                            credentials=cred,
-                                            provider_name=self.name,
-                                            provider_type=self.type)
+        yield LastFMAuthenticationComplete(profile=profile,
+                                           credentials=cred,
+                                           provider_name=self.name,
+                                           provider_type=self.type)
 
 
 def sign_call(params, secret):
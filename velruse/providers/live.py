@@ -1,8 +1,6 @@
 """Live Authentication Views"""
 import datetime
-from json import loads
-
-import requests
+from functools import partial
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -12,8 +10,13 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
+from velruse.decoding import json_body
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -35,6 +38,7 @@ def add_live_login_from_settings(config, prefix='velruse.live.'):
     p.update('scope')
     p.update('login_path')
     p.update('callback_path')
+    p.update('lazy_profile')
     config.add_live_login(**p.kwargs)
 
 
@@ -44,11 +48,16 @@ def add_live_login(config,
                    scope=None,
                    login_path='/login/live',
                    callback_path='/login/live/callback',
+                   lazy_profile=False,
                    name='live'):
     """
     Add a Live login provider to the application.
+
+    When ``lazy_profile`` is true the user's profile is only fetched when
+    the ``profile`` of the resulting context is first read.
     """
-    provider = LiveProvider(name, consumer_key, consumer_secret, scope)
+    provider = LiveProvider(name, consumer_key, consumer_secret, scope,
+                            lazy_profile)
 
     config.add_route(provider.login_route, login_path)
     config.add_view(provider, attr='login', route_name=provider.login_route,
@@ -62,12 +71,19 @@ def add_live_login(config,
 
 
 class LiveProvider(object):
-    def __init__(self, name, consumer_key, consumer_secret, scope):
+    def __init__(self, name, consumer_key, consumer_secret, scope,
+                 lazy_profile=False):
         self.name = name
         self.type = 'live'
+        self.transport = Transport(name)
+        self.upstream_urls = [
+            'https://oauth.live.com/',
+            'https://apis.live.net/',
+        ]
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.scope = scope
+        self.lazy_profile = lazy_profile
 
         self.login_route = 'velruse.%s-login' % name
         self.callback_route = 'velruse.%s-callback' % name
@@ -84,15 +100,22 @@ class LiveProvider(object):
 
     def callback(self, request):
         """Process the Live redirect"""
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
         if 'error' in request.GET:
             raise ThirdPartyFailure(request.GET.get('error_description',
                                     'No reason provided.'))
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error_reason', 'No reason provided.')
-            return AuthenticationDenied(reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         # Now retrieve the access token with the code
         access_url = flat_url(
@@ -102,30 +125,51 @@ class LiveProvider(object):
             redirect_uri=request.route_url(self.callback_route),
             grant_type="authorization_code",
             code=code)
-        r = requests.get(access_url)
+        r = yield Call('GET', access_url, deadline=deadline,
+                       phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
         access_token = data['access_token']
 
-        # Retrieve profile data
+        cred = {'oauthAccessToken': access_token}
+        if 'refresh_token' in data:
+            cred['oauthRefreshToken'] = data['refresh_token']
+        if self.lazy_profile:
+            account = None
+            if data.get('user_id'):
+                account = {'domain': 'live.com', 'userid': data['user_id']}
+            yield LiveAuthenticationComplete(
+                profile_loader=partial(self.load_profile, access_token),
+                account=account,
+                credentials=cred,
+                provider_name=self.name,
+                provider_type=self.type)
+            return
+
+        profile = yield self.profile_flow(access_token, deadline)
+        yield LiveAuthenticationComplete(profile=profile,
+                                         credentials=cred,
+                                         provider_name=self.name,
+                                         provider_type=self.type)
+
+    def load_profile(self, access_token):
+        """Fetch the profile of the user owning ``access_token``"""
+        return self.transport.run(
+            self.profile_flow(access_token, self.transport.deadline()))
+
+    def profile_flow(self, access_token, deadline):
+        """Flow retrieving and normalizing the user's profile"""
         graph_url = flat_url('https://apis.live.net/v5.0/me',
                              access_token=access_token)
-        r = requests.get(graph_url)
+        r = yield Call('GET', graph_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        live_profile = loads(r.content)
-        profile = extract_live_data(live_profile)
-
-        cred = {'oauthAccessToken': access_token}
-        if 'refresh_token' in data:
-            cred['oauthRefreshToken'] = data['refresh_token']
-        return LiveAuthenticationComplete(profile=profile,
-                                          credentials=cred,
-                                          provider_name=self.name,
-                                          provider_type=self.type)
+        live_profile = json_body(r)
+        yield extract_live_data(live_profile)
 
 
 def extract_live_data(data):
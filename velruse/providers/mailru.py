@@ -2,9 +2,6 @@
 
 You may see developer docs on http://api.mail.ru/docs/guides/oauth/
 """
-import json
-import uuid
-import requests
 import hashlib
 import re
 
@@ -16,8 +13,17 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
-from velruse.exceptions import CSRFError, ThirdPartyFailure
+from velruse.decoding import json_body
+from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    issue_state,
+    verify_state,
+)
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -91,6 +97,11 @@ class MailRuProvider(object):
     def __init__(self, name, consumer_key, consumer_secret, scope):
         self.name = name
         self.type = PROVIDER_NAME
+        self.transport = Transport(name)
+        self.upstream_urls = [
+            PROVIDER_ACCESS_TOKEN_URL,
+            PROVIDER_USER_PROFILE_URL,
+        ]
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.scope = scope
@@ -101,7 +112,8 @@ class MailRuProvider(object):
 
     def login(self, request):
         """Initiate a MailRu login"""
-        request.session['state'] = state = uuid.uuid4().hex
+        response = HTTPFound()
+        state = issue_state(self, request, response)
         auth_url = flat_url(
             PROVIDER_AUTH_URL,
             scope=self.scope,
@@ -109,28 +121,28 @@ class MailRuProvider(object):
             redirect_uri=request.route_url(self.callback_route),
             response_type='code',
             state=state)
-        return HTTPFound(location=auth_url)
+        response.location = auth_url
+        return response
 
 
     def callback(self, request):
         """Process the MailRu redirect"""
-        state = request.session.get('state')
-        if not state or state != request.GET.get('state'):
-            raise CSRFError(
-                'CSRF Validation check failed. Request state {req_state} is not '
-                'the same as session state {sess_state}'.format(
-                    req_state=request.GET.get('state'),
-                    sess_state=request.session.get('state')
-                )
-            )
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
+        verify_state(self, request)
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error', 'No reason provided.')
-            return AuthenticationDenied(
+            yield AuthenticationDenied(
                 reason=reason,
                 provider_name=self.name,
                 provider_type=self.type
             )
+            return
         # Now retrieve the access token with the code
         access_params = dict(
             grant_type='authorization_code',
@@ -139,14 +151,15 @@ class MailRuProvider(object):
             client_secret=self.consumer_secret,
             redirect_uri=request.route_url(self.callback_route),
         )
-        r = requests.post(PROVIDER_ACCESS_TOKEN_URL, access_params)
+        r = yield Call('POST', PROVIDER_ACCESS_TOKEN_URL, data=access_params,
+                       deadline=deadline, phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure(
                 'Status {status}: {content}'.format(
                     status=r.status_code, content=r.content
                 )
             )
-        data =json.loads(r.content)
+        data = json_body(r)
         access_token = data['access_token']
         
         # Retrieve profile data.
@@ -176,17 +189,18 @@ class MailRuProvider(object):
             session_key=access_token,
             secure=1
         )
-        r = requests.get(profile_url)
+        r = yield Call('GET', profile_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure(
                 'Status {status}: {content}'.format(
                     status=r.status_code, content=r.content
                 )
             )
-        profile = json.loads(r.content)[0]
+        profile = json_body(r)[0]
         profile = extract_normalize_mailru_data(profile)
         cred = {'oauthAccessToken': access_token}
-        return MailRuAuthenticationComplete(
+        yield MailRuAuthenticationComplete(
             profile=profile,
             credentials=cred,
             provider_name=self.name,
@@ -0,0 +1,139 @@
+"""Background OpenID Association Renewal
+
+Keeps a valid association with the fixed OP endpoints of providers such as
+Google and Yahoo so that logins never negotiate one inline.
+
+"""
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+from openid.consumer import consumer
+from openid.consumer import discover
+
+
+log = logging.getLogger(__name__)
+
+
+class AssociationKeeper(object):
+    """Negotiate and renew associations with fixed OP endpoints in a
+    background thread.
+
+    The endpoints are found by discovering ``identifiers`` (through
+    ``discovery_cache`` when given), plus any endpoint a login used.
+    Associations are renewed ``renew_before`` seconds before they expire;
+    the thread checks them every ``interval`` seconds and whenever a login
+    finds one missing.
+
+    Consumers attached with :meth:`attach` only ever use associations
+    already in the store. When there is none they proceed without one and
+    the response is verified directly with the OP, instead of delaying the
+    user for a Diffie-Hellman exchange.
+
+    The thread is only started on first use, so keepers created at
+    configuration time are safe to use with forking servers.
+
+    """
+    def __init__(self,
+                 identifiers,
+                 renew_before=600,
+                 interval=60,
+                 discovery_cache=None,
+                 clock=time.time):
+        self.identifiers = list(identifiers)
+        self.renew_before = renew_before
+        self.interval = interval
+        self.discovery_cache = discovery_cache
+        self.clock = clock
+
+        self.store = None
+        self.endpoints = {}
+        self.discovered = False
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.renewals = 0
+
+    def attach(self, oidconsumer, store):
+        """Make ``oidconsumer`` (a python-openid ``Consumer``) use only the
+        associations kept in ``store``"""
+        self.start(store)
+        oidconsumer.consumer._getAssociation = self.get_association
+
+    def get_association(self, endpoint):
+        """Replacement for ``GenericConsumer._getAssociation`` that never
+        negotiates"""
+        if endpoint.server_url not in self.endpoints:
+            with self.lock:
+                self.endpoints.setdefault(endpoint.server_url, endpoint)
+        assoc = self.store.getAssociation(endpoint.server_url)
+        expires_in = assoc.getExpiresIn(int(self.clock())) if assoc else 0
+        if expires_in <= self.renew_before:
+            self.wakeup.set()
+        if expires_in <= 0:
+            log.debug('no association with %s yet, continuing without one',
+                      endpoint.server_url)
+            return None
+        return assoc
+
+    def discover_endpoints(self):
+        for identifier in self.identifiers:
+            if self.discovery_cache is not None:
+                claimed_id, services = self.discovery_cache.discover(
+                    identifier)
+            else:
+                claimed_id, services = discover.discover(identifier)
+            with self.lock:
+                for endpoint in services[:1]:
+                    self.endpoints.setdefault(endpoint.server_url, endpoint)
+        self.discovered = True
+
+    def renew(self):
+        """Negotiate an association with every endpoint lacking one that is
+        valid for more than ``renew_before`` seconds"""
+        try:
+            if not self.discovered:
+                self.discover_endpoints()
+            with self.lock:
+                endpoints = list(self.endpoints.values())
+            for endpoint in endpoints:
+                assoc = self.store.getAssociation(endpoint.server_url)
+                now = int(self.clock())
+                if assoc is not None and \
+                        assoc.getExpiresIn(now) > self.renew_before:
+                    continue
+                generic = consumer.GenericConsumer(self.store)
+                assoc = generic._negotiateAssociation(endpoint)
+                if assoc is None:
+                    raise ValueError('%s refused to associate'
+                                     % endpoint.server_url)
+                self.store.storeAssociation(endpoint.server_url, assoc)
+                self.renewals += 1
+        except Exception:
+            log.warning('could not renew OpenID associations for %s',
+                        self.identifiers, exc_info=True)
+            return False
+        return True
+
+    def start(self, store):
+        """Start renewing associations in ``store``"""
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.store = store
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.clear()
+            failures = 0
+            while not self.renew():
+                # back off while the provider is failing
+                failures += 1
+                time.sleep(min(2 ** failures, self.interval))
+            self.wakeup.wait(self.interval)
@@ -0,0 +1,331 @@
+"""OpenID Discovery Caching
+
+Caches the results of Yadis/XRDS discovery so that logins against the same
+identifier, and in particular the fixed directed-identity endpoints of
+providers such as Google and Yahoo, do not repeat discovery every time.
+Discovery can also be bounded in time, and failures remembered so that
+repeated attempts against unreachable hosts, or identifiers that could not
+be discovered, fail immediately.
+
+"""
+from __future__ import absolute_import
+
+from collections import OrderedDict
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+import logging
+import socket
+import threading
+import time
+import urllib2
+from urlparse import urlsplit
+
+from openid import fetchers
+from openid.yadis import xri
+from openid.consumer import consumer
+from openid.consumer import discover
+import requests
+
+from velruse.exceptions import CircuitOpen
+from velruse.exceptions import DeadlineExceeded
+from velruse.exceptions import ThirdPartyFailure
+from velruse.transport import Deadline
+from velruse.transport import Transport
+
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class HostUnreachable(fetchers.HTTPFetchingError):
+    """A discovery fetch failed to connect or timed out, as opposed to the
+    host answering with an error or a document without services"""
+
+
+def _unreachable(exc):
+    """Whether ``exc``, raised by a fetcher, means the host could not be
+    connected to or did not answer in time"""
+    if isinstance(exc, fetchers.HTTPFetchingError):
+        exc = exc.why
+    if isinstance(exc, urllib2.HTTPError):
+        return False
+    return isinstance(exc, (socket.error, urllib2.URLError))
+
+
+class RecordingFetcher(fetchers.HTTPFetcher):
+    """Wrap the default python-openid fetcher to keep the responses fetched
+    by the current thread while discovery is in progress, so their cache
+    headers can be honored.
+
+    While a time-bounded discovery is in progress, requests go through
+    that discovery's :class:`~velruse.transport.Transport` instead so they
+    all draw from its deadline.
+
+    """
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+
+    def fetch(self, url, body=None, headers=None):
+        transport = getattr(_local, 'transport', None)
+        if transport is None:
+            # the default fetcher is python-openid's ExceptionWrappingFetcher,
+            # which hides connection errors in HTTPFetchingError.why
+            try:
+                response = self.fetcher.fetch(url, body, headers)
+            except Exception, e:
+                if _unreachable(e):
+                    raise HostUnreachable('%s: %s' % (
+                        url, getattr(e, 'why', None) or e))
+                raise
+        else:
+            response = self._bounded_fetch(transport, url, body, headers)
+        responses = getattr(_local, 'responses', None)
+        if responses is not None:
+            responses.append(response)
+        return response
+
+    def _bounded_fetch(self, transport, url, body, headers):
+        if not fetchers._allowedURL(url):
+            raise ValueError('Bad URL scheme: %r' % (url,))
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', fetchers.USER_AGENT)
+        method = 'GET' if body is None else 'POST'
+        try:
+            r = transport.request(method, url, deadline=_local.deadline,
+                                  phase='discovery', data=body,
+                                  headers=headers)
+        except (DeadlineExceeded, CircuitOpen, requests.ConnectionError,
+                requests.Timeout), e:
+            raise HostUnreachable('%s: %s' % (url, e))
+        except (ThirdPartyFailure, requests.RequestException), e:
+            raise fetchers.HTTPFetchingError('%s: %s' % (url, e))
+        return fetchers.HTTPResponse(
+            r.url, r.status_code,
+            dict((k.lower(), v) for k, v in r.headers.items()), r.content)
+
+
+_install_lock = threading.Lock()
+
+
+def install_fetcher():
+    """Wrap python-openid's default fetcher with a
+    :class:`RecordingFetcher`, once per process"""
+    with _install_lock:
+        fetcher = fetchers.getDefaultFetcher()
+        if not isinstance(fetcher, RecordingFetcher):
+            fetchers.setDefaultFetcher(RecordingFetcher(fetcher),
+                                       wrap_exceptions=False)
+
+
+def _header(headers, name):
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def response_ttl(response, default):
+    """Return how many seconds ``response`` may be cached for according to
+    its ``Cache-Control`` and ``Expires`` headers, or ``default`` if it
+    does not say"""
+    cache_control = _header(response.headers, 'cache-control')
+    if cache_control:
+        directives = {}
+        for directive in cache_control.split(','):
+            name, _, value = directive.strip().partition('=')
+            directives[name.lower()] = value.strip('"')
+        if 'no-store' in directives or 'no-cache' in directives:
+            return 0
+        for name in ('s-maxage', 'max-age'):
+            if directives.get(name, '').isdigit():
+                return int(directives[name])
+    expires = _header(response.headers, 'expires')
+    if expires:
+        expires = parsedate_tz(expires)
+        if expires is None:
+            # invalid dates, such as "0", mean already expired
+            return 0
+        date = parsedate_tz(_header(response.headers, 'date') or '')
+        now = mktime_tz(date) if date is not None else time.time()
+        return max(int(mktime_tz(expires) - now), 0)
+    return default
+
+
+def failure_key(identifier, host=False):
+    """Return the key discovery failures for ``identifier`` are cached
+    under: its host (or the XRI itself) when ``host`` is true, the
+    normalized identifier otherwise.
+
+    Only :class:`HostUnreachable` errors are cached per host, so that
+    discovering a bogus identifier cannot block a whole OP.
+
+    """
+    if host:
+        if xri.identifierScheme(identifier) == 'XRI':
+            return 'host', identifier
+        return 'host', urlsplit(normalize_identifier(identifier)).hostname
+    return 'identifier', normalize_identifier(identifier)
+
+
+def normalize_identifier(identifier):
+    """Return the key discovery results for ``identifier`` are cached
+    under"""
+    if xri.identifierScheme(identifier) == 'XRI':
+        return identifier
+    if '://' not in identifier:
+        identifier = 'http://' + identifier
+    return discover.normalizeURL(identifier)
+
+
+class DiscoveryCache(object):
+    """Cache of OpenID discovery results keyed by normalized identifier.
+
+    Results are kept for as long as the ``Cache-Control``/``Expires``
+    headers of the fetched XRDS (or HTML) documents allow, ``ttl`` seconds
+    if they say nothing, and never longer than ``max_ttl``. Up to
+    ``max_entries`` results are kept in-process.
+
+    When ``shared`` is true, results are also written to and read from the
+    store passed to :meth:`discover` (the velruse store), so every worker
+    benefits from discovery done by any of them.
+
+    When ``timeout`` is set, discovery is abandoned once it has spent that
+    many seconds fetching documents, its requests going through
+    ``transport`` (by default a :class:`~velruse.transport.Transport` of
+    its own). When ``failure_ttl`` is set, a failed discovery makes further
+    discoveries fail immediately for that many seconds: those of every
+    identifier on the same host when the host could not be reached in
+    time, and only those of the same identifier otherwise. A cache with a
+    ``ttl`` of ``0`` does no positive caching and only provides these
+    protections.
+
+    """
+    def __init__(self,
+                 ttl=3600,
+                 max_ttl=86400,
+                 max_entries=1000,
+                 shared=False,
+                 key_prefix='velruse.openid.discovery.',
+                 timeout=None,
+                 failure_ttl=0,
+                 transport=None,
+                 clock=time.time):
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+        self.failure_ttl = failure_ttl
+        if transport is None and timeout is not None:
+            transport = Transport('openid-discovery', timeout=timeout)
+        self.transport = transport
+        self.clock = clock
+
+        self.entries = OrderedDict()
+        self.failures = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        install_fetcher()
+
+    def discover(self, identifier, store=None):
+        """Drop-in replacement for
+        :func:`openid.consumer.discover.discover` returning cached results
+        when possible"""
+        key = normalize_identifier(identifier)
+        now = self.clock()
+        result = self._lookup(key, now, store)
+        if result is not None:
+            self.hits += 1
+            claimed_id, services = result
+            return claimed_id, list(services)
+
+        self.misses += 1
+        if self.failure_ttl:
+            for failed in (failure_key(identifier, host=True),
+                           ('identifier', key)):
+                failure = self.failures.get(failed)
+                if failure is not None and failure[0] > now:
+                    raise consumer.DiscoveryFailure(failure[1], None)
+
+        _local.responses = responses = []
+        if self.transport is not None:
+            _local.transport = self.transport
+            _local.deadline = Deadline(self.timeout)
+        try:
+            claimed_id, services = discover.discover(identifier)
+            if not services:
+                raise consumer.DiscoveryFailure(
+                    'No usable OpenID services found for %s' % identifier,
+                    None)
+        except (consumer.DiscoveryFailure, fetchers.HTTPFetchingError), e:
+            if self.failure_ttl:
+                self._fail(failure_key(identifier,
+                                       isinstance(e, HostUnreachable)),
+                           now + self.failure_ttl, str(e))
+            raise
+        finally:
+            _local.responses = None
+            _local.transport = None
+            _local.deadline = None
+
+        ttl = self.ttl
+        for response in responses:
+            ttl = min(ttl, response_ttl(response, self.ttl))
+        ttl = min(ttl, self.max_ttl)
+        if ttl > 0 and services:
+            self._save(key, now + ttl, (claimed_id, list(services)), store)
+        return claimed_id, services
+
+    def _lookup(self, key, now, store):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        if self.shared and store is not None:
+            try:
+                entry = store.retrieve(self.key_prefix + key)
+            except KeyError:
+                entry = None
+            if entry is not None and entry[0] > now:
+                self._remember(key, entry)
+                return entry[1]
+        return None
+
+    def _save(self, key, expires, result, store):
+        entry = (expires, result)
+        self._remember(key, entry)
+        if self.shared and store is not None:
+            store.store(self.key_prefix + key, entry,
+                        expires=int(expires - self.clock()) + 1)
+
+    def _fail(self, key, expires, message):
+        log.info('OpenID discovery of %s %s failed, not retrying it for '
+                 '%ss: %s', key[0], key[1], self.failure_ttl, message)
+        with self.lock:
+            self.failures.pop(key, None)
+            self.failures[key] = (expires, message)
+            while len(self.failures) > self.max_entries:
+                self.failures.popitem(last=False)
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class CachingConsumer(consumer.Consumer):
+    """python-openid ``Consumer`` performing discovery, both when starting
+    a login and when verifying the response, through a
+    :class:`DiscoveryCache`"""
+    def __init__(self, session, store, discovery_cache, shared_store=None):
+        consumer.Consumer.__init__(self, session, store)
+        self.discovery_cache = discovery_cache
+        self.shared_store = shared_store
+        self.consumer._discover = self._discover
+
+    def _discover(self, identifier):
+        return self.discovery_cache.discover(identifier, self.shared_store)
@@ -1,6 +1,7 @@
 """OpenID Extensions
 
-Additional OpenID extensions for OAuth and UIRequest extensions.
+Additional OpenID extensions for OAuth and UIRequest extensions, and
+prebuilt extension requests.
 
 """
 from __future__ import absolute_import
@@ -38,3 +39,17 @@ class OAuthRequest(extension.Extension):
 
     def getExtensionArgs(self):
         return self._args
+
+
+class PrebuiltExtension(extension.Extension):
+    """An extension request whose arguments are computed once, from
+    ``extension``, and reused for every message it is added to"""
+
+    def __init__(self, extension):
+        super(PrebuiltExtension, self).__init__()
+        self.ns_uri = extension.ns_uri
+        self.ns_alias = extension.ns_alias
+        self._args = extension.getExtensionArgs()
+
+    def getExtensionArgs(self):
+        return self._args
@@ -0,0 +1,241 @@
+"""OpenID Nonce Tracking
+
+Replay protection for OpenID responses with bounded memory and cleanup
+cost. Nonces are kept in buckets covering ``bucket_size`` seconds of nonce
+timestamps and a whole bucket is dropped at once when every nonce in it is
+too old to be accepted anyway.
+
+"""
+from __future__ import absolute_import
+
+from datetime import datetime
+from datetime import timedelta
+from hashlib import sha1
+import logging
+import math
+import struct
+import threading
+import time
+
+from anykeystore.backends.memcached import MemcachedStore
+from anykeystore.backends.memory import MemoryStore
+from anykeystore.backends.redis import RedisStore
+from anykeystore.compat import pickle
+from openid.store import nonce
+
+
+log = logging.getLogger(__name__)
+
+
+def _nonce_key(server_url, timestamp, salt):
+    return '%s\0%s\0%s' % (server_url, timestamp, salt)
+
+
+_memory_lock = threading.Lock()
+
+
+def atomic_add(store):
+    """Return a function ``add(key, value, expires)`` storing ``value``
+    under ``key`` of the `anykeystore` backend ``store`` only if the key is
+    absent, in a single atomic operation, and returning whether it did.
+
+    Backends may provide their own ``add``. Redis uses ``SET NX`` and
+    memcached its ``add`` command. ``None`` is returned for backends that
+    cannot do it atomically.
+
+    """
+    if hasattr(store, 'add'):
+        return store.add
+    if isinstance(store, RedisStore):
+        def add(key, value, expires):
+            return bool(store._get_conn().set(
+                store._make_key(key),
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                ex=expires, nx=True))
+        return add
+    if isinstance(store, MemcachedStore):
+        def add(key, value, expires):
+            return bool(store._get_conn().add(store._make_key(key), value,
+                                              expires))
+        return add
+    if isinstance(store, MemoryStore):
+        def add(key, value, expires):
+            now = datetime.utcnow()
+            with _memory_lock:
+                entry = store._store.get(key)
+                if entry is not None and (entry[1] is None or
+                                          entry[1] > now):
+                    return False
+                store._store[key] = (value,
+                                     now + timedelta(seconds=expires))
+                return True
+        return add
+    return None
+
+
+class BloomFilter(object):
+    """Fixed size set membership filter that may report false positives,
+    with a rate of about ``error_rate`` once ``capacity`` items are in it,
+    but never false negatives"""
+    def __init__(self, capacity, error_rate=0.001):
+        bits = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        self.size = max(int(math.ceil(bits / 8.0)) * 8, 8)
+        self.hashes = max(int(round(self.size * math.log(2) / capacity)), 1)
+        self.bits = bytearray(self.size // 8)
+
+    def _positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', sha1(key).digest()[:16])
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        """Add ``key`` and return whether it was (probably) already
+        present"""
+        present = True
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                present = False
+                self.bits[byte] |= 1 << bit
+        return present
+
+
+class NonceStore(object):
+    """In-process nonce store with O(1) expiry.
+
+    Nonces with a timestamp more than ``skew`` seconds away from the
+    current time are rejected, like python-openid's own stores do. Accepted
+    ones are kept in a bucket per ``bucket_size`` seconds of timestamps,
+    and buckets are discarded whole once they fall out of the ``skew``
+    window, so cleanup never scans individual nonces.
+
+    With ``bloom`` each bucket is a :class:`BloomFilter` sized for
+    ``capacity`` nonces instead of an exact set. Memory then stays constant
+    whatever the traffic, at the cost of rejecting roughly ``error_rate``
+    of fresh responses as replays once a bucket is full.
+
+    It implements ``useNonce`` of the python-openid ``OpenIDStore``
+    interface.
+
+    """
+    def __init__(self,
+                 bucket_size=300,
+                 skew=nonce.SKEW,
+                 bloom=False,
+                 capacity=10000,
+                 error_rate=0.001,
+                 clock=time.time):
+        self.bucket_size = bucket_size
+        self.skew = skew
+        self.bloom = bloom
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.clock = clock
+
+        self.buckets = {}
+        self.oldest = None
+        self.lock = threading.Lock()
+
+    def _new_bucket(self):
+        if self.bloom:
+            return BloomFilter(self.capacity, self.error_rate)
+        return set()
+
+    def _expire(self, now):
+        cutoff = int(now - self.skew) // self.bucket_size
+        if self.oldest is None or cutoff - self.oldest > len(self.buckets):
+            for index in [i for i in self.buckets if i < cutoff]:
+                del self.buckets[index]
+        else:
+            for index in range(self.oldest, cutoff):
+                self.buckets.pop(index, None)
+        self.oldest = max(cutoff, self.oldest)
+
+    def useNonce(self, server_url, timestamp, salt):
+        now = self.clock()
+        if abs(timestamp - now) > self.skew:
+            return False
+        key = _nonce_key(server_url, timestamp, salt)
+        index = int(timestamp) // self.bucket_size
+        with self.lock:
+            self._expire(now)
+            bucket = self.buckets.get(index)
+            if bucket is None:
+                bucket = self.buckets[index] = self._new_bucket()
+            if self.bloom:
+                return not bucket.add(key)
+            if key in bucket:
+                return False
+            bucket.add(key)
+            return True
+
+    def cleanupNonces(self):
+        with self.lock:
+            count = len(self.buckets)
+            self._expire(self.clock())
+            return count - len(self.buckets)
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class SharedNonceStore(object):
+    """Nonce store shared by every worker through an `anykeystore`
+    backend.
+
+    Each nonce is a key that the backend expires by itself ``skew`` seconds
+    after the end of its timestamp's bucket, so the backend does the
+    cleanup. Each check is a single atomic add-if-absent (see
+    :func:`atomic_add`), so two workers handling the same replayed response
+    cannot both accept it.
+
+    Backends without an atomic add fall back to a lookup followed by a
+    store. Two workers can then still both accept a response replayed to
+    them at the same moment, so a per-process :class:`NonceStore` is
+    checked as well to at least rule that out within a process.
+
+    """
+    def __init__(self,
+                 store,
+                 key_prefix='velruse.openid.nonce.',
+                 bucket_size=300,
+                 skew=nonce.SKEW,
+                 clock=time.time):
+        self.store = store
+        self.key_prefix = key_prefix
+        self.bucket_size = bucket_size
+        self.skew = skew
+        self.clock = clock
+        self.add = atomic_add(store)
+        self.local = None
+        if self.add is None:
+            log.warning('%s cannot add keys atomically, concurrent OpenID '
+                        'response replays to different processes may go '
+                        'undetected', type(store).__name__)
+            self.local = NonceStore(bucket_size, skew, clock=clock)
+
+    def useNonce(self, server_url, timestamp, salt):
+        now = self.clock()
+        if abs(timestamp - now) > self.skew:
+            return False
+        index = int(timestamp) // self.bucket_size
+        key = '%s%d.%s' % (self.key_prefix, index,
+                           sha1(_nonce_key(server_url, timestamp,
+                                           salt)).hexdigest())
+        expires = int((index + 1) * self.bucket_size + self.skew - now) + 1
+        if self.add is not None:
+            return self.add(key, True, expires)
+        if not self.local.useNonce(server_url, timestamp, salt):
+            return False
+        try:
+            self.store.retrieve(key)
+        except KeyError:
+            self.store.store(key, True, expires=expires)
+            return True
+        return False
+
+    def cleanupNonces(self):
+        # the backend expires nonces by itself
+        return 0
@@ -0,0 +1,164 @@
+"""OpenID Stores
+
+:class:`AnyKeyOpenIDStore` keeps OpenID associations and nonces in an
+`anykeystore` backend, normally the velruse store configured by the
+``store.*`` settings, so that every worker shares the associations
+negotiated by any of them. :class:`MemoryOpenIDStore` is the per-process
+default.
+
+"""
+from __future__ import absolute_import
+
+from hashlib import sha1
+import threading
+import time
+
+from openid.association import Association
+from openid.store.interface import OpenIDStore
+from openid.store.memstore import MemoryStore
+
+from velruse.providers.oid_nonce import NonceStore
+from velruse.providers.oid_nonce import SharedNonceStore
+
+
+class AnyKeyOpenIDStore(OpenIDStore):
+    """``OpenIDStore`` on top of an `anykeystore` backend.
+
+    ``store`` is the backend to use. When it is ``None`` the velruse store
+    of the application is used, see :meth:`bind`.
+
+    The associations of each OP endpoint are kept under a single key and
+    read through a local cache for ``cache_ttl`` seconds. A handle missing
+    from the local cache (negotiated by another worker) always causes the
+    backend to be read again.
+
+    Nonces go to ``nonce_store``, by default a
+    :class:`~velruse.providers.oid_nonce.SharedNonceStore` on the same
+    backend.
+
+    """
+    def __init__(self,
+                 store=None,
+                 key_prefix='velruse.openid.',
+                 cache_ttl=30,
+                 nonce_store=None,
+                 clock=time.time):
+        self.store = store
+        self.key_prefix = key_prefix
+        self.cache_ttl = cache_ttl
+        self.clock = clock
+        self._nonce_store = nonce_store
+        if nonce_store is None and store is not None:
+            nonce_store = SharedNonceStore(store, key_prefix + 'nonce.',
+                                           clock=clock)
+        self.nonce_store = nonce_store
+
+        self.cache = {}
+        self.lock = threading.Lock()
+        self._bound = {}
+
+    def bind(self, registry):
+        """Return this store, or a copy using the velruse store of
+        ``registry`` when no backend was given"""
+        if self.store is not None:
+            return self
+        storage = registry.velruse_store
+        bound = self._bound.get(id(storage))
+        if bound is None:
+            with self.lock:
+                bound = self._bound.get(id(storage))
+                if bound is None:
+                    bound = self.__class__(storage, self.key_prefix,
+                                           self.cache_ttl, self._nonce_store,
+                                           self.clock)
+                    self._bound[id(storage)] = bound
+        return bound
+
+    def _key(self, kind, value):
+        return '%s%s.%s' % (self.key_prefix, kind, sha1(value).hexdigest())
+
+    def _load(self, server_url):
+        try:
+            data = self.store.retrieve(self._key('assoc', server_url))
+        except KeyError:
+            data = None
+        now = int(self.clock())
+        assocs = {}
+        for serialized in data or ():
+            assoc = Association.deserialize(serialized)
+            if assoc.getExpiresIn(now) > 0:
+                assocs[assoc.handle] = assoc
+        with self.lock:
+            self.cache[server_url] = (self.clock() + self.cache_ttl, assocs)
+        return assocs
+
+    def _save(self, server_url, assocs):
+        key = self._key('assoc', server_url)
+        if assocs:
+            now = int(self.clock())
+            expires = max(a.getExpiresIn(now) for a in assocs.values())
+            self.store.store(key, [a.serialize() for a in assocs.values()],
+                             expires=expires)
+        else:
+            self.store.delete(key)
+        with self.lock:
+            self.cache[server_url] = (self.clock() + self.cache_ttl, assocs)
+
+    def _cached(self, server_url, handle):
+        entry = self.cache.get(server_url)
+        if entry is not None and entry[0] > self.clock():
+            if handle is None or handle in entry[1]:
+                return entry[1]
+        return self._load(server_url)
+
+    def storeAssociation(self, server_url, association):
+        assocs = self._load(server_url)
+        assocs[association.handle] = association
+        self._save(server_url, assocs)
+
+    def getAssociation(self, server_url, handle=None):
+        now = int(self.clock())
+        assocs = self._cached(server_url, handle)
+        if handle is not None:
+            assoc = assocs.get(handle)
+            if assoc is not None and assoc.getExpiresIn(now) > 0:
+                return assoc
+            return None
+        valid = [a for a in assocs.values() if a.getExpiresIn(now) > 0]
+        if not valid:
+            return None
+        return max(valid, key=lambda a: a.issued)
+
+    def removeAssociation(self, server_url, handle):
+        assocs = self._load(server_url)
+        if assocs.pop(handle, None) is None:
+            return False
+        self._save(server_url, assocs)
+        return True
+
+    def useNonce(self, server_url, timestamp, salt):
+        return self.nonce_store.useNonce(server_url, timestamp, salt)
+
+    def cleanupNonces(self):
+        return self.nonce_store.cleanupNonces()
+
+    def cleanupAssociations(self):
+        # the backend expires associations by itself
+        return 0
+
+
+class MemoryOpenIDStore(MemoryStore):
+    """python-openid's ``MemoryStore`` with nonces tracked by a
+    :class:`~velruse.providers.oid_nonce.NonceStore` (or ``nonce_store``),
+    so that they never accumulate in a long running process"""
+    def __init__(self, nonce_store=None):
+        MemoryStore.__init__(self)
+        if nonce_store is None:
+            nonce_store = NonceStore()
+        self.nonce_store = nonce_store
+
+    def useNonce(self, server_url, timestamp, salt):
+        return self.nonce_store.useNonce(server_url, timestamp, salt)
+
+    def cleanupNonces(self):
+        return self.nonce_store.cleanupNonces()
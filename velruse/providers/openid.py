@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import datetime
 import re
 import logging
+import uuid
 
 from openid.consumer import consumer
 from openid.extensions import ax
@@ -19,6 +20,9 @@ from velruse.api import (
 )
 from velruse.exceptions import MissingParameter
 from velruse.exceptions import ThirdPartyFailure
+from velruse.providers.oid_discovery import CachingConsumer
+from velruse.providers.oid_discovery import DiscoveryCache
+from velruse.providers.oid_extensions import PrebuiltExtension
 
 
 log = logging.getLogger(__name__)
@@ -71,6 +75,10 @@ trans_dict = dict(
 
 attributes = ax_attributes
 
+# Reverse lookups used to decode responses in a single pass
+ax_attribute_names = dict((v, k) for k, v in attributes.items())
+sreg_attribute_names = dict((v, k) for k, v in trans_dict.items())
+
 
 class OpenIDAuthenticationComplete(AuthenticationComplete):
     """OpenID auth complete"""
@@ -85,15 +93,33 @@ def add_openid_login(config,
                      storage=None,
                      login_path='/login/openid',
                      callback_path='/login/openid/callback',
+                     discovery_cache=None,
+                     server_session=False,
+                     server_session_ttl=600,
                      name='openid'):
     """
     Add a OpenID login provider to the application.
 
     `storage` should be an object conforming to the
     `openid.store.interface.OpenIDStore` protocol. This will default
-    to `openid.store.memstore.MemoryStore`.
+    to :class:`~velruse.providers.oid_store.MemoryOpenIDStore`, which is
+    private to each process. Use
+    :class:`~velruse.providers.oid_store.AnyKeyOpenIDStore` to share
+    associations between workers through the velruse store.
+
+    `discovery_cache` caches discovery results and can bound discovery in
+    time, see :class:`~velruse.providers.oid_discovery.DiscoveryCache`. It
+    may be an instance of that class or ``True`` to use one with default
+    settings.
+
+    `server_session` keeps the python-openid consumer state of logins in
+    progress in the velruse store for `server_session_ttl` seconds, with
+    only its key in the session, instead of in the session itself.
     """
-    provider = OpenIDConsumer(name, realm, storage)
+    provider = OpenIDConsumer(name, realm=realm, storage=storage,
+                              discovery_cache=discovery_cache,
+                              server_session=server_session,
+                              server_session_ttl=server_session_ttl)
 
     config.add_route(provider.login_route, login_path)
     config.add_view(provider, attr='login', route_name=provider.login_route,
@@ -117,22 +143,34 @@ class OpenIDConsumer(object):
                  _type=None,
                  realm=None,
                  storage=None,
-                 context=AuthenticationComplete):
+                 context=AuthenticationComplete,
+                 discovery_cache=None,
+                 server_session=False,
+                 server_session_ttl=600):
         self.openid_store = storage
         self.name = name
         self.type = _type
         self.context = context
         self.realm_override = realm
+        if discovery_cache is True:
+            discovery_cache = DiscoveryCache()
+        self.discovery_cache = discovery_cache
+        self.association_keeper = None
+        self.server_session = server_session
+        self.server_session_ttl = server_session_ttl
 
         self.login_route = 'velruse.%s-url' % name
         self.callback_route = 'velruse.%s-callback' % name
 
     _openid_store = None
 
+    # consumers making OAuth calls set their own pooled transport
+    transport = None
+
     def _get_openid_store(self):
         if self._openid_store is None:
-            from openid.store.memstore import MemoryStore
-            self._openid_store = MemoryStore()
+            from velruse.providers.oid_store import MemoryOpenIDStore
+            self._openid_store = MemoryOpenIDStore()
         return self._openid_store
 
     def _set_openid_store(self, val):
@@ -145,38 +183,103 @@ class OpenIDConsumer(object):
             return self.realm_override
         return request.host_url
 
+    def _get_consumer(self, request, openid_session):
+        """Return the python-openid consumer for a login or callback"""
+        store = self.openid_store
+        if hasattr(store, 'bind'):
+            store = store.bind(request.registry)
+        if self.discovery_cache is None:
+            oidconsumer = consumer.Consumer(openid_session, store)
+        else:
+            oidconsumer = CachingConsumer(
+                openid_session, store, self.discovery_cache,
+                getattr(request.registry, 'velruse_store', None))
+        if self.association_keeper is not None:
+            self.association_keeper.attach(oidconsumer, store)
+        return oidconsumer
+
+    def _save_openid_session(self, request, openid_session):
+        """Keep the consumer state of a login until its callback"""
+        if not self.server_session:
+            request.session['openid_session'] = openid_session
+            return
+        key = uuid.uuid4().hex
+        request.registry.velruse_store.store(
+            'velruse.openid.session.' + key, openid_session,
+            expires=self.server_session_ttl)
+        request.session['openid_session_key'] = key
+
+    def _load_openid_session(self, request):
+        """Return and forget the consumer state saved by the login, or
+        ``None``"""
+        if not self.server_session:
+            return request.session.pop('openid_session', None)
+        key = request.session.pop('openid_session_key', None)
+        if key is None:
+            return None
+        storage = request.registry.velruse_store
+        key = 'velruse.openid.session.' + key
+        try:
+            openid_session = storage.retrieve(key)
+        except KeyError:
+            return None
+        storage.delete(key)
+        return openid_session
+
     def _lookup_identifier(self, request, identifier):
         """Extension point for inherited classes that want to change or set
         a default identifier"""
         return identifier
 
-    def _update_authrequest(self, request, authrequest):
-        """Update the authrequest with the default extensions and attributes
-        we ask for
+    def _extension_requests(self):
+        """Return the extension requests added to every authrequest
 
-        This method doesn't need to return anything, since the extensions
-        should be added to the authrequest object itself.
+        They are only built once per consumer, so anything depending on
+        the request belongs in :meth:`_update_authrequest` instead.
 
         """
         # Add on the Attribute Exchange for those that support that
         ax_request = ax.FetchRequest()
         for attrib in attributes.values():
             ax_request.add(ax.AttrInfo(attrib))
-        authrequest.addExtension(ax_request)
 
         # Form the Simple Reg request
         sreg_request = sreg.SRegRequest(
             optional=['nickname', 'email', 'fullname', 'dob', 'gender',
                       'postcode', 'country', 'language', 'timezone'],
         )
-        authrequest.addExtension(sreg_request)
+        return [ax_request, sreg_request]
+
+    _prebuilt_extensions = None
 
-    def _get_access_token(self, request_token):
+    def _add_extensions(self, authrequest):
+        """Add the extension requests of :meth:`_extension_requests`,
+        computing their arguments on first use"""
+        extensions = self._prebuilt_extensions
+        if extensions is None:
+            extensions = [PrebuiltExtension(extension)
+                          for extension in self._extension_requests()]
+            self._prebuilt_extensions = extensions
+        for extension in extensions:
+            authrequest.addExtension(extension)
+
+    def _update_authrequest(self, request, authrequest):
+        """Update the authrequest with the default extensions and attributes
+        we ask for
+
+        This method doesn't need to return anything, since the extensions
+        should be added to the authrequest object itself.
+
+        """
+        self._add_extensions(authrequest)
+
+    def _get_access_token(self, request_token, deadline=None):
         """Called to exchange a request token for the access token
 
         This method doesn't by default return anything, other OpenID+Oauth
         consumers should override it to do the appropriate lookup for the
-        access token, and return the access token.
+        access token, and return the access token. ``deadline`` is the
+        time budget of the whole callback.
 
         """
 
@@ -194,7 +297,7 @@ class OpenIDConsumer(object):
             raise MissingParameter('No openid_identifier was found')
 
         openid_session = {}
-        oidconsumer = consumer.Consumer(openid_session, self.openid_store)
+        oidconsumer = self._get_consumer(request, openid_session)
 
         try:
             log.debug('About to try OpenID begin')
@@ -215,7 +318,7 @@ class OpenIDConsumer(object):
         realm = self._get_realm(request)
         # TODO: add a csrf check to the return_to URL
         return_to = request.route_url(self.callback_route)
-        request.session['openid_session'] = openid_session
+        self._save_openid_session(request, openid_session)
 
         # OpenID 2.0 lets Providers request POST instead of redirect, this
         # checks for such a request.
@@ -234,22 +337,27 @@ class OpenIDConsumer(object):
                 immediate=False)
             return Response(body=html)
 
-    def _update_profile_data(self, request, user_data, credentials):
-        """Update the profile data using an OAuth request to fetch more data"""
+    def _update_profile_data(self, request, user_data, credentials,
+                             deadline=None):
+        """Update the profile data using an OAuth request to fetch more data,
+        within ``deadline``"""
 
     def callback(self, request):
         """Handle incoming redirect from OpenID Provider"""
         log.debug('Handling processing of response from server')
 
-        openid_session = request.session.get('openid_session', None)
+        # every upstream call of the callback draws from one budget
+        deadline = None
+        if self.transport is not None:
+            deadline = self.transport.deadline()
+
+        # Fetch and delete the temporary token data used for the OpenID auth
+        openid_session = self._load_openid_session(request)
         if not openid_session:
             raise ThirdPartyFailure("No OpenID Session has begun.")
 
-        # Delete the temporary token data used for the OpenID auth
-        del request.session['openid_session']
-
         # Setup the consumer and parse the information coming back
-        oidconsumer = consumer.Consumer(openid_session, self.openid_store)
+        oidconsumer = self._get_consumer(request, openid_session)
         return_to = request.route_url(self.callback_route)
         info = oidconsumer.complete(request.params, return_to)
 
@@ -275,12 +383,14 @@ class OpenIDConsumer(object):
             )
             cred = {}
             if oauth and 'request_token' in oauth:
-                access_token = self._get_access_token(oauth['request_token'])
+                access_token = self._get_access_token(
+                    oauth['request_token'], deadline=deadline)
                 if access_token:
                     cred.update(access_token)
 
                 # See if we need to update our profile data with an OAuth call
-                self._update_profile_data(request, user_data, cred)
+                self._update_profile_data(request, user_data, cred,
+                                          deadline=deadline)
 
             return self.context(profile=user_data,
                                 credentials=cred,
@@ -292,29 +402,34 @@ class OpenIDConsumer(object):
 
 class AttribAccess(object):
     """Uniform attribute accessor for Simple Reg and Attribute Exchange
-    values"""
+    values
+
+    Both responses are decoded once, into flat dicts keyed by attribute
+    name, so every lookup is a dict access.
+
+    """
     def __init__(self, sreg_resp, ax_resp):
-        self.sreg_resp = sreg_resp or {}
-        self.ax_resp = ax_resp or ax.AXKeyValueMessage()
+        ax_values = {}
+        if ax_resp is not None:
+            for type_uri, values in ax_resp.data.iteritems():
+                if values and values[0] and type_uri in ax_attribute_names:
+                    ax_values[ax_attribute_names[type_uri]] = values[0]
+
+        values = {}
+        if sreg_resp is not None:
+            sreg_data = getattr(sreg_resp, 'data', sreg_resp)
+            for field, value in sreg_data.iteritems():
+                if field in sreg.data_fields:
+                    values[sreg_attribute_names.get(field, field)] = value
+        values.update(ax_values)
+        self.ax_values = ax_values
+        self.values = values
 
     def get(self, key, ax_only=False):
         """Get a value from either Simple Reg or AX"""
-        # First attempt to fetch it from AX
-        v = self.ax_resp.getSingle(attributes[key])
-        if v:
-            return v
         if ax_only:
-            return None
-
-        # Translate the key if needed
-        if key in trans_dict:
-            key = trans_dict[key]
-
-        # Don't attempt to fetch keys that aren't valid sreg fields
-        if key not in sreg.data_fields:
-            return None
-
-        return self.sreg_resp.get(key)
+            return self.ax_values.get(key)
+        return self.values.get(key)
 
 
 def extract_openid_data(identifier, sreg_resp, ax_resp):
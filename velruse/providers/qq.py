@@ -1,8 +1,4 @@
 """QQ Authentication Views"""
-from json import loads
-from urlparse import parse_qs
-
-import requests
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -12,8 +8,18 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
+from velruse.decoding import (
+    form_body,
+    json_body,
+    jsonp_body,
+)
+from velruse.exceptions import MalformedResponse
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -65,6 +71,8 @@ class QQProvider(object):
     def __init__(self, name, consumer_key, consumer_secret, scope):
         self.name = name
         self.type = 'qq'
+        self.transport = Transport(name)
+        self.upstream_urls = ['https://graph.qq.com/']
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.scope = scope
@@ -84,12 +92,19 @@ class QQProvider(object):
 
     def callback(self, request):
         """Process the qq redirect"""
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error', 'No reason provided.')
-            return AuthenticationDenied(reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         # Now retrieve the access token with the code
         access_url = flat_url(
@@ -99,31 +114,40 @@ class QQProvider(object):
             grant_type='authorization_code',
             redirect_uri=request.route_url(self.callback_route),
             code=code)
-        r = requests.get(access_url)
+        r = yield Call('GET', access_url, deadline=deadline,
+                       phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        access_token = parse_qs(r.content)['access_token'][0]
+        access_token = form_body(r)['access_token'][0]
 
         # Retrieve profile data
         graph_url = flat_url('https://graph.qq.com/oauth2.0/me',
                              access_token=access_token)
-        r = requests.get(graph_url)
+        r = yield Call('GET', graph_url, deadline=deadline,
+                       phase='openid', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content[10:-3])
+        data = jsonp_body(r)
+        if not isinstance(data, dict):
+            raise MalformedResponse('Expected a JSON object, got: %r'
+                                    % r.content[:100])
         openid = data.get('openid', '')
 
         user_info_url = flat_url('https://graph.qq.com/user/get_user_info',
                 access_token=access_token,
                 oauth_consumer_key=self.consumer_key,
                 openid=openid)
-        r = requests.get(user_info_url)
+        r = yield Call('GET', user_info_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
+        if not isinstance(data, dict):
+            raise MalformedResponse('Expected a JSON object, got: %r'
+                                    % r.content[:100])
 
         profile = {
             'accounts': [{'domain':'qq.com', 'userid':openid}],
@@ -132,7 +156,7 @@ class QQProvider(object):
         }
 
         cred = {'oauthAccessToken': access_token}
-        return QQAuthenticationComplete(profile=profile,
-                                        credentials=cred,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+        yield QQAuthenticationComplete(profile=profile,
+                                       credentials=cred,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
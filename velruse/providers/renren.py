@@ -1,7 +1,4 @@
 """Renren Authentication Views"""
-from json import loads
-
-import requests
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -11,8 +8,13 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
+from velruse.decoding import json_body
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -64,6 +66,8 @@ class RenrenProvider(object):
     def __init__(self, name, consumer_key, consumer_secret, scope):
         self.name = name
         self.type = 'renren'
+        self.transport = Transport(name)
+        self.upstream_urls = ['https://graph.renren.com/']
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.scope = scope
@@ -83,12 +87,19 @@ class RenrenProvider(object):
 
     def callback(self, request):
         """Process the renren redirect"""
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error', 'No reason provided.')
-            return AuthenticationDenied(reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         access_url = flat_url(
             'https://graph.renren.com/oauth/token',
@@ -98,11 +109,12 @@ class RenrenProvider(object):
             redirect_uri=request.route_url(self.callback_route),
             code=code)
 
-        r = requests.get(access_url)
+        r = yield Call('GET', access_url, deadline=deadline,
+                       phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
         access_token = data['access_token']
         profile = {
             'accounts': [
@@ -114,7 +126,7 @@ class RenrenProvider(object):
 
         cred = {'oauthAccessToken': access_token}
 
-        return RenrenAuthenticationComplete(profile=profile,
-                                            credentials=cred,
-                                            provider_name=self.name,
-                                            provider_type=self.type)
+        yield RenrenAuthenticationComplete(profile=profile,
+                                           credentials=cred,
+                                           provider_name=self.name,
+                                           provider_type=self.type)
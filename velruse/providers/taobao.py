@@ -1,10 +1,7 @@
 """Taobao Authentication Views"""
 from hashlib import md5
-from json import loads
 import time
 
-import requests
-
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
 
@@ -13,8 +10,13 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
+from velruse.decoding import json_body
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -64,6 +66,11 @@ class TaobaoProvider(object):
     def __init__(self, name, consumer_key, consumer_secret):
         self.name = name
         self.type = 'taobao'
+        self.transport = Transport(name)
+        self.upstream_urls = [
+            'https://oauth.taobao.com/',
+            'http://gw.api.taobao.com/',
+        ]
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
 
@@ -80,24 +87,32 @@ class TaobaoProvider(object):
 
     def callback(self, request):
         """Process the taobao redirect"""
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error', 'No reason provided.')
-            return AuthenticationDenied(reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         # Now retrieve the access token with the code
-        r = requests.post('https://oauth.taobao.com/token',
-                dict(grant_type='authorization_code',
-                     client_id=self.consumer_key,
-                     client_secret=self.consumer_secret,
-                     redirect_uri=request.route_url(self.callback_route),
-                     code=code))
+        r = yield Call('POST', 'https://oauth.taobao.com/token',
+                data=dict(grant_type='authorization_code',
+                          client_id=self.consumer_key,
+                          client_secret=self.consumer_secret,
+                          redirect_uri=request.route_url(self.callback_route),
+                          code=code),
+                deadline=deadline, phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
         access_token = data['access_token']
 
         # Retrieve profile data
@@ -117,10 +132,11 @@ class TaobaoProvider(object):
         params['sign'] = md5(src).hexdigest().upper()
         get_user_info_url = flat_url('http://gw.api.taobao.com/router/rest',
                                      **params)
-        r = requests.get(get_user_info_url)
+        r = yield Call('GET', get_user_info_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
 
         username = data['user_get_response']['user']['nick']
         userid = data['user_get_response']['user']['user_id']
@@ -132,7 +148,7 @@ class TaobaoProvider(object):
         }
 
         cred = {'oauthAccessToken': access_token}
-        return TaobaoAuthenticationComplete(profile=profile,
-                                            credentials=cred,
-                                            provider_name=self.name,
-                                            provider_type=self.type)
+        yield TaobaoAuthenticationComplete(profile=profile,
+                                           credentials=cred,
+                                           provider_name=self.name,
+                                           provider_type=self.type)
@@ -4,9 +4,6 @@ VK is considered to be the #1 social network
 (with more than a 100 million active users) in Russia.
 You may see the developer docs at http://vk.com/developers.php#devstep2
 """
-import json
-import uuid
-import requests
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -16,8 +13,17 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
-from velruse.exceptions import CSRFError, ThirdPartyFailure
+from velruse.decoding import json_body
+from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    issue_state,
+    verify_state,
+)
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -84,6 +90,11 @@ class VKProvider(object):
     def __init__(self, name, consumer_key, consumer_secret, scope):
         self.name = name
         self.type = PROVIDER_NAME
+        self.transport = Transport(name)
+        self.upstream_urls = [
+            PROVIDER_ACCESS_TOKEN_URL,
+            PROVIDER_USER_PROFILE_URL,
+        ]
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.scope = scope
@@ -94,7 +105,8 @@ class VKProvider(object):
 
     def login(self, request):
         """Initiate a VK login"""
-        request.session['state'] = state = uuid.uuid4().hex
+        response = HTTPFound()
+        state = issue_state(self, request, response)
         fb_url = flat_url(
             PROVIDER_AUTH_URL,
             scope=self.scope,
@@ -102,29 +114,28 @@ class VKProvider(object):
             redirect_uri=request.route_url(self.callback_route),
             response_type='code',
             state=state)
-        return HTTPFound(location=fb_url)
+        response.location = fb_url
+        return response
 
 
     def callback(self, request):
         """Process the VK redirect"""
-        sess_state = request.session.get('state')
-        req_state = request.GET.get('state')
-        if not sess_state or sess_state != req_state:
-            raise CSRFError(
-                'CSRF Validation check failed. Request state {req_state} is not '
-                'the same as session state {sess_state}'.format(
-                    req_state=req_state,
-                    sess_state=sess_state
-                )
-            )
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
+        verify_state(self, request)
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error_description', 'No reason provided.')
-            return AuthenticationDenied(
+            yield AuthenticationDenied(
                 reason=reason,
                 provider_name=self.name,
                 provider_type=self.type
             )
+            return
         # Now retrieve the access token with the code
         access_url = flat_url(
             PROVIDER_ACCESS_TOKEN_URL,
@@ -133,14 +144,15 @@ class VKProvider(object):
             redirect_uri=request.route_url(self.callback_route),
             code=code
         )
-        r = requests.get(access_url)
+        r = yield Call('GET', access_url, deadline=deadline,
+                       phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure(
                 'Status {status}: {content}'.format(
                     status=r.status_code, content=r.content
                 )
             )
-        data =json.loads(r.content)
+        data = json_body(r)
         access_token = data['access_token']
         
         # Retrieve profile data
@@ -154,18 +166,19 @@ class VKProvider(object):
                 'rate,contacts,education'
             )
         )
-        r = requests.get(graph_url)
+        r = yield Call('GET', graph_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure(
                 'Status {status}: {content}'.format(
                     status=r.status_code, content=r.content
                 )
             )
-        vk_profile = json.loads(r.content)['response'][0]
+        vk_profile = json_body(r)['response'][0]
         vk_profile['uid'] = data['user_id']
         profile = extract_normalize_vk_data(vk_profile)
         cred = {'oauthAccessToken': access_token}
-        return VKAuthenticationComplete(
+        yield VKAuthenticationComplete(
             profile=profile,
             credentials=cred,
             provider_name=self.name,
@@ -1,8 +1,4 @@
 """Sina Microblogging weibo.com Authentication Views"""
-import uuid
-from json import loads
-
-import requests
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -12,9 +8,17 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
-from velruse.exceptions import CSRFError
+from velruse.decoding import json_body
 from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    issue_state,
+    verify_state,
+)
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -64,6 +68,8 @@ class WeiboProvider(object):
     def __init__(self, name, consumer_key, consumer_secret):
         self.name = name
         self.type = 'weibo'
+        self.transport = Transport(name)
+        self.upstream_urls = ['https://api.weibo.com/']
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
 
@@ -72,47 +78,50 @@ class WeiboProvider(object):
 
     def login(self, request):
         """Initiate a weibo login"""
-        request.session['state'] = state = uuid.uuid4().hex
+        response = HTTPFound()
+        state = issue_state(self, request, response)
         fb_url = flat_url('https://api.weibo.com/oauth2/authorize',
                           client_id=self.consumer_key,
                           redirect_uri=request.route_url(self.callback_route),
                           state=state)
-        return HTTPFound(location=fb_url)
+        response.location = fb_url
+        return response
 
     def callback(self, request):
         """Process the weibo redirect"""
-        sess_state = request.session.get('state')
-        req_state = request.GET.get('state')
-        if not sess_state or sess_state != req_state:
-            raise CSRFError(
-                'CSRF Validation check failed. Request state {req_state} is not '
-                'the same as session state {sess_state}'.format(
-                    req_state=req_state,
-                    sess_state=sess_state
-                )
-            )
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
+        verify_state(self, request)
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error_reason', 'No reason provided.')
-            return AuthenticationDenied(reason,
-                                        provider_name=self.name,
-                                        provider_type=self.type)
+            yield AuthenticationDenied(reason,
+                                       provider_name=self.name,
+                                       provider_type=self.type)
+            return
 
         # Now retrieve the access token with the code
-        r = requests.post(
+        r = yield Call(
+            'POST',
             'https://api.weibo.com/oauth2/access_token',
-            dict(
+            data=dict(
                 client_id=self.consumer_key,
                 client_secret=self.consumer_secret,
                 redirect_uri=request.route_url(self.callback_route),
                 grant_type='authorization_code',
                 code=code,
             ),
+            deadline=deadline,
+            phase='access_token',
         )
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
         access_token = data['access_token']
         uid = data['uid']
 
@@ -120,11 +129,12 @@ class WeiboProvider(object):
         graph_url = flat_url('https://api.weibo.com/2/users/show.json',
                                 access_token=access_token,
                                 uid=uid)
-        r = requests.get(graph_url)
+        r = yield Call('GET', graph_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure("Status %s: %s" % (
                 r.status_code, r.content))
-        data = loads(r.content)
+        data = json_body(r)
 
         profile = {
             'accounts': [{'domain':'weibo.com', 'userid':data['id']}],
@@ -134,7 +144,7 @@ class WeiboProvider(object):
         }
 
         cred = {'oauthAccessToken': access_token}
-        return WeiboAuthenticationComplete(profile=profile,
-                                           credentials=cred,
-                                           provider_name=self.name,
-                                           provider_type=self.type)
+        yield WeiboAuthenticationComplete(profile=profile,
+                                          credentials=cred,
+                                          provider_name=self.name,
+                                          provider_type=self.type)
@@ -1,7 +1,6 @@
 from __future__ import absolute_import
 
 import logging
-from urlparse import parse_qs
 
 import oauth2 as oauth
 from openid.extensions import ax
@@ -9,15 +8,20 @@ from openid.extensions import ax
 from pyramid.security import NO_PERMISSION_REQUIRED
 
 from velruse.api import register_provider
+from velruse.decoding import form_body
+from velruse.oauth1 import OAuth1Signer
+from velruse.providers.oid_associations import AssociationKeeper
 from velruse.providers.oid_extensions import OAuthRequest
 from velruse.providers.openid import (
     OpenIDAuthenticationComplete,
     OpenIDConsumer,
 )
+from velruse.transport import Transport
 
 
 log = logging.getLogger(__name__)
 
+YAHOO_OPENID = 'https://me.yahoo.com/'
 YAHOO_OAUTH = 'https://api.login.yahoo.com/oauth/v2/get_token'
 
 
@@ -36,16 +40,23 @@ def add_yahoo_login(config,
                     consumer_secret=None,
                     login_path='/login/yahoo',
                     callback_path='/login/yahoo/callback',
+                    discovery_cache=None,
+                    association_keeper=None,
+                    server_session=False,
+                    server_session_ttl=600,
                     name='yahoo'):
     """
     Add a Yahoo login provider to the application.
 
-    OpenID parameters: realm, storage
+    OpenID parameters: realm, storage, discovery_cache, association_keeper,
+    server_session, server_session_ttl
 
     OAuth parameters: consumer_key, consumer_secret
     """
     provider = YahooConsumer(name, realm, storage,
-                             consumer_key, consumer_secret)
+                             consumer_key, consumer_secret, discovery_cache,
+                             association_keeper, server_session,
+                             server_session_ttl)
 
     config.add_route(provider.login_route, login_path)
     config.add_view(provider, attr='login', route_name=provider.login_route,
@@ -60,7 +71,9 @@ def add_yahoo_login(config,
 
 class YahooConsumer(OpenIDConsumer):
     def __init__(self, name, realm=None, storage=None,
-                 oauth_key=None, oauth_secret=None):
+                 oauth_key=None, oauth_secret=None, discovery_cache=None,
+                 association_keeper=None, server_session=False,
+                 server_session_ttl=600):
         """Handle Yahoo Auth
 
         This also handles making an OAuth request during the OpenID
@@ -68,15 +81,26 @@ class YahooConsumer(OpenIDConsumer):
 
         """
         OpenIDConsumer.__init__(self, name, 'yahoo', realm, storage,
-                                context=YahooAuthenticationComplete)
+                                context=YahooAuthenticationComplete,
+                                discovery_cache=discovery_cache,
+                                server_session=server_session,
+                                server_session_ttl=server_session_ttl)
+        if association_keeper is True:
+            association_keeper = AssociationKeeper(
+                [YAHOO_OPENID], discovery_cache=self.discovery_cache)
+        self.association_keeper = association_keeper
+        self.transport = Transport(name)
         self.oauth_key = oauth_key
         self.oauth_secret = oauth_secret
+        self.signer = None
+        if oauth_key is not None:
+            self.signer = OAuth1Signer(oauth_key, oauth_secret)
 
     def _lookup_identifier(self, request, identifier):
         """Return the Yahoo OpenID directed endpoint"""
-        return 'https://me.yahoo.com/'
+        return YAHOO_OPENID
 
-    def _update_authrequest(self, request, authrequest):
+    def _extension_requests(self):
         # Add on the Attribute Exchange for those that support that
         ax_request = ax.FetchRequest()
         for attrib in ['http://axschema.org/namePerson/friendly',
@@ -86,24 +110,27 @@ class YahooConsumer(OpenIDConsumer):
                        'http://axschema.org/media/image/default',
                        'http://axschema.org/contact/email']:
             ax_request.add(ax.AttrInfo(attrib))
-        authrequest.addExtension(ax_request)
+        return [ax_request]
+
+    def _update_authrequest(self, request, authrequest):
+        self._add_extensions(authrequest)
 
         # Add OAuth request?
         if 'oauth' in request.POST:
             oauth_request = OAuthRequest(consumer=self.oauth_key)
             authrequest.addExtension(oauth_request)
 
-    def _get_access_token(self, request_token):
-        consumer = oauth.Consumer(key=self.oauth_key, secret=self.oauth_secret)
+    def _get_access_token(self, request_token, deadline=None):
         token = oauth.Token(key=request_token, secret='')
-        client = oauth.Client(consumer, token)
-        resp, content = client.request(YAHOO_OAUTH, "POST")
-        if resp['status'] != '200':
+        r = self.transport.send(self.signer.call(
+            'POST', YAHOO_OAUTH, token=token,
+            deadline=deadline, phase='access_token'))
+        if r.status_code != 200:
             log.error("OAuth token validation failed. Status: %s, Content: %s",
-                resp['status'], content)
+                r.status_code, r.content)
             return
 
-        access_token = dict(parse_qs(content))
+        access_token = form_body(r)
 
         return {'oauthAccessToken': access_token['oauth_token'],
                 'oauthAccessTokenSecret': access_token['oauth_token_secret']}
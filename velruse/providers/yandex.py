@@ -2,9 +2,6 @@
 
 You may see developer docs at http://api.yandex.com/oauth/
 """
-import json
-import uuid
-import requests
 
 from pyramid.httpexceptions import HTTPFound
 from pyramid.security import NO_PERMISSION_REQUIRED
@@ -14,8 +11,17 @@ from velruse.api import (
     AuthenticationDenied,
     register_provider,
 )
-from velruse.exceptions import CSRFError, ThirdPartyFailure
+from velruse.decoding import json_body
+from velruse.exceptions import ThirdPartyFailure
 from velruse.settings import ProviderSettings
+from velruse.state import (
+    issue_state,
+    verify_state,
+)
+from velruse.transport import (
+    Call,
+    Transport,
+)
 from velruse.utils import flat_url
 
 
@@ -75,6 +81,11 @@ class YandexProvider(object):
     def __init__(self, name, consumer_key, consumer_secret):
         self.name = name
         self.type = PROVIDER_NAME
+        self.transport = Transport(name)
+        self.upstream_urls = [
+            PROVIDER_ACCESS_TOKEN_URL,
+            PROVIDER_USER_PROFILE_URL,
+        ]
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.login_route = 'velruse.{name}-login'.format(name=name)
@@ -87,36 +98,36 @@ class YandexProvider(object):
 
     def login(self, request):
         """Initiate a Yandex login"""
-        request.session['state'] = state = uuid.uuid4().hex
+        response = HTTPFound()
+        state = issue_state(self, request, response)
         auth_url = flat_url(
             PROVIDER_AUTH_URL,
             client_id=self.consumer_key,
             response_type='code',
             state=state
         )
-        return HTTPFound(location=auth_url)
+        response.location = auth_url
+        return response
 
 
     def callback(self, request):
         """Process the Yandex redirect"""
-        sess_state = request.session.get('state')
-        req_state = request.GET.get('state')
-        if not sess_state or sess_state != req_state:
-            raise CSRFError(
-                'CSRF Validation check failed. Request state {req_state} is not '
-                'the same as session state {sess_state}'.format(
-                    req_state=req_state,
-                    sess_state=sess_state
-                )
-            )
+        return self.transport.run(self.callback_flow(request))
+
+    def callback_flow(self, request):
+        """Generator form of :meth:`callback` yielding upstream
+        :class:`~velruse.transport.Call` objects"""
+        deadline = self.transport.deadline()
+        verify_state(self, request)
         code = request.GET.get('code')
         if not code:
             reason = request.GET.get('error', 'No reason provided.')
-            return AuthenticationDenied(
+            yield AuthenticationDenied(
                 reason=reason,
                 provider_name=self.name,
                 provider_type=self.type
             )
+            return
         # Now retrieve the access token with the code
         token_params = {
             'grant_type': 'authorization_code',
@@ -124,14 +135,15 @@ class YandexProvider(object):
             'client_id': self.consumer_key,
             'client_secret': self.consumer_secret,
         }
-        r = requests.post(PROVIDER_ACCESS_TOKEN_URL, token_params)
+        r = yield Call('POST', PROVIDER_ACCESS_TOKEN_URL, data=token_params,
+                       deadline=deadline, phase='access_token')
         if r.status_code != 200:
             raise ThirdPartyFailure(
                 'Status {status}: {content}'.format(
                     status=r.status_code, content=r.content
                 )
             )
-        data =json.loads(r.content)
+        data = json_body(r)
         access_token = data['access_token']
         
         # Retrieve profile data
@@ -140,17 +152,18 @@ class YandexProvider(object):
             format='json',
             oauth_token=access_token
         )
-        r = requests.get(profile_url)
+        r = yield Call('GET', profile_url, deadline=deadline,
+                       phase='profile', idempotent=True)
         if r.status_code != 200:
             raise ThirdPartyFailure(
                 'Status {status}: {content}'.format(
                     status=r.status_code, content=r.content
                 )
             )
-        profile = json.loads(r.content)
+        profile = json_body(r)
         profile = extract_normalize_yandex_data(profile)
         cred = {'oauthAccessToken': access_token}
-        return YandexAuthenticationComplete(
+        yield YandexAuthenticationComplete(
             profile=profile,
             credentials=cred,
             provider_name=self.name,
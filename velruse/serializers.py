@@ -0,0 +1,178 @@
+"""Compact serializers for session data
+
+Each serializer has the ``dumps(appstruct)`` / ``loads(bstruct)`` interface
+of Pyramid's session serializers, turning session data into a byte string
+and back. Signing is left to the session factory.
+
+"""
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+from openid.consumer.discover import OpenIDServiceEndpoint
+from openid.yadis.manager import YadisServiceManager
+
+from velruse.transport import asbool
+
+
+#: Objects python-openid keeps in the session, encoded as their attributes
+SESSION_TYPES = {
+    'openid.endpoint': OpenIDServiceEndpoint,
+    'openid.services': YadisServiceManager,
+}
+_TYPE_NAMES = dict((cls, name) for name, cls in SESSION_TYPES.items())
+
+
+def _str(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_str(v) for v in value]
+    return value
+
+
+def _encode_object(obj):
+    name = _TYPE_NAMES.get(type(obj))
+    if name is None:
+        raise TypeError('%r cannot be serialized' % (obj,))
+    return {'__type__': name, '__attrs__': vars(obj)}
+
+
+def _decode_object(value):
+    name = value.get('__type__')
+    if name is None or '__attrs__' not in value:
+        return value
+    obj = SESSION_TYPES[name].__new__(SESSION_TYPES[name])
+    # python-openid expects byte strings
+    obj.__dict__.update((str(k), _str(v))
+                        for k, v in value['__attrs__'].items())
+    return obj
+
+
+class PickleSerializer(object):
+    """The pickle serialization used by Pyramid's cookie sessions"""
+
+    def dumps(self, appstruct):
+        return pickle.dumps(appstruct, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, bstruct):
+        try:
+            return pickle.loads(bstruct)
+        except Exception:
+            raise ValueError('invalid pickle data')
+
+
+class JSONSerializer(object):
+    """Serialize to compact JSON.
+
+    The python-openid objects listed in :data:`SESSION_TYPES` are encoded
+    as their attributes. Strings come back as ``unicode`` and tuples as
+    lists.
+
+    """
+    def __init__(self):
+        self.encoder = json.JSONEncoder(separators=(',', ':'),
+                                        default=_encode_object)
+        self.decoder = json.JSONDecoder()
+        self.object_decoder = json.JSONDecoder(object_hook=_decode_object)
+
+    def dumps(self, appstruct):
+        return self.encoder.encode(appstruct)
+
+    def loads(self, bstruct):
+        # only pay for the object hook when there are objects to decode
+        if '"__type__"' in bstruct:
+            return self.object_decoder.decode(bstruct)
+        return self.decoder.decode(bstruct)
+
+
+class MsgpackSerializer(object):
+    """Serialize to msgpack, which requires the optional `msgpack`
+    package.
+
+    Like :class:`JSONSerializer` it handles the python-openid objects
+    listed in :data:`SESSION_TYPES`.
+
+    """
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('the msgpack serializer requires the '
+                              '"msgpack" package')
+
+    def dumps(self, appstruct):
+        return msgpack.packb(appstruct, default=_encode_object,
+                             use_bin_type=False)
+
+    def loads(self, bstruct):
+        try:
+            return msgpack.unpackb(bstruct, object_hook=_decode_object)
+        except Exception:
+            raise ValueError('invalid msgpack data')
+
+
+class CompressingSerializer(object):
+    """Wrap ``serializer`` to compress its output with zlib when it is at
+    least ``threshold`` bytes long.
+
+    A one byte header records whether the data was compressed, so small
+    values, which rarely shrink, are not paid for.
+
+    """
+    def __init__(self, serializer, threshold=256, level=6):
+        self.serializer = serializer
+        self.threshold = threshold
+        self.level = level
+
+    def dumps(self, appstruct):
+        data = self.serializer.dumps(appstruct)
+        if len(data) >= self.threshold:
+            compressed = zlib.compress(data, self.level)
+            if len(compressed) < len(data):
+                return 'z' + compressed
+        return '.' + data
+
+    def loads(self, bstruct):
+        flag, data = bstruct[:1], bstruct[1:]
+        if flag == 'z':
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                raise ValueError('invalid compressed data')
+        elif flag != '.':
+            raise ValueError('unknown serialization header')
+        return self.serializer.loads(data)
+
+
+serializers = {
+    'pickle': PickleSerializer,
+    'json': JSONSerializer,
+    'msgpack': MsgpackSerializer,
+}
+
+
+def serializer_from_settings(settings, prefix='session.'):
+    """Return the serializer configured by the ``serializer`` (``pickle``,
+    ``json`` or ``msgpack``), ``compress`` and ``compress_threshold``
+    settings under ``prefix``, or ``None`` when none is set"""
+    name = settings.get(prefix + 'serializer')
+    compress = asbool(settings.get(prefix + 'compress', False))
+    if name is None and not compress:
+        return None
+    name = name or 'pickle'
+    if name not in serializers:
+        raise ValueError('unknown serializer "%s", expected one of %s'
+                         % (name, ', '.join(sorted(serializers))))
+    serializer = serializers[name]()
+    if compress:
+        serializer = CompressingSerializer(
+            serializer,
+            threshold=int(settings.get(prefix + 'compress_threshold', 256)))
+    return serializer
@@ -0,0 +1,183 @@
+"""Server-side sessions kept in an `anykeystore` backend"""
+from collections import MutableMapping
+import hashlib
+import hmac
+import os
+import time
+
+from pyramid.interfaces import ISession
+from zope.interface import implementer
+
+
+def StoreSessionFactory(secret,
+                        store=None,
+                        timeout=1200,
+                        key_prefix='velruse.session.',
+                        cookie_name='velruse.session',
+                        max_age=None,
+                        path='/',
+                        domain=None,
+                        secure=False,
+                        httponly=True,
+                        serializer=None):
+    """Return a Pyramid session factory keeping session data in an
+    `anykeystore` backend, with only a signed session id in the cookie.
+
+    ``store`` is the backend to use. When it is ``None`` the velruse store
+    of the application is used.
+
+    Nothing is done for a request that never touches ``request.session``.
+    The data is read from the backend on first access and written back,
+    expiring ``timeout`` seconds later, only when the session was changed.
+    Session ids whose signature does not match ``secret`` are ignored
+    without a backend lookup.
+
+    ``serializer`` (see :mod:`velruse.serializers`) turns the session data
+    into a string before it is stored. By default the backend is given the
+    data itself.
+
+    """
+    if isinstance(secret, unicode):
+        secret = secret.encode('utf-8')
+
+    def sign(session_id):
+        return hmac.new(secret, session_id, hashlib.sha256).hexdigest()[:32]
+
+    def get_store(request):
+        if store is not None:
+            return store
+        return request.registry.velruse_store
+
+    @implementer(ISession)
+    class StoreSession(MutableMapping):
+        """Dictionary-like session loaded lazily from the backend"""
+        _cookie_name = cookie_name
+        _timeout = timeout
+
+        def __init__(self, request):
+            self.request = request
+            self.session_id = None
+            self.old_session_id = None
+            self.dirty = False
+            self._data = None
+            self._created = None
+            value = request.cookies.get(cookie_name)
+            if value:
+                session_id, _, signature = str(value).partition('.')
+                if hmac.compare_digest(sign(session_id), signature):
+                    self.session_id = session_id
+            self.had_cookie = self.session_id is not None
+
+        def _load(self):
+            if self._data is None:
+                self._created, self._data = time.time(), {}
+                if self.session_id is not None:
+                    try:
+                        value = get_store(self.request).retrieve(
+                            self._key())
+                        if serializer is not None:
+                            value = serializer.loads(value)
+                        self._created, self._data = value
+                    except (KeyError, ValueError):
+                        self.session_id = None
+            return self._data
+
+        def _key(self, session_id=None):
+            return key_prefix + (session_id or self.session_id)
+
+        @property
+        def created(self):
+            self._load()
+            return self._created
+
+        @property
+        def new(self):
+            self._load()
+            return self.session_id is None
+
+        def changed(self):
+            if not self.dirty:
+                self.dirty = True
+                self.request.add_response_callback(self._save)
+
+        def invalidate(self):
+            self._load()
+            if self.session_id is not None:
+                self.old_session_id = self.session_id
+            self.session_id = None
+            self._created, self._data = time.time(), {}
+            self.changed()
+
+        def _save(self, request, response):
+            storage = get_store(request)
+            if self.old_session_id is not None:
+                storage.delete(self._key(self.old_session_id))
+            if not self._data:
+                if self.session_id is not None:
+                    storage.delete(self._key())
+                if self.had_cookie:
+                    response.delete_cookie(cookie_name, path=path,
+                                           domain=domain)
+                return
+            if self.session_id is None:
+                self.session_id = os.urandom(16).encode('hex')
+                response.set_cookie(
+                    cookie_name,
+                    '%s.%s' % (self.session_id, sign(self.session_id)),
+                    max_age=max_age, path=path, domain=domain,
+                    secure=secure, httponly=httponly)
+            value = (self._created, self._data)
+            if serializer is not None:
+                value = serializer.dumps(value)
+            storage.store(self._key(), value, expires=timeout)
+
+        # mapping interface
+
+        def __getitem__(self, key):
+            return self._load()[key]
+
+        def __setitem__(self, key, value):
+            self._load()[key] = value
+            self.changed()
+
+        def __delitem__(self, key):
+            del self._load()[key]
+            self.changed()
+
+        def __iter__(self):
+            return iter(self._load())
+
+        def __len__(self):
+            return len(self._load())
+
+        def __contains__(self, key):
+            return key in self._load()
+
+        # flash API
+
+        def flash(self, msg, queue='', allow_duplicate=True):
+            storage = self.setdefault('_f_' + queue, [])
+            if allow_duplicate or (msg not in storage):
+                storage.append(msg)
+                self.changed()
+
+        def pop_flash(self, queue=''):
+            return self.pop('_f_' + queue, [])
+
+        def peek_flash(self, queue=''):
+            return self.get('_f_' + queue, [])
+
+        # CSRF API
+
+        def new_csrf_token(self):
+            token = os.urandom(20).encode('hex')
+            self['_csrft_'] = token
+            return token
+
+        def get_csrf_token(self):
+            token = self.get('_csrft_', None)
+            if token is None:
+                token = self.new_csrf_token()
+            return token
+
+    return StoreSession
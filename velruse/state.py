@@ -0,0 +1,211 @@
+"""Signed, time-limited login state carried by the browser"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from urlparse import parse_qs
+import uuid
+
+try:
+    from cryptography.fernet import Fernet
+    from cryptography.fernet import InvalidToken
+except ImportError:  # pragma: no cover
+    Fernet = None
+
+    class InvalidToken(Exception):
+        pass
+
+from velruse.exceptions import CSRFError
+from velruse.transport import asbool
+
+
+def _b64encode(value):
+    return base64.urlsafe_b64encode(value).rstrip('=')
+
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(str(value) + '=' * (-len(value) % 4))
+
+
+class SignedState(object):
+    """Serialize small pieces of login state into signed values that
+    expire after ``max_age`` seconds.
+
+    Values are signed with HMAC-SHA256 using ``secret``. With ``encrypt``
+    they are encrypted as well, which requires the optional `cryptography`
+    package, so that they can hold secrets such as OAuth1 request token
+    secrets.
+
+    Values handed to the browser are tied to it by a cookie named
+    ``cookie_prefix`` followed by the provider name, so that a value
+    obtained by one browser is useless in another.
+
+    """
+    def __init__(self,
+                 secret,
+                 max_age=600,
+                 encrypt=False,
+                 cookie_prefix='velruse.state.',
+                 secure=False,
+                 clock=time.time):
+        if isinstance(secret, unicode):
+            secret = secret.encode('utf-8')
+        self.secret = secret
+        self.max_age = max_age
+        self.cookie_prefix = cookie_prefix
+        self.secure = secure
+        self.clock = clock
+        self.fernet = None
+        if encrypt:
+            if Fernet is None:
+                raise ImportError('encrypting the login state requires the '
+                                  '"cryptography" package')
+            key = base64.urlsafe_b64encode(hashlib.sha256(secret).digest())
+            self.fernet = Fernet(key)
+
+    @property
+    def encrypted(self):
+        return self.fernet is not None
+
+    def dumps(self, data):
+        """Return a signed value holding ``data``, which must be JSON
+        serializable"""
+        payload = json.dumps([int(self.clock()), data],
+                             separators=(',', ':'))
+        if self.fernet is not None:
+            return self.fernet.encrypt(payload)
+        payload = _b64encode(payload)
+        signature = hmac.new(self.secret, payload, hashlib.sha256).digest()
+        return '%s.%s' % (payload, _b64encode(signature))
+
+    def loads(self, value):
+        """Return the data held by ``value``, raising
+        :class:`~velruse.exceptions.CSRFError` unless it is intact and
+        recent enough"""
+        if not value:
+            raise CSRFError('CSRF Validation check failed. No state given')
+        value = str(value)
+        try:
+            if self.fernet is not None:
+                payload = self.fernet.decrypt(value)
+            else:
+                payload, _, signature = value.rpartition('.')
+                expected = hmac.new(self.secret, payload,
+                                    hashlib.sha256).digest()
+                if not hmac.compare_digest(_b64decode(signature), expected):
+                    raise ValueError('bad signature')
+                payload = _b64decode(payload)
+            issued, data = json.loads(payload)
+        except (TypeError, ValueError, InvalidToken):
+            raise CSRFError('CSRF Validation check failed. Invalid state')
+        if self.clock() - issued > self.max_age:
+            raise CSRFError('CSRF Validation check failed. State expired')
+        return data
+
+    def _set_cookie(self, response, name, value):
+        response.set_cookie(self.cookie_prefix + name, value,
+                            max_age=self.max_age, httponly=True,
+                            secure=self.secure)
+
+    def issue(self, response, name):
+        """Return a new ``state`` value for provider ``name``, tied to the
+        browser by a cookie set on ``response``"""
+        nonce = os.urandom(16).encode('hex')
+        self._set_cookie(response, name, nonce)
+        return self.dumps(nonce)
+
+    def verify(self, request, name, value):
+        """Check the ``state`` value returned to provider ``name``"""
+        nonce = self.loads(value)
+        cookie = request.cookies.get(self.cookie_prefix + name)
+        if not cookie or not hmac.compare_digest(str(nonce), str(cookie)):
+            raise CSRFError('CSRF Validation check failed. The state was not '
+                            'issued to this browser')
+
+    def save(self, response, name, data):
+        """Keep ``data`` for provider ``name`` in a cookie set on
+        ``response``"""
+        self._set_cookie(response, name, self.dumps(data))
+
+    def load(self, request, name):
+        """Return the data saved by :meth:`save`"""
+        return self.loads(request.cookies.get(self.cookie_prefix + name))
+
+
+def signed_state_from_settings(settings, prefix=''):
+    """Return a :class:`SignedState` configured by the ``state_secret``,
+    ``state_max_age``, ``state_encrypt`` and ``state_secure`` settings
+    under ``prefix``, or ``None`` unless ``state_secret`` is set"""
+    secret = settings.get(prefix + 'state_secret')
+    if not secret:
+        return None
+    return SignedState(
+        secret,
+        max_age=int(settings.get(prefix + 'state_max_age', 600)),
+        encrypt=asbool(settings.get(prefix + 'state_encrypt', False)),
+        secure=asbool(settings.get(prefix + 'state_secure', False)))
+
+
+def issue_state(provider, request, response):
+    """Return the ``state`` of a new OAuth2 login.
+
+    It is kept in the session unless the provider has a
+    :class:`SignedState`, in which case it is signed and tied to the
+    browser through ``response``.
+
+    """
+    signed_state = getattr(provider, 'signed_state', None)
+    if signed_state is not None:
+        return signed_state.issue(response, provider.name)
+    request.session['state'] = state = uuid.uuid4().hex
+    return state
+
+
+def verify_state(provider, request):
+    """Raise :class:`~velruse.exceptions.CSRFError` unless the ``state``
+    returned to an OAuth2 callback is the one issued by its login"""
+    req_state = request.GET.get('state')
+    signed_state = getattr(provider, 'signed_state', None)
+    if signed_state is not None:
+        signed_state.verify(request, provider.name, req_state)
+        return
+    sess_state = request.session.get('state')
+    if not sess_state or sess_state != req_state:
+        raise CSRFError(
+            'CSRF Validation check failed. Request state {req_state} is not '
+            'the same as session state {sess_state}'.format(
+                req_state=req_state,
+                sess_state=sess_state
+            )
+        )
+
+
+def save_request_token(provider, request, response, content):
+    """Keep the raw OAuth1 request token of a login until its callback,
+    in the session or in an encrypted cookie set on ``response``.
+
+    The token includes the request token secret, so providers using this
+    must set ``saves_request_token``: :func:`velruse.api.register_provider`
+    then refuses a :class:`SignedState` that does not encrypt.
+
+    """
+    signed_state = getattr(provider, 'signed_state', None)
+    if signed_state is not None:
+        signed_state.save(response, provider.name, content)
+    else:
+        request.session['token'] = content
+
+
+def load_request_token(provider, request):
+    """Return the raw OAuth1 request token saved by the login"""
+    signed_state = getattr(provider, 'signed_state', None)
+    if signed_state is None:
+        return request.session['token']
+    content = str(signed_state.load(request, provider.name))
+    returned = request.GET.get('oauth_token')
+    if returned and returned not in parse_qs(content).get('oauth_token', []):
+        raise CSRFError('CSRF Validation check failed. The request token '
+                        'was not issued to this browser')
+    return content
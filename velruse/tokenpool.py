@@ -0,0 +1,137 @@
+"""Pools of pre-fetched OAuth1 request tokens"""
+from collections import deque
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class RequestTokenPool(object):
+    """Keep unused OAuth1 request tokens ready for upcoming logins.
+
+    A login normally has to fetch a request token from the provider before
+    it can redirect the user. With a pool, :meth:`get` hands out a token
+    fetched ahead of time by a background thread, which keeps up to
+    ``size`` tokens per callback URL. Tokens older than ``ttl`` seconds are
+    discarded unused, so ``ttl`` should be shorter than the lifetime the
+    provider grants request tokens.
+
+    Callback URLs are derived from the request's ``Host`` header, so only
+    the first ``max_urls`` URLs seen are pooled. A URL no login asked for
+    in ``idle`` seconds (``ttl`` by default) is dropped to make room for
+    another one. Logins for URLs that are not pooled fetch their own token.
+
+    ``fetch`` is called with a callback URL and must return the raw
+    request token response (``oauth_token=...&oauth_token_secret=...``).
+
+    The refill thread is only started on first use, so pools created at
+    configuration time are safe to use with forking servers.
+
+    """
+    def __init__(self, fetch, size=5, ttl=300, name=None, max_urls=1,
+                 idle=None, clock=time.time):
+        self.fetch = fetch
+        self.size = size
+        self.ttl = ttl
+        self.name = name
+        self.max_urls = max_urls
+        self.idle = ttl if idle is None else idle
+        self.clock = clock
+
+        self.tokens = {}
+        self.last_used = OrderedDict()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, callback_url):
+        """Return a pre-fetched token for ``callback_url``, or ``None`` if
+        none is available and the caller must fetch one itself"""
+        now = self.clock()
+        token = None
+        with self.lock:
+            tokens = self._track(callback_url, now)
+            while tokens:
+                expires, candidate = tokens.popleft()
+                if expires > now:
+                    token = candidate
+                    break
+            if token is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._start()
+        self.wakeup.set()
+        return token
+
+    def _track(self, callback_url, now):
+        # least recently used first
+        for url, used in list(self.last_used.items()):
+            if used > now - self.idle:
+                break
+            del self.last_used[url]
+            del self.tokens[url]
+        if callback_url not in self.tokens:
+            if len(self.tokens) >= self.max_urls:
+                return None
+            self.tokens[callback_url] = deque()
+        self.last_used.pop(callback_url, None)
+        self.last_used[callback_url] = now
+        return self.tokens[callback_url]
+
+    def refill(self):
+        """Top up the pool of every callback URL being pooled"""
+        with self.lock:
+            urls = list(self.tokens)
+        for url in urls:
+            self._prune(url)
+            while self._missing(url):
+                try:
+                    token = self.fetch(url)
+                except Exception:
+                    log.warning('request token pool %s: could not fetch a '
+                                'token for %s', self.name, url, exc_info=True)
+                    return False
+                with self.lock:
+                    tokens = self.tokens.get(url)
+                    if tokens is None:
+                        # dropped while fetching
+                        break
+                    tokens.append((self.clock() + self.ttl, token))
+        return True
+
+    def _missing(self, url):
+        with self.lock:
+            return url in self.tokens and len(self.tokens[url]) < self.size
+
+    def _prune(self, url):
+        now = self.clock()
+        with self.lock:
+            tokens = self.tokens.get(url, ())
+            while tokens and tokens[0][0] <= now:
+                tokens.popleft()
+
+    def _start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            # wake up on demand, or in time to replace expiring tokens
+            self.wakeup.wait(self.ttl / 2.0)
+            self.wakeup.clear()
+            failures = 0
+            while not self.refill():
+                # back off while the provider is failing
+                failures += 1
+                time.sleep(min(2 ** failures, self.ttl / 2.0))
@@ -0,0 +1,582 @@
+"""Pooled HTTP transport used by providers to talk to upstream services"""
+import logging
+import Queue
+import random
+import sys
+import threading
+import time
+import types
+from urlparse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from velruse.breaker import CircuitBreaker
+from velruse.bulkhead import Bulkhead
+from velruse.hedging import Hedger
+from velruse.exceptions import DeadlineExceeded
+from velruse.exceptions import ResponseTooLarge
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+# largest response body accepted by default, and tighter limits for token
+# endpoints which only ever return a few hundred bytes
+DEFAULT_MAX_RESPONSE_SIZE = 1024 * 1024
+DEFAULT_PHASE_RESPONSE_SIZES = {
+    'access_token': 64 * 1024,
+    'request_token': 64 * 1024,
+    'session': 64 * 1024,
+}
+
+CHUNK_SIZE = 16 * 1024
+
+
+def asbool(value):
+    """Interpret a settings value as a boolean"""
+    if isinstance(value, basestring):
+        return value.strip().lower() in ('true', 'yes', 'on', '1')
+    return bool(value)
+
+
+class Deadline(object):
+    """The time budget shared by every upstream call of one login or
+    callback.
+
+    A ``timeout`` of ``None`` means the budget is unlimited.
+
+    """
+    def __init__(self, timeout=None, clock=time.time):
+        self.timeout = timeout
+        self.clock = clock
+        self.started = clock()
+        if timeout is None:
+            self.expires = None
+        else:
+            self.expires = self.started + timeout
+
+    def remaining(self):
+        """Seconds left in the budget, or ``None`` if it is unlimited"""
+        if self.expires is None:
+            return None
+        return max(self.expires - self.clock(), 0.0)
+
+    @property
+    def expired(self):
+        return self.expires is not None and self.clock() >= self.expires
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+
+class Call(object):
+    """An upstream request yielded by a provider flow.
+
+    Provider flows (``callback_flow``, ``login_flow``) are generators that
+    yield a :class:`Call` whenever they need to talk to the provider and
+    receive the response back from the ``yield`` expression. Anything else
+    they yield is the final result of the flow (an ``HTTPFound``,
+    ``AuthenticationComplete`` or ``AuthenticationDenied``), except for
+    other flows, which are run as sub-flows (see :func:`advance_flow`).
+
+    This keeps the provider logic independent of how the request is
+    executed: :meth:`Transport.run` drives a flow on the calling thread
+    while :func:`velruse.aio.run_flow` drives it on an event loop.
+
+    The response object sent back exposes ``status_code``, ``content``
+    and ``headers``.
+
+    ``idempotent`` marks calls that are safe to repeat, such as profile
+    fetches. Only those are retried on failure; token and code exchanges
+    must never be.
+
+    A ``max_size`` keyword overrides the largest response body, in bytes,
+    accepted for this call.
+
+    """
+    def __init__(self, method, url, deadline=None, phase=None,
+                 idempotent=False, **kw):
+        self.method = method
+        self.url = url
+        self.deadline = deadline
+        self.phase = phase
+        self.idempotent = idempotent
+        self.kw = kw
+
+    def __repr__(self):
+        return '<Call %s %s (%s)>' % (self.method, self.url, self.phase)
+
+
+def advance_flow(flows, value=None, exc_info=None):
+    """Resume a stack of provider flows until one yields a :class:`Call`.
+
+    ``flows`` is the stack of running flows, outermost first. The innermost
+    flow is resumed with ``value`` (or has ``exc_info`` raised into it).
+    A flow may yield another flow to run it as a sub-flow, receiving its
+    result back from the ``yield`` expression; exceptions raised by a
+    sub-flow propagate into its parent.
+
+    Returns the pending :class:`Call`, or the outermost flow's result once
+    ``flows`` is empty.
+
+    """
+    while True:
+        current = flows[-1]
+        try:
+            if exc_info is not None:
+                item = current.throw(*exc_info)
+            else:
+                item = current.send(value)
+        except StopIteration:
+            item = None
+        except Exception:
+            flows.pop()
+            if not flows:
+                raise
+            value, exc_info = None, sys.exc_info()
+            continue
+        value = exc_info = None
+        if isinstance(item, Call):
+            return item
+        if isinstance(item, types.GeneratorType):
+            flows.append(item)
+            continue
+        current.close()
+        flows.pop()
+        if not flows:
+            return item
+        value = item
+
+
+class Transport(object):
+    """A keep-alive HTTP client shared by every callback of a provider.
+
+    Connections are pooled per upstream host, so consecutive token
+    exchanges and profile fetches against the same host reuse an already
+    established TCP+TLS connection instead of opening a new one.
+
+    ``pool_connections`` is the number of upstream hosts to keep pools for
+    and ``pool_maxsize`` the number of idle connections kept per host. When
+    ``pool_block`` is true, callbacks wait for a free connection instead of
+    opening (and discarding) an extra one when a pool is exhausted.
+
+    ``timeout`` is the number of seconds a single login or callback may
+    spend waiting on upstream calls, see :meth:`deadline`.
+
+    ``breaker`` enables a :class:`velruse.breaker.CircuitBreaker` per
+    upstream host when set to a dict of its keyword arguments. Connection
+    errors, timeouts and 5xx responses count as failures.
+
+    ``retries`` is the number of times an idempotent call failing with a
+    connection error or a 5xx response is retried. Attempts are spaced by
+    a random delay of up to ``retry_backoff`` seconds, doubling with every
+    attempt but never exceeding ``retry_backoff_max``, and are abandoned
+    when the delay would not fit in what is left of the deadline.
+
+    ``bulkhead`` caps the number of concurrent upstream calls of the
+    provider when set to a dict of :class:`velruse.bulkhead.Bulkhead`
+    keyword arguments. Time spent waiting for a slot counts against the
+    deadline.
+
+    ``hedge``, a dict of :class:`velruse.hedging.Hedger` keyword arguments,
+    enables hedging of idempotent ``GET`` calls: when one is slower than
+    usual an identical call is sent alongside it and the first successful
+    response wins.
+
+    Response bodies are streamed and abandoned with
+    :class:`velruse.exceptions.ResponseTooLarge` as soon as they grow past
+    ``max_response_size`` bytes. ``max_response_sizes`` maps call phases
+    to tighter (or looser) limits and defaults to
+    ``DEFAULT_PHASE_RESPONSE_SIZES``.
+
+    """
+    def __init__(self,
+                 name=None,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 pool_block=False,
+                 timeout=None,
+                 breaker=None,
+                 retries=0,
+                 retry_backoff=0.1,
+                 retry_backoff_max=2.0,
+                 max_response_size=DEFAULT_MAX_RESPONSE_SIZE,
+                 max_response_sizes=None,
+                 bulkhead=None,
+                 hedge=None):
+        self.name = name
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+        self.breaker = breaker
+        self.breakers = {}
+        self.breakers_lock = threading.Lock()
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.max_response_size = max_response_size
+        self.bulkhead = None
+        if bulkhead is not None:
+            self.bulkhead = Bulkhead(name=name, **bulkhead)
+        self.hedger = None
+        if hedge is not None:
+            self.hedger = Hedger(**hedge)
+        self.max_response_sizes = dict(DEFAULT_PHASE_RESPONSE_SIZES)
+        if max_response_sizes:
+            self.max_response_sizes.update(max_response_sizes)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def deadline(self):
+        """Start the time budget for a new login or callback.
+
+        The returned :class:`Deadline` should be passed to every upstream
+        call made while handling the request so they all draw from the same
+        budget.
+
+        """
+        return Deadline(self.timeout)
+
+    def request(self, method, url, deadline=None, phase=None,
+                idempotent=False, **kw):
+        """Issue an upstream request, returning a ``requests`` response.
+
+        When a ``deadline`` is given the call is bounded by whatever is
+        left of it and :class:`velruse.exceptions.DeadlineExceeded` is
+        raised, tagged with ``phase``, once it runs out.
+
+        Calls flagged ``idempotent`` are retried as configured by
+        ``retries``.
+
+        """
+        attempt = 0
+        while True:
+            retry = idempotent and attempt < self.retries
+            try:
+                if (idempotent and method == 'GET' and
+                        self.hedger is not None):
+                    response = self._hedged_attempt(method, url, deadline,
+                                                    phase, kw)
+                else:
+                    response = self._attempt(method, url, deadline, phase,
+                                             dict(kw))
+            except requests.ConnectionError:
+                if not (retry and self._backoff(attempt, deadline)):
+                    raise
+            else:
+                if not (retry and response.status_code >= 500 and
+                        self._backoff(attempt, deadline)):
+                    return response
+            attempt += 1
+            log.info('provider %s: retrying "%s" call to %s (attempt %d)',
+                     self.name, phase, url, attempt + 1)
+
+    def _backoff(self, attempt, deadline):
+        """Sleep before the next attempt, returning ``False`` instead if
+        the delay would not fit within ``deadline``"""
+        delay = random.uniform(0, min(self.retry_backoff_max,
+                                      self.retry_backoff * 2 ** attempt))
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining is not None and delay >= remaining:
+                return False
+        time.sleep(delay)
+        return True
+
+    def _hedged_attempt(self, method, url, deadline, phase, kw):
+        """Make a call, sending a second identical one if the first is
+        slower than the hedger allows, and return the first success"""
+        hedger = self.hedger
+        key = (urlsplit(url).netloc, phase)
+        results = Queue.Queue()
+
+        def attempt():
+            start = time.time()
+            try:
+                response = self._attempt(method, url, deadline, phase,
+                                         dict(kw))
+            except Exception:
+                results.put((None, sys.exc_info()))
+            else:
+                hedger.record(key, time.time() - start)
+                results.put((response, None))
+
+        def spawn():
+            thread = threading.Thread(target=attempt)
+            thread.daemon = True
+            thread.start()
+
+        delay = hedger.delay(key)
+        spawn()
+        pending = 1
+        hedged = delay is None
+        failure = None
+        while pending:
+            try:
+                response, exc_info = results.get(
+                    True, None if hedged else delay)
+            except Queue.Empty:
+                hedged = True
+                if hedger.spend():
+                    log.info('provider %s: hedging "%s" call to %s after '
+                             '%.3fs', self.name, phase, url, delay)
+                    spawn()
+                    pending += 1
+                continue
+            pending -= 1
+            if exc_info is None:
+                return response
+            # a failure before the hedge delay is not worth hedging
+            hedged = True
+            if failure is None:
+                failure = exc_info
+        raise failure[0], failure[1], failure[2]
+
+    def _attempt(self, method, url, deadline, phase, kw):
+        limit = kw.pop('max_size', None) or self.max_size_for(phase)
+        kw['stream'] = True
+        if deadline is not None and deadline.expired:
+            self._overrun(deadline, phase)
+        if self.bulkhead is None:
+            return self._call(method, url, deadline, phase, limit, kw)
+        wait = None
+        if deadline is not None:
+            wait = deadline.remaining()
+        self.bulkhead.acquire(wait)
+        try:
+            return self._call(method, url, deadline, phase, limit, kw)
+        finally:
+            self.bulkhead.release()
+
+    def _call(self, method, url, deadline, phase, limit, kw):
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    self._overrun(deadline, phase)
+                kw.setdefault('timeout', remaining)
+        breaker = self.breaker_for(url)
+        if breaker is not None:
+            breaker.before_call()
+        start = time.time()
+        try:
+            response = self.session.request(method, url, **kw)
+            self._read_body(response, limit, phase, deadline)
+        except DeadlineExceeded:
+            if breaker is not None:
+                breaker.record(False)
+            raise
+        except requests.Timeout:
+            if breaker is not None:
+                breaker.record(False)
+            if deadline is None:
+                raise
+            self._overrun(deadline, phase)
+        except Exception:
+            if breaker is not None:
+                breaker.record(False)
+            # a read timeout while streaming the body surfaces as a
+            # connection error
+            if deadline is not None and deadline.expired:
+                self._overrun(deadline, phase)
+            raise
+        if breaker is not None:
+            breaker.record(response.status_code < 500, time.time() - start)
+        return response
+
+    def max_size_for(self, phase):
+        """Return the largest response body accepted for ``phase``"""
+        return self.max_response_sizes.get(phase, self.max_response_size)
+
+    def _read_body(self, response, limit, phase, deadline=None):
+        """Read the body of a streamed ``response``, giving up once it
+        grows past ``limit`` bytes or ``deadline`` runs out"""
+        length = response.headers.get('content-length')
+        if length is not None and length.isdigit() and int(length) > limit:
+            response.close()
+            self._too_large(limit, phase)
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            # the socket timeout only bounds each read, so a body trickling
+            # in could otherwise outlive the deadline
+            if deadline is not None and deadline.expired:
+                response.close()
+                self._overrun(deadline, phase)
+            size += len(chunk)
+            if size > limit:
+                response.close()
+                self._too_large(limit, phase)
+            chunks.append(chunk)
+        # hand the body over to ``response.content``
+        response._content = ''.join(chunks)
+
+    def _too_large(self, limit, phase):
+        log.warning('provider %s: "%s" response larger than %d bytes',
+                    self.name, phase, limit)
+        raise ResponseTooLarge(
+            'Upstream "%s" response exceeded %d bytes' % (phase, limit),
+            phase=phase, limit=limit)
+
+    def breaker_for(self, url):
+        """Return the circuit breaker guarding the host of ``url``"""
+        if self.breaker is None:
+            return None
+        host = urlsplit(url).netloc
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            with self.breakers_lock:
+                breaker = self.breakers.get(host)
+                if breaker is None:
+                    breaker = CircuitBreaker(name='%s:%s' % (self.name, host),
+                                             **self.breaker)
+                    self.breakers[host] = breaker
+        return breaker
+
+    def _overrun(self, deadline, phase):
+        log.warning('provider %s: %.2fs deadline exceeded during "%s" '
+                    '(%.2fs elapsed)', self.name, deadline.timeout, phase,
+                    deadline.elapsed())
+        raise DeadlineExceeded(
+            'Upstream deadline of %ss exceeded during "%s"' % (
+                deadline.timeout, phase),
+            phase=phase)
+
+    def get(self, url, **kw):
+        return self.request('GET', url, **kw)
+
+    def post(self, url, data=None, **kw):
+        return self.request('POST', url, data=data, **kw)
+
+    def send(self, call):
+        """Execute a :class:`Call` yielded by a provider flow"""
+        return self.request(call.method, call.url, deadline=call.deadline,
+                            phase=call.phase, idempotent=call.idempotent,
+                            **call.kw)
+
+    def run(self, flow):
+        """Drive a provider flow to completion on the calling thread.
+
+        Every :class:`Call` the flow yields is sent through this transport
+        and its response (or exception) is handed back to the flow. The
+        flow's result is returned.
+
+        """
+        flows = [flow]
+        item = advance_flow(flows)
+        while flows:
+            try:
+                response = self.send(item)
+            except Exception:
+                item = advance_flow(flows, exc_info=sys.exc_info())
+            else:
+                item = advance_flow(flows, response)
+        return item
+
+    def preconnect(self, url, timeout=None):
+        """Open a pooled connection to the host of ``url`` ahead of time.
+
+        A ``HEAD`` request is sent to the root of the host and its
+        connection is returned to the pool for the next upstream call.
+
+        """
+        parts = urlsplit(url)
+        response = self.session.head('%s://%s/' % (parts.scheme, parts.netloc),
+                                     timeout=timeout, allow_redirects=False)
+        response.content  # release the connection back into the pool
+        return response
+
+    def close(self):
+        """Drop every pooled connection"""
+        self.session.close()
+
+
+def transport_from_settings(settings, prefix='', name=None):
+    """Build a :class:`Transport` from settings under ``prefix``.
+
+    Supported settings are ``pool_connections``, ``pool_maxsize``,
+    ``pool_block`` and ``timeout`` (in seconds), ``retries``,
+    ``retry_backoff`` and ``retry_backoff_max`` for idempotent calls, and
+    ``max_response_size`` along with ``max_response_size.<phase>`` for
+    per-phase limits.
+
+    Setting ``max_concurrent`` enables a bulkhead, along with
+    ``max_waiting`` and ``wait_timeout``.
+
+    Setting ``hedge`` to true enables hedging, tuned by ``hedge.percentile``,
+    ``hedge.min_samples``, ``hedge.window``, ``hedge.budget`` and
+    ``hedge.min_delay``.
+
+    Setting ``breaker`` to true enables circuit breaking, tuned by
+    ``breaker.failure_rate``, ``breaker.minimum_calls``, ``breaker.window``,
+    ``breaker.reset_timeout``, ``breaker.slow_call`` and
+    ``breaker.half_open_calls``.
+
+    """
+    kw = {}
+    for key in ('pool_connections', 'pool_maxsize'):
+        value = settings.get(prefix + key)
+        if value is not None:
+            kw[key] = int(value)
+    value = settings.get(prefix + 'pool_block')
+    if value is not None:
+        kw['pool_block'] = asbool(value)
+    kw.update(_options(settings, prefix, dict(
+        timeout=float,
+        retries=int,
+        retry_backoff=float,
+        retry_backoff_max=float,
+    )))
+    value = settings.get(prefix + 'max_response_size')
+    if value is not None:
+        kw['max_response_size'] = int(value)
+    sizes_prefix = prefix + 'max_response_size.'
+    sizes = dict((key[len(sizes_prefix):], int(value))
+                 for key, value in settings.items()
+                 if key.startswith(sizes_prefix))
+    if sizes:
+        kw['max_response_sizes'] = sizes
+    if settings.get(prefix + 'max_concurrent') is not None:
+        kw['bulkhead'] = _options(settings, prefix, dict(
+            max_concurrent=int,
+            max_waiting=int,
+            wait_timeout=float,
+        ))
+    if asbool(settings.get(prefix + 'hedge', False)):
+        kw['hedge'] = _options(settings, prefix + 'hedge.', dict(
+            percentile=float,
+            min_samples=int,
+            window=int,
+            budget=float,
+            min_delay=float,
+        ))
+    if asbool(settings.get(prefix + 'breaker', False)):
+        kw['breaker'] = _options(settings, prefix + 'breaker.', dict(
+            failure_rate=float,
+            minimum_calls=int,
+            window=int,
+            reset_timeout=float,
+            slow_call=float,
+            half_open_calls=int,
+        ))
+    return Transport(name=name, **kw)
+
+
+def _options(settings, prefix, converters):
+    """Collect and convert the settings named in ``converters`` under
+    ``prefix``"""
+    options = {}
+    for key, convert in converters.items():
+        value = settings.get(prefix + key)
+        if value is not None:
+            options[key] = convert(value)
+    return options
@@ -0,0 +1,104 @@
+"""Pre-resolve and pre-connect to provider hosts at startup"""
+import logging
+import socket
+import threading
+import time
+from urlparse import urlsplit
+
+
+log = logging.getLogger(__name__)
+
+
+def upstream_hosts(providers):
+    """Return ``(provider_name, base_url)`` pairs for every distinct
+    upstream host listed in the providers' ``upstream_urls``"""
+    seen = set()
+    hosts = []
+    for name in sorted(providers):
+        provider = providers[name]
+        for url in getattr(provider, 'upstream_urls', ()):
+            parts = urlsplit(url)
+            base = '%s://%s/' % (parts.scheme, parts.netloc)
+            if (name, base) not in seen:
+                seen.add((name, base))
+                hosts.append((name, base))
+    return hosts
+
+
+def warm_host(transport, url, timeout=None):
+    """Resolve and connect to the host of ``url``, returning timings"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    stats = {'dns': None, 'connect': None, 'error': None}
+    start = time.time()
+    try:
+        socket.getaddrinfo(parts.hostname, port, 0, socket.SOCK_STREAM)
+        stats['dns'] = time.time() - start
+        if transport is not None:
+            start = time.time()
+            transport.preconnect(url, timeout=timeout)
+            stats['connect'] = time.time() - start
+    except Exception as e:
+        stats['error'] = str(e)
+    return stats
+
+
+def warm_up(registry, timeout=5.0, dns_cache=None, connect=True):
+    """Pre-resolve and pre-connect to the upstream hosts of every provider
+    registered in ``registry``.
+
+    Hosts are warmed in parallel, each bounded by ``timeout`` seconds.
+    When a :class:`velruse.dnscache.DNSCache` is given the hosts are added
+    to it first so the resolutions made here are cached. With ``connect``
+    false the hosts are only resolved.
+
+    The pooled connections opened here belong to the process calling
+    :func:`warm_up`. Servers that load the application before forking
+    workers (``gunicorn --preload``, uWSGI without ``lazy-apps``) would
+    share those sockets between workers, so either warm up after the fork
+    or pass ``connect=False``.
+
+    Failures are logged and otherwise ignored. The timings of every host
+    are logged and stored, keyed by ``(provider_name, base_url)``, in
+    ``registry.velruse_warmup``, which is also returned.
+
+    """
+    providers = getattr(registry, 'velruse_providers', {})
+    transports = getattr(registry, 'velruse_transports', {})
+    hosts = upstream_hosts(providers)
+    if dns_cache is not None:
+        for name, url in hosts:
+            dns_cache.add_host(urlsplit(url).hostname)
+
+    results = {}
+
+    def warm(name, url):
+        transport = transports.get(name) if connect else None
+        results[(name, url)] = warm_host(transport, url, timeout)
+
+    start = time.time()
+    threads = []
+    for name, url in hosts:
+        thread = threading.Thread(target=warm, args=(name, url))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(max(start + timeout - time.time(), 0))
+
+    for name, url in hosts:
+        stats = results.get((name, url))
+        if stats is None:
+            log.warning('provider %s: warm-up of %s timed out', name, url)
+        elif stats['error'] is not None:
+            log.warning('provider %s: warm-up of %s failed: %s',
+                        name, url, stats['error'])
+        else:
+            log.info('provider %s: warmed up %s (dns %.3fs, connect %s)',
+                     name, url, stats['dns'],
+                     '%.3fs' % stats['connect']
+                     if stats['connect'] is not None else 'skipped')
+    log.info('warmed up %d upstream hosts in %.3fs',
+             len(hosts), time.time() - start)
+    registry.velruse_warmup = results
+    return results